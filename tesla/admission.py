@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import time
+
+import actionslog as log
+from tesla.tesla_exception import TeslaException
+
+
+class RejectedConnection(asyncio.Protocol):
+    '''
+    Stands for a Proxy when the server is full: answers with a ready-made
+    response and closes, nothing is parsed nor inspected
+    '''
+
+    def __init__(self, response):
+        '''
+        @param response: bytes whole HTTP response
+        '''
+        self._response = response
+
+    def connection_made(self, transport):
+        transport.write(self._response)
+        transport.close()
+
+    def data_received(self, data):
+        pass
+
+
+class AdmissionControl(object):
+    '''
+    Bounds the work a process takes: at most `max_connections` client
+    connections and `max_in_flight` requests being inspected and proxied.
+
+    A request over the in-flight limit waits in a short FIFO queue, its
+    client is not read meanwhile; when the queue is full, or the request
+    waited `queue_timeout` seconds, it is answered 503 at once. Shedding
+    early keeps the latency of the admitted requests bounded.
+
+    With a `target_latency` the in-flight limit adapts (AIMD): every
+    request faster than the target adds 1/limit to it, a slower one cuts
+    it by `decrease`, at most once per target latency, never below
+    `min_in_flight` nor above `max_in_flight`.
+    '''
+
+    def __init__(self,
+                 max_connections=0,
+                 max_in_flight=0,
+                 queue_size=64,
+                 queue_timeout=1.0,
+                 target_latency=0.0,
+                 min_in_flight=8,
+                 decrease=0.9,
+                 clock=time.monotonic):
+        '''
+        @param max_connections: int client connections, 0 for no limit
+        @param max_in_flight: int requests in progress, 0 for no limit
+        @param queue_size: int requests waiting for an in-flight slot
+        @param queue_timeout: float seconds a request waits for a slot
+        @param target_latency: float seconds from the admission to the end
+            of the response the in-flight limit is tuned for, 0 keeps the
+            limit fixed
+        @param min_in_flight: int lowest adaptive limit
+        @param decrease: float factor applied to the limit when a request
+            is slower than the target
+        @param clock: callable() -> float seconds
+        '''
+        if max_connections < 0 or max_in_flight < 0 or queue_size < 0:
+            raise TeslaException('Admission limits should not be negative')
+        if target_latency and not max_in_flight:
+            raise TeslaException(
+                'The adaptive limit needs a max in-flight limit')
+
+        self._max_connections = max_connections
+        self._max_in_flight = max_in_flight
+        self._queue_size = queue_size
+        self._queue_timeout = queue_timeout
+        self._target_latency = target_latency
+        self._min_in_flight = min(min_in_flight, max_in_flight)
+        self._decrease = decrease
+        self._clock = clock
+
+        self._limit = float(max_in_flight)
+        self._last_decrease = 0.0
+        self._connections = 0
+        self._in_flight = 0
+        # Waiting requests: [callback, timer handle]
+        self._queue = collections.deque()
+
+        self.rejected_connections = 0
+        self.rejected_requests = 0
+        self.queued = 0
+
+    @property
+    def connections(self):
+        return self._connections
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def limit(self):
+        '''
+        :return int current in-flight limit, 0 for no limit
+        '''
+        return int(self._limit)
+
+    def stats(self):
+        '''
+        :return dict current connections, requests and limit, requests
+            queued and rejected connections and requests
+        '''
+        return {
+            'connections': self._connections,
+            'in_flight': self._in_flight,
+            'limit': self.limit,
+            'waiting': len(self._queue),
+            'queued': self.queued,
+            'rejected_connections': self.rejected_connections,
+            'rejected_requests': self.rejected_requests,
+        }
+
+    def accepts_connection(self):
+        '''
+        Checked before a Proxy is created for a new connection
+        :return bool False if the connection should be rejected
+        '''
+        if self._max_connections and \
+                self._connections >= self._max_connections:
+            self.rejected_connections += 1
+            return False
+        return True
+
+    def connection_opened(self):
+        self._connections += 1
+
+    def connection_closed(self):
+        self._connections -= 1
+
+    def acquire(self, on_admitted, on_rejected):
+        '''
+        Ask for an in-flight slot
+        @param on_admitted: callable() called when a queued request gets its
+            slot
+        @param on_rejected: callable() called when a queued request timed out
+        :return True if admitted now, None if queued, False if rejected
+        '''
+        if not self._limit or self._in_flight < self._limit:
+            self._in_flight += 1
+            return True
+
+        if len(self._queue) >= self._queue_size:
+            self.rejected_requests += 1
+            return False
+
+        waiter = [on_admitted, None]
+        if self._queue_timeout:
+            waiter[1] = asyncio.get_event_loop().call_later(
+                self._queue_timeout, self._expire, waiter, on_rejected)
+        self._queue.append(waiter)
+        self.queued += 1
+        return None
+
+    def cancel(self, on_admitted):
+        '''
+        Forget a queued request, its client left
+        '''
+        for waiter in self._queue:
+            if waiter[0] == on_admitted:
+                self._queue.remove(waiter)
+                if waiter[1] is not None:
+                    waiter[1].cancel()
+                return
+
+    def release(self, latency=None):
+        '''
+        Give an in-flight slot back
+        @param latency: float seconds the request took, None if it did not
+            complete
+        '''
+        if latency is not None and self._target_latency:
+            self._adapt(latency)
+
+        self._in_flight -= 1
+        while self._queue and self._in_flight < self._limit:
+            on_admitted, handle = self._queue.popleft()
+            if handle is not None:
+                handle.cancel()
+            self._in_flight += 1
+            on_admitted()
+
+    def _expire(self, waiter, on_rejected):
+        if waiter in self._queue:
+            self._queue.remove(waiter)
+            self.rejected_requests += 1
+            on_rejected()
+
+    def _adapt(self, latency):
+        if latency <= self._target_latency:
+            self._limit = min(float(self._max_in_flight),
+                              self._limit + 1.0 / self._limit)
+            return
+
+        now = self._clock()
+        if now - self._last_decrease < self._target_latency:
+            # One cut per round of slow requests
+            return
+        self._last_decrease = now
+        limit = max(float(self._min_in_flight), self._limit * self._decrease)
+        if int(limit) != int(self._limit):
+            log.info(
+                'In-flight limit lowered',
+                limit=int(limit),
+                latency=round(latency, 3))
+        self._limit = limit
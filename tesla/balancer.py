@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import itertools
+import time
+
+import actionslog as log
+from tesla.proxy import ProxyTarget
+from tesla.tesla_exception import TeslaException
+
+
+class Backend(object):
+    '''
+    An endpoint of a target and what the balancer knows about it
+    '''
+
+    def __init__(self, host, port):
+        '''
+        @param host: str host to connect to
+        @param port: int port to connect to
+        '''
+        self.host = host
+        self.port = port
+        # Connections handed to the proxies and not given back yet
+        self.active = 0
+        # Moving average of the seconds to the response head, None until
+        # the first response
+        self.latency = None
+        self.fails = 0
+        self.healthy = True
+        self.ejected_until = 0.0
+
+    @classmethod
+    def parse(cls, address):
+        '''
+        @param address: str `host:port`, `[v6]:port` for IPv6
+        :return Backend
+        '''
+        host, sep, port = address.rpartition(':')
+        if not sep or not host or not port.isdigit():
+            raise TeslaException('Invalid backend address "%s"' % address)
+        return cls(host.strip('[]'), int(port))
+
+    def available(self, now):
+        return self.healthy and now >= self.ejected_until
+
+    def __repr__(self):
+        return '%s:%d' % (self.host, self.port)
+
+
+class Balancer(object):
+    '''
+    Spreads the connections of a target over its backends.
+
+    `round-robin` takes the backends in turn, `least-conn` the one with the
+    fewest connections in use and `ewma` the one with the lowest moving
+    average of the response latency, weighted by its connections in use so
+    a backend getting slow stops attracting the traffic.
+
+    A backend is ejected for `fail_timeout` seconds after `max_fails`
+    connect failures in a row, and while the background health check can
+    not connect to it. When no backend is left all of them are tried, it is
+    better than failing every request. A failed connect is retried on
+    another backend, nothing was sent yet.
+    '''
+
+    ROUND_ROBIN = 'round-robin'
+    LEAST_CONN = 'least-conn'
+    EWMA = 'ewma'
+    POLICIES = (ROUND_ROBIN, LEAST_CONN, EWMA)
+
+    def __init__(self,
+                 backends,
+                 policy=ROUND_ROBIN,
+                 retries=2,
+                 connect_timeout=5.0,
+                 max_fails=3,
+                 fail_timeout=30.0,
+                 health_check_interval=5.0,
+                 health_check_timeout=2.0,
+                 ewma_alpha=0.3):
+        '''
+        @param backends: list(Backend)
+        @param policy: str one of POLICIES
+        @param retries: int other backends tried after a connect failure
+        @param connect_timeout: float seconds to connect to a backend
+        @param max_fails: int connect failures in a row ejecting a backend
+        @param fail_timeout: float seconds a failing backend is ejected
+        @param health_check_interval: float seconds between two health
+            checks, 0 disables them
+        @param health_check_timeout: float seconds for a health check to
+            connect
+        @param ewma_alpha: float weight of the last latency in its average
+        '''
+        if not backends:
+            raise TeslaException('A balancer needs at least one backend')
+        if policy not in self.POLICIES:
+            raise TeslaException('Unknown balancing policy "%s"' % policy)
+
+        self._backends = list(backends)
+        self._policy = policy
+        self._retries = retries
+        self._connect_timeout = connect_timeout
+        self._max_fails = max_fails
+        self._fail_timeout = fail_timeout
+        self._health_check_interval = health_check_interval
+        self._health_check_timeout = health_check_timeout
+        self._ewma_alpha = ewma_alpha
+
+        self._next = itertools.count()
+        self._task = None
+
+        self._choose = {
+            self.ROUND_ROBIN: self._choose_round_robin,
+            self.LEAST_CONN: self._choose_least_conn,
+            self.EWMA: self._choose_ewma,
+        }[policy]
+
+    @property
+    def backends(self):
+        return list(self._backends)
+
+    @property
+    def policy(self):
+        return self._policy
+
+    def stats(self):
+        '''
+        :return list(dict) state of each backend
+        '''
+        now = time.monotonic()
+        return [{
+            'backend': repr(b),
+            'active': b.active,
+            'latency': b.latency,
+            'available': b.available(now),
+        } for b in self._backends]
+
+    def start(self, loop=None):
+        '''
+        Start the health checks in the event loop of this process
+        '''
+        if self._task is not None or not self._health_check_interval:
+            return
+        loop = loop or asyncio.get_event_loop()
+        self._task = loop.create_task(self._check_periodically())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def choose(self, exclude=()):
+        '''
+        @param exclude: collection(Backend) backends already tried
+        :return Backend|None None if every backend was excluded
+        '''
+        now = time.monotonic()
+        candidates = [
+            b for b in self._backends
+            if b not in exclude and b.available(now)
+        ]
+        if not candidates:
+            # Fail open: an ejected backend may be back already
+            candidates = [b for b in self._backends if b not in exclude]
+        if not candidates:
+            return None
+        return self._choose(candidates)
+
+    async def connect(self, parent, pool=None):
+        '''
+        Connect `parent` to a backend, trying another one when the connect
+        fails. The backend is counted as active until `release`
+        @param parent: Proxy that will receive the target events
+        @param pool: UpstreamPool of the connections, None for a new one
+        :return tuple(Backend, ProxyTarget)
+        '''
+        tried = []
+        loop = asyncio.get_event_loop()
+        while True:
+            backend = self.choose(tried)
+            if backend is None:
+                raise last_error
+            tried.append(backend)
+
+            try:
+                if pool is not None:
+                    # A full pool is waited for, it is not a backend failure
+                    result = await pool.acquire(
+                        backend.host, backend.port, parent,
+                        connect_timeout=self._connect_timeout)
+                else:
+                    result = await asyncio.wait_for(
+                        loop.create_connection(lambda: ProxyTarget(parent),
+                                               backend.host, backend.port),
+                        self._connect_timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                last_error = e
+                self._failed(backend, e)
+                if len(tried) > self._retries:
+                    raise
+                continue
+
+            backend.fails = 0
+            backend.active += 1
+            target = result if pool is not None else result[1]
+            return backend, target
+
+    def release(self, backend):
+        '''
+        The connection to `backend` is not used anymore
+        '''
+        backend.active -= 1
+
+    def observe(self, backend, latency):
+        '''
+        @param backend: Backend
+        @param latency: float seconds from the request to the response head
+        '''
+        if backend.latency is None:
+            backend.latency = latency
+        else:
+            backend.latency += self._ewma_alpha * (latency - backend.latency)
+
+    def _choose_round_robin(self, candidates):
+        return candidates[next(self._next) % len(candidates)]
+
+    def _choose_least_conn(self, candidates):
+        # Ties go round-robin, not always to the first backend
+        start = next(self._next) % len(candidates)
+        ordered = candidates[start:] + candidates[:start]
+        return min(ordered, key=lambda b: b.active)
+
+    def _choose_ewma(self, candidates):
+        def cost(backend):
+            if backend.latency is None:
+                # Unknown yet, give it a try
+                return -1.0
+            return backend.latency * (backend.active + 1)
+
+        start = next(self._next) % len(candidates)
+        ordered = candidates[start:] + candidates[:start]
+        return min(ordered, key=cost)
+
+    def _failed(self, backend, e):
+        backend.fails += 1
+        log.warn(
+            'Could not connect to backend',
+            backend=repr(backend),
+            fails=backend.fails,
+            reason=e)
+        if backend.fails >= self._max_fails:
+            backend.ejected_until = time.monotonic() + self._fail_timeout
+            log.warn(
+                'Backend ejected',
+                backend=repr(backend),
+                seconds=self._fail_timeout)
+
+    async def _check_periodically(self):
+        while True:
+            await asyncio.sleep(self._health_check_interval)
+            await self.check()
+
+    async def check(self):
+        '''
+        Health check every backend at once
+        '''
+        results = await asyncio.gather(
+            *[self._check(b) for b in self._backends])
+        for backend, healthy in zip(self._backends, results):
+            if healthy != backend.healthy:
+                log.warn(
+                    'Backend is up' if healthy else 'Backend is down',
+                    backend=repr(backend))
+            backend.healthy = healthy
+            if healthy:
+                backend.fails = 0
+                backend.ejected_until = 0.0
+
+    async def _check(self, backend):
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(backend.host, backend.port),
+                self._health_check_timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import tempfile
+
+
+class BodySpool(object):
+    '''
+    Request body held until ModSecurity gives its verdict.
+    Bodies larger than `max_memory` are spilled to a temporary file.
+    '''
+
+    def __init__(self, max_memory=64 * 1024, tmp_dir=None):
+        '''
+        @param max_memory: int bytes kept in memory before spilling to disk
+        @param tmp_dir: str directory of the temporary file, if None the
+            system default is used
+        '''
+        self._max_memory = max_memory
+        self._file = tempfile.SpooledTemporaryFile(
+            max_size=max_memory, dir=tmp_dir)
+        self._length = 0
+        self._reading = False
+
+    @property
+    def length(self):
+        return self._length
+
+    @property
+    def spilled(self):
+        return self._length > self._max_memory
+
+    def write(self, data):
+        if self._reading:
+            raise IOError('BodySpool is already being read')
+
+        self._length += len(data)
+        return self._file.write(data)
+
+    def read(self, size=64 * 1024):
+        '''
+        Read the body from its beginning, `write` can not be called anymore
+        :return bytes up to `size` bytes, empty once the body was read
+        '''
+        if not self._reading:
+            self._reading = True
+            self._file.seek(0)
+
+        return self._file.read(size)
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+import base64
+import gzip
+import http.client
+import json
+import random
+import ssl
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import actionslog as log
+from tesla.tesla_exception import TeslaException
+
+
+class BulkExportError(TeslaException):
+    def __init__(self, message, status=None, retryable=True):
+        super(BulkExportError, self).__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class BulkExporter(object):
+    '''
+    Ships documents to Elasticsearch with the `_bulk` API.
+
+    Documents are batched and a batch is sent when it holds `max_docs`
+    documents or `max_bytes` bytes, or when its oldest document waited
+    `flush_interval` seconds. At most `max_in_flight` batches are being sent
+    at once; `add` blocks when the window is full, which slows the producer
+    down instead of queueing without bound.
+
+    Failed batches are retried with an exponential backoff. When only some
+    documents of a batch fail, only the retryable ones (429, 5xx) are sent
+    again. Documents rejected by Elasticsearch, one by one or with their
+    whole batch (400, 413...), are dropped: sending them again would fail
+    the same way. Documents of batches that could not be sent at all, the
+    retries exhausted, are reported by `flush`, so the caller can send them
+    again later.
+    '''
+
+    RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+    def __init__(self,
+                 host,
+                 port,
+                 index='modsecurity_logs',
+                 doc_type='modsecurity',
+                 user=None,
+                 secret=None,
+                 max_docs=500,
+                 max_bytes=5 * 1024 * 1024,
+                 flush_interval=1.0,
+                 max_retries=5,
+                 backoff=0.5,
+                 max_backoff=30.0,
+                 compress=False,
+                 max_in_flight=2,
+                 timeout=10.0,
+                 ca_file=None):
+        '''
+        @param host: str Elasticsearch host, or its URL: `https://host`
+            connects with TLS
+        @param port: int Elasticsearch port, a port in the URL wins
+        @param index: str index of the documents
+        @param doc_type: str type of the documents, None for Elasticsearch
+            7 and later
+        @param user: str basic auth user, None disables authentication
+        @param secret: str basic auth password
+        @param max_docs: int documents per batch
+        @param max_bytes: int bytes per batch
+        @param flush_interval: float seconds a document waits for its batch
+            to fill up, 0 disables the time threshold
+        @param max_retries: int times a batch is sent again before its
+            documents are dropped
+        @param backoff: float seconds before the first retry, doubled on
+            every retry
+        @param max_backoff: float max seconds between retries
+        @param compress: bool gzip the request bodies
+        @param max_in_flight: int batches sent at the same time
+        @param timeout: float seconds to wait for Elasticsearch
+        @param ca_file: str CA bundle the https certificate is checked
+            against, None for the system ones
+        '''
+        self._ssl_context = None
+        if '://' in host:
+            url = urllib.parse.urlsplit(host)
+            if url.scheme not in ('http', 'https'):
+                raise TeslaException(
+                    'Unsupported Elasticsearch scheme "%s"' % url.scheme)
+            if url.scheme == 'https':
+                self._ssl_context = ssl.create_default_context(
+                    cafile=ca_file)
+            host = url.hostname
+            port = url.port or port
+        self._host = host
+        self._port = port
+        self._max_docs = max_docs
+        self._max_bytes = max_bytes
+        self._flush_interval = flush_interval
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._compress = compress
+        self._timeout = timeout
+
+        action = {'_index': index}
+        if doc_type is not None:
+            action['_type'] = doc_type
+        self._action = (json.dumps({'index': action}) + '\n').encode('utf-8')
+
+        self._headers = {'Content-Type': 'application/x-ndjson'}
+        if compress:
+            self._headers['Content-Encoding'] = 'gzip'
+        if user is not None:
+            credentials = '%s:%s' % (user, secret or '')
+            self._headers['Authorization'] = 'Basic ' + base64.b64encode(
+                credentials.encode('utf-8')).decode('ascii')
+
+        self._lock = threading.Condition()
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_started = None
+        self._closed = False
+        # Documents of failed batches since the last flush(wait=True)
+        self._unshipped = 0
+
+        self._max_in_flight = max_in_flight
+        self._window = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._local = threading.local()
+
+        self._stats = {
+            'docs': 0,
+            'sent': 0,
+            'failed': 0,
+            'batches': 0,
+            'retries': 0,
+        }
+
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, daemon=True)
+            self._flusher.start()
+
+    def stats(self):
+        '''
+        :return dict documents added, sent and failed, batches sent and
+            retries
+        '''
+        with self._lock:
+            return dict(self._stats)
+
+    def add(self, doc):
+        '''
+        Queue a document, blocks while the in-flight window is full
+        @param doc: str|bytes|dict JSON document
+        '''
+        if isinstance(doc, dict):
+            doc = json.dumps(doc)
+        if isinstance(doc, str):
+            doc = doc.encode('utf-8')
+
+        with self._lock:
+            if self._closed:
+                raise TeslaException('BulkExporter is closed')
+
+            if not self._batch:
+                self._batch_started = time.monotonic()
+            self._batch.append(doc)
+            self._batch_bytes += len(self._action) + len(doc) + 1
+            self._stats['docs'] += 1
+
+            if len(self._batch) < self._max_docs and \
+                    self._batch_bytes < self._max_bytes:
+                return
+            batch = self._take_batch()
+
+        self._submit(batch)
+
+    def flush(self, wait=False):
+        '''
+        Send the current batch
+        @param wait: bool wait until every batch was sent
+        :return int documents that could not be sent since the previous
+            flush(wait=True), always 0 without `wait`
+        '''
+        with self._lock:
+            batch = self._take_batch()
+
+        if batch:
+            self._submit(batch)
+        if not wait:
+            return 0
+
+        self._wait()
+        with self._lock:
+            unshipped = self._unshipped
+            self._unshipped = 0
+        return unshipped
+
+    def close(self):
+        '''
+        Send what is left and stop
+        '''
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._lock.notify_all()
+
+        self.flush(wait=True)
+        self._executor.shutdown(wait=True)
+        if self._flusher is not None:
+            self._flusher.join()
+
+    def _take_batch(self):
+        batch = self._batch
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_started = None
+        return batch
+
+    def _submit(self, batch):
+        # Blocks the producer while max_in_flight batches are being sent
+        self._window.acquire()
+        try:
+            future = self._executor.submit(self._send_batch, batch)
+        except Exception:
+            self._window.release()
+            raise
+        future.add_done_callback(lambda f: self._window.release())
+
+    def _wait(self):
+        # Every slot of the window is free once all the batches are done
+        for _ in range(self._max_in_flight):
+            self._window.acquire()
+        for _ in range(self._max_in_flight):
+            self._window.release()
+
+    def _flush_periodically(self):
+        with self._lock:
+            while not self._closed:
+                timeout = self._flush_interval
+                if self._batch_started is not None:
+                    timeout = self._batch_started + self._flush_interval - \
+                        time.monotonic()
+
+                if timeout > 0:
+                    self._lock.wait(timeout)
+                    continue
+
+                batch = self._take_batch()
+                self._lock.release()
+                try:
+                    self._submit(batch)
+                finally:
+                    self._lock.acquire()
+
+    def _send_batch(self, batch):
+        retries = 0
+        while batch:
+            try:
+                batch = self._post(batch)
+            except (BulkExportError, OSError, ValueError,
+                    http.client.HTTPException) as e:
+                if isinstance(e, BulkExportError) and not e.retryable:
+                    self._count_failed(batch, e, unshipped=False)
+                    return
+                if retries >= self._max_retries:
+                    self._count_failed(batch, e)
+                    return
+            else:
+                if not batch:
+                    return
+                if retries >= self._max_retries:
+                    self._count_failed(
+                        batch, BulkExportError('Documents rejected'))
+                    return
+
+            delay = min(self._max_backoff, self._backoff * 2**retries)
+            # Jitter keeps the workers from retrying all at once
+            time.sleep(delay * (0.5 + random.random() / 2))
+            retries += 1
+            with self._lock:
+                self._stats['retries'] += 1
+
+    def _post(self, batch):
+        '''
+        :return list(bytes) documents of `batch` to send again
+        '''
+        body = b''.join(self._action + doc + b'\n' for doc in batch)
+        if self._compress:
+            body = gzip.compress(body, compresslevel=5)
+
+        connection = self._connection()
+        try:
+            connection.request('POST', '/_bulk', body, self._headers)
+            response = connection.getresponse()
+            data = response.read()
+        except Exception:
+            self._drop_connection()
+            raise
+
+        if response.status != 200:
+            self._drop_connection()
+            raise BulkExportError(
+                'Bulk request failed with status %d' % response.status,
+                status=response.status,
+                retryable=response.status in self.RETRY_STATUSES)
+
+        with self._lock:
+            self._stats['batches'] += 1
+
+        result = json.loads(data.decode('utf-8'))
+        if not result.get('errors'):
+            self._count_sent(len(batch))
+            return []
+
+        retry = []
+        failed = 0
+        for doc, item in zip(batch, result.get('items', [])):
+            status = next(iter(item.values())).get('status', 500)
+            if status < 300:
+                continue
+            if status in self.RETRY_STATUSES:
+                retry.append(doc)
+            else:
+                failed += 1
+
+        if failed:
+            log.warn('Elasticsearch rejected documents', count=failed)
+        with self._lock:
+            self._stats['failed'] += failed
+        self._count_sent(len(batch) - len(retry) - failed)
+        return retry
+
+    def _connection(self):
+        # One keep-alive connection per sending thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self._ssl_context is not None:
+                connection = http.client.HTTPSConnection(
+                    self._host,
+                    self._port,
+                    timeout=self._timeout,
+                    context=self._ssl_context)
+            else:
+                connection = http.client.HTTPConnection(
+                    self._host, self._port, timeout=self._timeout)
+            self._local.connection = connection
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _count_sent(self, count):
+        with self._lock:
+            self._stats['sent'] += count
+
+    def _count_failed(self, batch, e, unshipped=True):
+        '''
+        @param unshipped: bool False if the documents are dropped for good,
+            they are not reported by `flush`
+        '''
+        log.error(e, documents=len(batch), dropped=not unshipped)
+        with self._lock:
+            self._stats['failed'] += len(batch)
+            if unshipped:
+                self._unshipped += len(batch)
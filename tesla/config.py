@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import toml as tomllib
+
+from tesla.auto_property import autoproperty
+from tesla.tesla_exception import TeslaException
+
+
+@autoproperty(name='')
+@autoproperty(host='')
+@autoproperty(port=0)
+@autoproperty(backends=None)
+@autoproperty(balance='round-robin')
+@autoproperty(health_check_interval=5.0)
+class Target(object):
+    def __init__(self,
+                 name,
+                 host,
+                 port,
+                 backends=None,
+                 balance='round-robin',
+                 health_check_interval=5.0):
+        '''
+        @param name: str name of the target, `[target.<name>]`
+        @param host: str host to connect to
+        @param port: int port to connect to
+        @param backends: list(str) `host:port` endpoints the connections are
+            balanced over, None to only use `host:port`
+        @param balance: str balancing policy of the backends
+        @param health_check_interval: float seconds between two health
+            checks of the backends, 0 disables them
+        '''
+        self.name = name
+        self.host = host
+        self.port = port
+        self.backends = backends
+        self.balance = balance
+        self.health_check_interval = health_check_interval
+
+
+@autoproperty(name='')
+@autoproperty(host='0.0.0.0')
+@autoproperty(port=0)
+@autoproperty(target=None)
+@autoproperty(ssl=False)
+@autoproperty(cert='')
+@autoproperty(key='')
+class Listener(object):
+    def __init__(self, name, host, port, target, ssl=False, cert='', key=''):
+        '''
+        @param name: str name of the listener, `[server.<name>]`
+        @param host: str host to bind
+        @param port: int port to bind
+        @param target: Target where the requests go
+        @param ssl: bool if the listener uses TLS
+        @param cert: str path to the certificate
+        @param key: str path to the private key
+        '''
+        self.name = name
+        self.host = host
+        self.port = port
+        self.target = target
+        self.ssl = ssl
+        self.cert = cert
+        self.key = key
+
+
+@autoproperty(name='')
+@autoproperty(hosts=None)
+@autoproperty(rules=None)
+@autoproperty(target=None)
+@autoproperty(rate_limit=0.0)
+@autoproperty(rate_burst=0.0)
+class VirtualHost(object):
+    def __init__(self,
+                 name,
+                 hosts,
+                 rules=None,
+                 target=None,
+                 rate_limit=0.0,
+                 rate_burst=0.0):
+        '''
+        @param name: str name of the virtual host, `[vhost.<name>]`
+        @param hosts: list(str) host names, `*.example.com` for the
+            subdomains
+        @param rules: str name of its rule set, None for the default rules
+        @param target: Target where its requests go, None for the target of
+            the server
+        @param rate_limit: float requests per second allowed to a client,
+            0 for no limit
+        @param rate_burst: float requests a client may send at once, 0 for
+            `rate_limit`
+        '''
+        self.name = name
+        self.hosts = hosts
+        self.rules = rules
+        self.target = target
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+
+
+class Config(object):
+    '''
+    Listeners and targets of a Tesla process, read from a TOML file:
+
+        [server.https]
+        port=8083
+        host="0.0.0.0"
+        target="local"
+        ssl=true
+        cert="etc/selfsigned.cert"
+        key="etc/selfsigned.key"
+
+        [target.local]
+        host="localhost"
+        port=8090
+
+        [target.app]
+        backends=["10.0.0.1:8080", "10.0.0.2:8080"]
+        balance="ewma"  # round-robin, least-conn or ewma
+        health_check_interval=5.0
+
+        [rules.api]
+        files=["etc/modsecurity.conf", "etc/api-rules/*.conf"]
+
+        [vhost.api]
+        hosts=["api.example.com", "*.api.example.com"]
+        rules="api"
+        target="app"
+        rate_limit=20.0  # requests per second and client
+        rate_burst=40.0
+
+    A server without `target` goes to the default target, the destination
+    given in the command line. Requests are routed to a virtual host by
+    their Host header, a virtual host without `rules` or `target` uses the
+    rules given in the command line or the target of the server.
+    '''
+
+    def __init__(self, listeners=None, targets=None, rule_sets=None,
+                 vhosts=None):
+        '''
+        @param listeners: list(Listener)
+        @param targets: dict name: Target
+        @param rule_sets: dict name: list(str) glob patterns of the rule
+            files
+        @param vhosts: list(VirtualHost)
+        '''
+        self._listeners = listeners or []
+        self._targets = targets or {}
+        self._rule_sets = rule_sets or {}
+        self._vhosts = vhosts or []
+
+    @property
+    def listeners(self):
+        return list(self._listeners)
+
+    @property
+    def targets(self):
+        return dict(self._targets)
+
+    @property
+    def rule_sets(self):
+        return dict(self._rule_sets)
+
+    @property
+    def vhosts(self):
+        return list(self._vhosts)
+
+    @classmethod
+    def load(cls, path, default_target=None):
+        '''
+        @param path: str path of the TOML file
+        @param default_target: Target of the servers without `target`
+        :return Config
+        '''
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = tomllib.loads(f.read())
+        except OSError as e:
+            raise TeslaException('Could not read "%s": %s' % (path, e))
+        except ValueError as e:
+            # TOMLDecodeError of both parsers is a ValueError
+            raise TeslaException('Invalid config "%s": %s' % (path, e))
+        return cls.from_dict(data, default_target)
+
+    @classmethod
+    def from_dict(cls, data, default_target=None):
+        '''
+        @param data: dict parsed TOML document
+        @param default_target: Target of the servers without `target`
+        :return Config
+        '''
+        targets = {}
+        for name, section in cls._sections(data, 'target').items():
+            targets[name] = cls._target(name, section)
+
+        listeners = []
+        for name, section in cls._sections(data, 'server').items():
+            target_name = section.get('target')
+            if target_name is None:
+                target = default_target
+            else:
+                target = targets.get(target_name)
+            if target is None:
+                raise TeslaException(
+                    'Server "%s": unknown target "%s"' % (name, target_name))
+
+            use_ssl = bool(section.get('ssl', False))
+            listener = Listener(
+                name,
+                cls._get(section, 'server', name, 'host', str, '0.0.0.0'),
+                cls._get(section, 'server', name, 'port', int),
+                target,
+                ssl=use_ssl)
+            if use_ssl:
+                listener.cert = cls._get(section, 'server', name, 'cert', str)
+                listener.key = cls._get(section, 'server', name, 'key', str)
+            listeners.append(listener)
+
+        bound = set()
+        for listener in listeners:
+            address = (listener.host, listener.port)
+            if address in bound:
+                raise TeslaException(
+                    'Server "%s": %s:%d is already used' %
+                    (listener.name, listener.host, listener.port))
+            bound.add(address)
+
+        rule_sets = {}
+        for name, section in cls._sections(data, 'rules').items():
+            rule_sets[name] = cls._get_strings(section, 'rules', name, 'files')
+
+        vhosts = []
+        for name, section in cls._sections(data, 'vhost').items():
+            rules = section.get('rules')
+            if rules is not None and rules not in rule_sets:
+                raise TeslaException(
+                    'vhost "%s": unknown rules "%s"' % (name, rules))
+            target = section.get('target')
+            if target is not None:
+                if target not in targets:
+                    raise TeslaException(
+                        'vhost "%s": unknown target "%s"' % (name, target))
+                target = targets[target]
+            vhosts.append(
+                VirtualHost(
+                    name,
+                    cls._get_strings(section, 'vhost', name, 'hosts'),
+                    rules=rules,
+                    target=target,
+                    rate_limit=cls._get_number(section, 'vhost', name,
+                                               'rate_limit', 0.0),
+                    rate_burst=cls._get_number(section, 'vhost', name,
+                                               'rate_burst', 0.0)))
+
+        return cls(listeners, targets, rule_sets, vhosts)
+
+    @classmethod
+    def _target(cls, name, section):
+        backends = section.get('backends')
+        if backends is None:
+            return Target(name, cls._get(section, 'target', name, 'host', str),
+                          cls._get(section, 'target', name, 'port', int))
+
+        backends = cls._get_strings(section, 'target', name, 'backends')
+        host, _, port = backends[0].rpartition(':')
+        if not port.isdigit():
+            raise TeslaException(
+                'target "%s": invalid backend "%s"' % (name, backends[0]))
+
+        # The first backend stands for the target in the logs
+        return Target(
+            name,
+            host.strip('[]'),
+            int(port),
+            backends=backends,
+            balance=cls._get(section, 'target', name, 'balance', str,
+                             'round-robin'),
+            health_check_interval=cls._get_number(
+                section, 'target', name, 'health_check_interval', 5.0))
+
+    @staticmethod
+    def _sections(data, kind):
+        sections = data.get(kind, {})
+        if not isinstance(sections, dict) or \
+                not all(isinstance(s, dict) for s in sections.values()):
+            raise TeslaException(
+                'Expected [%s.<name>] tables in the config' % kind)
+        return sections
+
+    @staticmethod
+    def _get_number(section, kind, name, key, default):
+        value = section.get(key, default)
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or \
+                value < 0:
+            raise TeslaException('%s "%s": "%s" should be a positive number' %
+                                 (kind, name, key))
+        return float(value)
+
+    @staticmethod
+    def _get_strings(section, kind, name, key):
+        values = section.get(key)
+        if not isinstance(values, list) or not values or \
+                not all(isinstance(v, str) for v in values):
+            raise TeslaException(
+                '%s "%s": "%s" should be a list of strings' %
+                (kind, name, key))
+        return values
+
+    @staticmethod
+    def _get(section, kind, name, key, type_, default=None):
+        value = section.get(key, default)
+        if value is None:
+            raise TeslaException('%s "%s": missing "%s"' % (kind, name, key))
+        # bool is an int, `port=true` is still a mistake
+        if not isinstance(value, type_) or isinstance(value, bool):
+            raise TeslaException(
+                '%s "%s": "%s" should be a %s' %
+                (kind, name, key, type_.__name__))
+        return value
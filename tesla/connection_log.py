@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import actionslog as log
+
+
+class ConnectionLog(object):
+    '''
+    Logger of a single proxied connection, cheap enough for the per-packet
+    path. Fields shared by every event (client, target) are bound once and
+    the level checks are plain attributes, so call sites test them before
+    building their own fields:
+
+        if self._log.info_enabled:
+            self._log.info('Request headers completed', url=url)
+
+    Per-chunk events go through `sample()` and only one of every
+    `sample_every` of them is logged.
+    '''
+
+    def __init__(self, sample_every=64, **context):
+        '''
+        @param sample_every: int log one of every `sample_every` per-chunk
+            events, 0 disables them
+        @param context: fields added to every event
+        '''
+        self._sample_every = sample_every
+        self._samples = 0
+        self._context = context
+        self.debug_enabled = False
+        self.info_enabled = False
+        self.refresh()
+
+    @property
+    def context(self):
+        return self._context
+
+    def bind(self, **context):
+        '''
+        Add fields to every following event of this connection
+        '''
+        self._context = dict(self._context, **context)
+
+    def refresh(self):
+        '''
+        Read the logger level again, it is only checked when the connection
+        log is created
+        '''
+        instance = log.get_instance()
+        self.debug_enabled = instance.isEnabledFor(logging.DEBUG)
+        self.info_enabled = instance.isEnabledFor(logging.INFO)
+
+    def sample(self):
+        '''
+        :return True if this per-chunk event must be logged
+        '''
+        if not self._sample_every or not self.info_enabled:
+            return False
+
+        self._samples += 1
+        return (self._samples - 1) % self._sample_every == 0
+
+    def debug(self, msg, **fields):
+        if self.debug_enabled:
+            log.debug(msg, **self._fields(fields))
+
+    def info(self, msg, **fields):
+        if self.info_enabled:
+            log.info(msg, **self._fields(fields))
+
+    def info_sampled(self, msg, **fields):
+        '''
+        Log a per-chunk event already accepted by `sample()`
+        '''
+        fields['sample_every'] = self._sample_every
+        log.info(msg, **self._fields(fields))
+
+    def warn(self, msg, **fields):
+        log.warn(msg, **self._fields(fields))
+
+    def error(self, e, **fields):
+        log.error(e, **self._fields(fields))
+
+    def _fields(self, fields):
+        if not fields:
+            return self._context
+        return dict(self._context, **fields)
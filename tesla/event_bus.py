@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import collections
+import datetime
+import threading
+import time
+
+import actionslog as log
+from tesla.modsec_event import ModSecurityEvent
+
+
+class EventBus(object):
+    '''
+    In-memory path of the ModSecurity events, from the callbacks to the
+    sinks (file, Elasticsearch, stdout).
+
+    `push` only appends a small tuple to a bounded ring buffer, it is safe
+    to call from the event loop. A background thread drains the ring in
+    batches, parses the lines into ModSecurityEvent documents and hands
+    them to every sink. When the ring is full the oldest events are
+    overwritten and counted as `overflow`, events a sink failed to write
+    are counted as `dropped`, as well as the events a sink lost after
+    taking them (its `dropped` property, if any).
+    '''
+
+    def __init__(self, capacity=10000, batch_size=500, flush_interval=0.5,
+                 descriptions=None):
+        '''
+        @param capacity: int events held before the oldest are overwritten
+        @param batch_size: int events handed to the sinks at once
+        @param flush_interval: float max seconds an event waits in the ring
+        @param descriptions: RuleDescriptions attack types of the events,
+            None to leave them out
+        '''
+        self._ring = collections.deque(maxlen=capacity)
+        self._capacity = capacity
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._descriptions = descriptions
+        self._sinks = []
+
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self._pushed = 0
+        self._overflow = 0
+        self._delivered = 0
+        self._dropped = 0
+
+    @property
+    def sinks(self):
+        return list(self._sinks)
+
+    def add_sink(self, sink):
+        '''
+        @param sink: object with `write(list(dict))` and `close()`
+        '''
+        self._sinks.append(sink)
+
+    def stats(self):
+        '''
+        :return dict events pushed, overwritten while the ring was full,
+            written and dropped by the sinks (counted once per sink), and
+            still queued
+        '''
+        lost = sum(getattr(sink, 'dropped', 0) for sink in self._sinks)
+        return {
+            'pushed': self._pushed,
+            'overflow': self._overflow,
+            'delivered': self._delivered - lost,
+            'dropped': self._dropped + lost,
+            'queued': len(self._ring),
+        }
+
+    def push(self, source, line, **fields):
+        '''
+        @param source: str where the event comes from (server, intervention)
+        @param line: str ModSecurity log line
+        @param fields: extra fields of the event (client_host...)
+        '''
+        if len(self._ring) == self._capacity:
+            self._overflow += 1
+        self._ring.append((time.time(), source, line, fields))
+        self._pushed += 1
+
+        if len(self._ring) >= self._batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        '''
+        Hand the queued events to the sinks and close them
+        '''
+        if self._thread is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            self._thread.join(timeout)
+            self._thread = None
+        self.drain()
+
+        for sink in self._sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                log.error(e, component='EventBus')
+
+    def drain(self):
+        '''
+        Hand everything queued to the sinks
+        :return int events handed
+        '''
+        count = 0
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return count
+            self._deliver(self._to_documents(batch))
+            count += len(batch)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            self.drain()
+        self.drain()
+
+    def _take_batch(self):
+        batch = []
+        pop = self._ring.popleft
+        try:
+            for _ in range(self._batch_size):
+                batch.append(pop())
+        except IndexError:
+            pass
+        return batch
+
+    def _to_documents(self, batch):
+        docs = []
+        for timestamp, source, line, fields in batch:
+            event = ModSecurityEvent.parse(line)
+            doc = event.to_dict() if event is not None else {'message': line}
+            if event is not None and self._descriptions is not None:
+                attack_type = self._descriptions.lookup(event.file)
+                if attack_type is not None:
+                    doc['type'] = attack_type
+
+            doc.update(fields)
+            doc['source'] = source
+            doc['date'] = datetime.datetime.fromtimestamp(
+                timestamp, datetime.timezone.utc).isoformat()
+            docs.append(doc)
+        return docs
+
+    def _deliver(self, docs):
+        for sink in self._sinks:
+            try:
+                sink.write(docs)
+            except Exception as e:
+                self._dropped += len(docs)
+                log.error(e, component='EventBus', sink=type(sink).__name__)
+            else:
+                self._delivered += len(docs)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import json
+import sys
+
+
+class FileSink(object):
+    '''
+    Writes the events as JSON lines
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        self._file = open(path, 'a', encoding='utf-8')
+
+    @property
+    def path(self):
+        return self._path
+
+    def write(self, events):
+        # One write per batch
+        self._file.write(''.join(json.dumps(e) + '\n' for e in events))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class StdoutSink(object):
+    '''
+    Prints the events as JSON lines
+    '''
+
+    def __init__(self, stream=None):
+        self._stream = stream
+
+    def write(self, events):
+        stream = self._stream or sys.stdout
+        stream.write(''.join(json.dumps(e) + '\n' for e in events))
+        stream.flush()
+
+    def close(self):
+        pass
+
+
+class ElasticsearchSink(object):
+    '''
+    Ships the events with a BulkExporter. `write` only queues them, the
+    events the exporter gives up on later are counted by `dropped`
+    '''
+
+    def __init__(self, exporter):
+        '''
+        @param exporter: BulkExporter
+        '''
+        self._exporter = exporter
+
+    @property
+    def exporter(self):
+        return self._exporter
+
+    @property
+    def dropped(self):
+        '''
+        Events written but not shipped, after their retries
+        '''
+        return self._exporter.stats()['failed']
+
+    def write(self, events):
+        for event in events:
+            self._exporter.add(event)
+
+    def close(self):
+        self._exporter.close()
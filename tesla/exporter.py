@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import multiprocessing
+import os
+import signal
+import threading
+
+import actionslog as log
+
+
+class ExporterTask(object):
+    '''
+    Ships the ModSecurity log every `interval` seconds from a task of the
+    proxy event loop. The log is read, parsed and shipped in bounded
+    batches by a thread of the loop executor; the loop only awaits the
+    run, it never reads the file itself.
+    '''
+
+    def __init__(self, parser_factory, log_dir, interval=10.0):
+        '''
+        @param parser_factory: callable returning the ModSecurityParser,
+            called once the exporter starts
+        @param log_dir: str directory of modsecurity.log
+        @param interval: float seconds between two runs
+        '''
+        self._parser_factory = parser_factory
+        self._log_dir = log_dir
+        self._interval = interval
+        self._parser = None
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self, loop=None):
+        if self._task is not None:
+            return
+        loop = loop or asyncio.get_event_loop()
+        self._parser = self._parser_factory()
+        self._task = loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._parser is not None:
+            self._parser.close()
+            self._parser = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self._parser.send_async(self._log_dir)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Try again on the next run
+                log.error(e, component='Exporter')
+
+
+class ExporterProcess(object):
+    '''
+    Ships the ModSecurity log every `interval` seconds from a child
+    process, away from the GIL of the proxy. The child reads the log by
+    itself, the log file is the pipe between the proxy and the exporter.
+    '''
+
+    def __init__(self, parser_factory, log_dir, interval=10.0):
+        '''
+        @param parser_factory: callable returning the ModSecurityParser,
+            called in the child
+        @param log_dir: str directory of modsecurity.log
+        @param interval: float seconds between two runs
+        '''
+        self._parser_factory = parser_factory
+        self._log_dir = log_dir
+        self._interval = interval
+        self._process = None
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.is_alive()
+
+    @property
+    def pid(self):
+        return self._process.pid if self._process is not None else None
+
+    def start(self, loop=None):
+        if self._process is not None:
+            return
+        context = multiprocessing.get_context('fork')
+        self._process = context.Process(
+            target=self._run, name='tesla-exporter', daemon=True)
+        self._process.start()
+        log.info('Exporter process started', pid=self._process.pid)
+
+    def stop(self, timeout=10.0):
+        '''
+        Let the child finish its current run and wait for it
+        '''
+        if self._process is None:
+            return
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+        self._process = None
+
+    def _run(self):
+        stopped = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+        # The supervisor or the terminal stop the parent, which stops us
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        parser = self._parser_factory()
+        try:
+            while not stopped.wait(self._interval):
+                try:
+                    parser.send(self._log_dir)
+                except Exception as e:
+                    log.error(e, component='Exporter', pid=os.getpid())
+        finally:
+            parser.close()
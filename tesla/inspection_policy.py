@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+
+class ResponseInspectionPolicy(object):
+    '''
+    Decide from the response headers if its body is worth going through
+    ModSecurity. Bodies that no rule would match (images, video, archives)
+    are passed through untouched.
+    '''
+
+    DEFAULT_TYPES = (
+        'text/',
+        'application/json',
+        'application/xml',
+        'application/xhtml+xml',
+        'application/javascript',
+        'application/x-javascript',
+        'application/x-www-form-urlencoded',
+        '+json',
+        '+xml',
+    )
+
+    def __init__(self, types=DEFAULT_TYPES, max_length=1024 * 1024,
+                 inspect_unknown=True):
+        '''
+        @param types: iterable(str) media types to inspect, a trailing `/`
+            matches a whole type (`text/`), a leading `+` matches a
+            structured syntax suffix (`+json`) and `*` matches any type
+        @param max_length: int bodies with a larger Content-Length are not
+            inspected, 0 means no limit
+        @param inspect_unknown: bool inspect responses without Content-Type
+        '''
+        self._any = '*' in types
+        self._prefixes = tuple(t.lower() for t in types if t.endswith('/'))
+        self._suffixes = tuple(t.lower() for t in types if t.startswith('+'))
+        self._types = frozenset(
+            t.lower() for t in types
+            if not t.endswith('/') and not t.startswith('+') and t != '*')
+        self._max_length = max_length
+        self._inspect_unknown = inspect_unknown
+        self._cache = {}
+
+    @property
+    def max_length(self):
+        return self._max_length
+
+    def should_inspect(self, content_type, content_length=None):
+        '''
+        @param content_type: bytes|str|None value of the Content-Type header
+        @param content_length: int|None value of the Content-Length header
+        :return True if the body must go through ModSecurity
+        '''
+        if content_length is not None and self._max_length and \
+                content_length > self._max_length:
+            return False
+
+        if not content_type:
+            return self._inspect_unknown
+
+        inspect = self._cache.get(content_type)
+        if inspect is None:
+            inspect = self._match(content_type)
+            if len(self._cache) > 1024:
+                self._cache.clear()
+            self._cache[content_type] = inspect
+
+        return inspect
+
+    def _match(self, content_type):
+        if self._any:
+            return True
+
+        if isinstance(content_type, bytes):
+            content_type = content_type.decode('latin-1')
+
+        media_type = content_type.split(';', 1)[0].strip().lower()
+        return media_type in self._types or \
+            media_type.startswith(self._prefixes) or \
+            media_type.endswith(self._suffixes)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import socket
+
+from tesla.tesla_exception import TeslaException
+
+
+class IpTable(object):
+    '''
+    Allow/deny table of IPv4 and IPv6 prefixes, looked up before any
+    ModSecurity transaction is created.
+
+    Prefixes are kept in one dict per prefix length, keyed by the network
+    bits of the address. A lookup converts the address to an int once and
+    tries the lengths in use, longest first, so the most specific prefix
+    wins: allow entries can carve exceptions out of a denied range, trust
+    entries also skip the inspection of their clients altogether. Tables
+    of millions of prefixes only use a handful of lengths, a lookup takes
+    a few dict accesses.
+    '''
+
+    ALLOW = 'allow'
+    DENY = 'deny'
+    TRUST = 'trust'
+    ACTIONS = (ALLOW, DENY, TRUST)
+
+    def __init__(self):
+        # family: (bits, {prefix length: {network: action}}, lengths)
+        self._tables = {
+            socket.AF_INET: (32, {}, []),
+            socket.AF_INET6: (128, {}, []),
+        }
+
+    def __len__(self):
+        return sum(
+            len(table) for _, tables, _ in self._tables.values()
+            for table in tables.values())
+
+    def stats(self):
+        '''
+        :return dict prefixes of each family and prefix lengths in use
+        '''
+        v4 = self._tables[socket.AF_INET]
+        v6 = self._tables[socket.AF_INET6]
+        return {
+            'ipv4': sum(len(t) for t in v4[1].values()),
+            'ipv6': sum(len(t) for t in v6[1].values()),
+            'lengths': len(v4[2]) + len(v6[2]),
+        }
+
+    def add(self, prefix, action=DENY):
+        '''
+        @param prefix: str address or CIDR prefix, host bits are ignored
+        @param action: str ALLOW, DENY or TRUST
+        '''
+        if action not in self.ACTIONS:
+            raise TeslaException('Unknown IP table action "%s"' % action)
+
+        family, length, network = self._parse(prefix)
+        bits, tables, lengths = self._tables[family]
+        table = tables.get(length)
+        if table is None:
+            table = tables[length] = {}
+            lengths.append(length)
+            lengths.sort(reverse=True)
+        table[network] = action
+
+    def remove(self, prefix):
+        '''
+        :return bool False if the prefix was not in the table
+        '''
+        family, length, network = self._parse(prefix)
+        bits, tables, lengths = self._tables[family]
+        table = tables.get(length)
+        if table is None or table.pop(network, None) is None:
+            return False
+        if not table:
+            del tables[length]
+            lengths.remove(length)
+        return True
+
+    def lookup(self, address):
+        '''
+        @param address: str IPv4 or IPv6 address, IPv4-mapped IPv6
+            addresses are looked up as IPv4
+        :return str|None action of the longest matching prefix, None if no
+            prefix matches or the address is invalid
+        '''
+        try:
+            family, ip = self._to_int(address)
+        except (OSError, ValueError, TypeError):
+            return None
+
+        bits, tables, lengths = self._tables[family]
+        for length in lengths:
+            action = tables[length].get(ip >> (bits - length))
+            if action is not None:
+                return action
+        return None
+
+    def load(self, path, action=DENY):
+        '''
+        Add the prefixes of a file, one per line, `#` starts a comment
+        @param path: str path of the file
+        @param action: str ALLOW, DENY or TRUST
+        :return int prefixes added
+        '''
+        count = 0
+        with open(path, encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                try:
+                    self.add(line, action)
+                except TeslaException as e:
+                    raise TeslaException('%s:%d: %s' % (path, number, e))
+                count += 1
+        return count
+
+    @classmethod
+    def _to_int(cls, address):
+        if ':' not in address:
+            return socket.AF_INET, int.from_bytes(
+                socket.inet_pton(socket.AF_INET, address), 'big')
+
+        ip = int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+        if ip >> 32 == 0xffff:
+            # ::ffff:a.b.c.d from a dual-stack socket
+            return socket.AF_INET, ip & 0xffffffff
+        return socket.AF_INET6, ip
+
+    @classmethod
+    def _parse(cls, prefix):
+        '''
+        :return tuple(int, int, int) family, prefix length and network bits
+        '''
+        address, _, length = prefix.strip().partition('/')
+        try:
+            family, ip = cls._to_int(address)
+        except (OSError, ValueError):
+            raise TeslaException('Invalid address "%s"' % prefix)
+
+        bits = 32 if family == socket.AF_INET else 128
+        if not length:
+            return family, bits, ip
+
+        written_bits = 128 if ':' in address else 32
+        if not length.isdigit() or int(length) > written_bits:
+            raise TeslaException('Invalid prefix length "%s"' % prefix)
+        # ::ffff:10.0.0.0/104 is 10.0.0.0/8
+        length = int(length) - (written_bits - bits)
+        if length < 0:
+            raise TeslaException('Invalid prefix length "%s"' % prefix)
+        return family, length, ip >> (bits - length)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import datetime
+import glob
+import gzip
+import os
+import queue
+import shutil
+import threading
+import time
+
+import actionslog as log
+
+
+class LogBackup(object):
+    '''
+    Rotates a log file into segments and compresses them in a background
+    thread.
+
+    `rotate` renames the log once it is larger than `max_segment_bytes`.
+    The writers use `WatchedFileHandler`, which opens the file again when
+    it was renamed. A segment is compressed once nothing was written to it
+    for `settle` seconds and `hold` lets it go, then removed. Archives
+    beyond `max_count` or `max_bytes` in total are deleted, oldest first.
+    '''
+
+    SUFFIX = '.gz'
+
+    def __init__(self,
+                 directory,
+                 max_segment_bytes=10 * 1024 * 1024,
+                 max_count=30,
+                 max_bytes=1024 * 1024 * 1024,
+                 settle=5.0,
+                 chunk_size=64 * 1024,
+                 max_queue=64,
+                 hold=None):
+        '''
+        @param directory: str where the archives are kept
+        @param max_segment_bytes: int size of the log before it is rotated
+        @param max_count: int archives kept, 0 for no limit
+        @param max_bytes: int total size of the archives kept, 0 for no limit
+        @param settle: float seconds without writes before a segment is
+            compressed, writers may still hold the renamed file
+        @param chunk_size: int bytes compressed at once
+        @param max_queue: int segments waiting to be compressed
+        @param hold: callable(str segment) -> bool, a segment is not
+            compressed while it returns True. Segments still held on `stop`
+            are left as is, `submit_pending` queues them again
+        '''
+        self._directory = directory
+        self._max_segment_bytes = max_segment_bytes
+        self._max_count = max_count
+        self._max_bytes = max_bytes
+        self._settle = settle
+        self._chunk_size = chunk_size
+        self._hold = hold
+
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._stopped = threading.Event()
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        '''
+        Stop once the queued segments are compressed
+        '''
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def rotate(self, path):
+        '''
+        Rename `path` into a new segment if it grew too large
+        :return str|None path of the segment
+        '''
+        try:
+            if os.stat(path).st_size < self._max_segment_bytes:
+                return None
+        except FileNotFoundError:
+            return None
+
+        segment = '%s.%s' % (path, datetime.datetime.now().strftime(
+            '%Y%m%d-%H%M%S-%f'))
+        os.rename(path, segment)
+        log.debug('Log file rotated', path=path, segment=segment)
+
+        self.submit(segment)
+        return segment
+
+    def submit(self, segment):
+        '''
+        Queue a segment to be compressed, never blocks
+        :return False if the queue is full, the segment is left as is
+        '''
+        try:
+            self._queue.put_nowait(segment)
+        except queue.Full:
+            log.warn('Log backup queue is full', segment=segment)
+            return False
+        return True
+
+    def submit_pending(self, path):
+        '''
+        Queue the segments of `path` left by a previous run
+        '''
+        for segment in sorted(glob.glob(glob.escape(path) + '.*')):
+            if not segment.endswith(self.SUFFIX) and \
+                    not segment.endswith('.tmp') and \
+                    os.path.isfile(segment):
+                self.submit(segment)
+
+    def archives(self):
+        '''
+        :return list(str) archives, oldest first
+        '''
+        paths = glob.glob(
+            os.path.join(glob.escape(self._directory), '*' + self.SUFFIX))
+        return sorted(paths, key=lambda p: (os.path.getmtime(p), p))
+
+    def compress(self, segment):
+        '''
+        Compress `segment` into the backup directory and remove it
+        :return str path of the archive
+        '''
+        archive = os.path.join(self._directory,
+                               os.path.basename(segment) + self.SUFFIX)
+        tmp_path = archive + '.tmp'
+
+        # Streamed, only chunk_size bytes are held in memory
+        with open(segment, 'rb') as src, \
+                gzip.open(tmp_path, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, self._chunk_size)
+
+        os.replace(tmp_path, archive)
+        os.remove(segment)
+        return archive
+
+    def enforce_retention(self):
+        '''
+        Delete the oldest archives beyond `max_count` or `max_bytes`
+        :return list(str) deleted archives
+        '''
+        archives = self.archives()
+        sizes = [os.path.getsize(a) for a in archives]
+        total = sum(sizes)
+        deleted = []
+
+        for archive, size in zip(archives, sizes):
+            over_count = self._max_count and \
+                len(archives) - len(deleted) > self._max_count
+            over_bytes = self._max_bytes and total > self._max_bytes
+            if not over_count and not over_bytes:
+                break
+
+            os.remove(archive)
+            deleted.append(archive)
+            total -= size
+
+        return deleted
+
+    def _run(self):
+        while True:
+            try:
+                segment = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopped.is_set():
+                    return
+                continue
+
+            try:
+                if not self._wait_settled(segment):
+                    log.debug('Log segment kept, it is still read',
+                              segment=segment)
+                    continue
+                archive = self.compress(segment)
+                deleted = self.enforce_retention()
+                log.debug(
+                    'Log segment backed up',
+                    archive=archive,
+                    deleted=len(deleted))
+            except Exception as e:
+                log.error(e, segment=segment)
+
+    def _wait_settled(self, segment):
+        '''
+        :return bool False if the segment is still held, it is left as is
+        '''
+        while not self._stopped.is_set():
+            idle = time.time() - os.path.getmtime(segment)
+            if idle < self._settle:
+                self._stopped.wait(self._settle - idle)
+            elif self._held(segment):
+                self._stopped.wait(max(self._settle, 0.5))
+            else:
+                return True
+        return not self._held(segment)
+
+    def _held(self, segment):
+        return self._hold is not None and self._hold(segment)
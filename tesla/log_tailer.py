@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+import glob
+import json
+import os
+
+import actionslog as log
+
+
+class LogTailer(object):
+    '''
+    Reads the lines appended to a log file since the last call.
+
+    The position is the inode and byte offset of the last complete line
+    handed out. Rotation (the path now points to another inode) and
+    truncation (the file is shorter than the offset) are detected, and what
+    was left in a rotated file is read before moving to the new one.
+
+    The position is saved to `checkpoint_path` by `commit`, once the lines
+    were shipped. A restart, or `rewind`, resumes from there: lines read but
+    not committed are read again.
+    '''
+
+    def __init__(self, path, checkpoint_path=None, chunk_size=64 * 1024,
+                 max_bytes=1024 * 1024, rotated_paths=None):
+        '''
+        @param path: str log file
+        @param checkpoint_path: str file where the position is saved, if None
+            it is not saved
+        @param chunk_size: int bytes read at once
+        @param max_bytes: int bytes read by a single `read_lines` call
+        @param rotated_paths: list(str) glob patterns of where the file is
+            moved on rotation, looked up when the checkpoint inode is not the
+            current one. Defaults to `path`.*
+        '''
+        self._path = path
+        self._checkpoint_path = checkpoint_path
+        self._chunk_size = chunk_size
+        self._max_bytes = max_bytes
+        self._rotated_paths = rotated_paths if rotated_paths is not None \
+            else [glob.escape(path) + '.*']
+
+        self._file = None
+        self._inode = None
+        self._offset = 0
+        # Bytes after the last complete line
+        self._partial = b''
+
+        self._committed = None
+        self._load_checkpoint()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def inode(self):
+        return self._inode
+
+    @property
+    def committed_inode(self):
+        '''
+        Inode of the last committed position, None if nothing was committed
+        '''
+        if self._committed is None:
+            return None
+        return self._committed['inode']
+
+    @property
+    def offset(self):
+        '''
+        Offset just after the last complete line read
+        '''
+        return self._offset
+
+    def read_lines(self):
+        '''
+        :return list(str) complete lines appended since the last call, at
+            most `max_bytes` of them
+        '''
+        lines = []
+        budget = self._max_bytes
+
+        while budget > 0:
+            if self._file is None and not self._open():
+                break
+
+            data = self._file.read(min(self._chunk_size, budget))
+            if not data:
+                if self._follow_rotation(lines):
+                    continue
+                break
+
+            budget -= len(data)
+            self._partial += data
+            end = self._partial.rfind(b'\n')
+            if end < 0:
+                if len(self._partial) > self._max_bytes:
+                    # Never keep an endless line in memory
+                    end = len(self._partial) - 1
+                else:
+                    continue
+
+            complete = self._partial[:end + 1]
+            self._partial = self._partial[end + 1:]
+            self._offset += len(complete)
+            lines.extend(
+                line.decode('utf-8', errors='replace')
+                for line in complete.splitlines())
+
+        return lines
+
+    def commit(self):
+        '''
+        Save the position of the lines read so far
+        '''
+        checkpoint = {'inode': self._inode, 'offset': self._offset}
+        if self._inode is None or checkpoint == self._committed:
+            return
+
+        if self._checkpoint_path is not None:
+            tmp_path = self._checkpoint_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(checkpoint, f)
+            os.replace(tmp_path, self._checkpoint_path)
+        self._committed = checkpoint
+
+    def rewind(self):
+        '''
+        Go back to the last committed position, the lines read since are
+        read again
+        '''
+        self.close()
+        self._partial = b''
+        if self._committed is None:
+            self._inode = None
+            self._offset = 0
+        else:
+            self._inode = self._committed['inode']
+            self._offset = self._committed['offset']
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _load_checkpoint(self):
+        if self._checkpoint_path is None or \
+                not os.path.exists(self._checkpoint_path):
+            return
+
+        try:
+            with open(self._checkpoint_path) as f:
+                checkpoint = json.load(f)
+            self._inode = int(checkpoint['inode'])
+            self._offset = int(checkpoint['offset'])
+        except (ValueError, KeyError, TypeError) as e:
+            log.warn(
+                'Ignoring invalid log checkpoint',
+                path=self._checkpoint_path,
+                error=str(e))
+            self._inode = None
+            self._offset = 0
+            return
+
+        self._committed = {'inode': self._inode, 'offset': self._offset}
+
+    def _open(self):
+        '''
+        Open the file at the saved position
+        :return True if the file could be opened
+        '''
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            return False
+
+        if self._inode is not None and stat.st_ino != self._inode:
+            # Rotated while we were not reading, finish the old file first
+            for pattern in self._rotated_paths:
+                for rotated_path in glob.iglob(pattern):
+                    if self._open_path(rotated_path, self._inode):
+                        return True
+            self._inode = None
+
+        if self._inode is None:
+            self._offset = 0
+        return self._open_path(self._path, stat.st_ino)
+
+    def _open_path(self, path, inode):
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return False
+
+        stat = os.fstat(f.fileno())
+        if stat.st_ino != inode:
+            f.close()
+            return False
+
+        if stat.st_size < self._offset:
+            log.info('Log file was truncated', path=path)
+            self._offset = 0
+
+        f.seek(self._offset)
+        self._file = f
+        self._inode = inode
+        self._partial = b''
+        return True
+
+    def _follow_rotation(self, lines):
+        '''
+        Called at the end of the open file
+        @param lines: list(str) where the last line of a rotated file goes
+        :return True if there is another file to read from
+        '''
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            # Rotated and not created again yet
+            return False
+
+        if stat.st_ino != self._inode:
+            log.info('Log file was rotated', path=self._path)
+            if self._partial:
+                # Nothing will be appended to it anymore
+                lines.append(self._partial.decode('utf-8', errors='replace'))
+            self.close()
+            self._inode = None
+            self._offset = 0
+            return self._open_path(self._path, stat.st_ino)
+
+        if stat.st_size < self._offset + len(self._partial):
+            log.info('Log file was truncated', path=self._path)
+            self._file.seek(0)
+            self._offset = 0
+            self._partial = b''
+            return True
+
+        return False
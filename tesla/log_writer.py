@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import weakref
+
+# Writers of this process, restarted in a forked child
+_writers = weakref.WeakSet()
+
+
+def _after_fork():
+    for writer in list(_writers):
+        writer._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    '''
+    QueueHandler that never blocks the caller: records arriving while the
+    queue is full are counted and dropped
+    '''
+
+    def __init__(self, queue):
+        super(DroppingQueueHandler, self).__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        '''
+        Queue the record as is, it is formatted by the handlers in the writer
+        thread instead of the caller's
+        '''
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class QueueLogWriter(object):
+    '''
+    Moves the file handlers of a logger to a background thread. The event
+    loop only puts the records in a bounded queue, the formatting and the
+    writes happen in the writer thread.
+
+    A forked worker gets its own queue and thread, threads do not survive
+    `fork`.
+    '''
+
+    def __init__(self, logger, max_queue=10000):
+        '''
+        @param logger: logging.Logger whose handlers are moved
+        @param max_queue: int records waiting to be written before new ones
+            are dropped
+        '''
+        self._logger = logger
+        self._max_queue = max_queue
+        self._handlers = []
+        self._handler = None
+        self._listener = None
+        self._lock = threading.Lock()
+        _writers.add(self)
+
+    @property
+    def dropped(self):
+        if self._handler is None:
+            return 0
+        return self._handler.dropped
+
+    @property
+    def handlers(self):
+        return list(self._handlers)
+
+    @property
+    def running(self):
+        return self._listener is not None
+
+    def add_handler(self, handler):
+        '''
+        Write the records of `handler` in the background thread. Handlers
+        already added to the logger are moved by `start`
+        '''
+        with self._lock:
+            self._handlers.append(handler)
+            if self._listener is not None:
+                self._restart()
+
+    def start(self):
+        with self._lock:
+            if self._handler is not None:
+                return
+
+            for handler in list(self._logger.handlers):
+                if isinstance(handler, logging.handlers.QueueHandler):
+                    continue
+                self._logger.removeHandler(handler)
+                self._handlers.append(handler)
+
+            self._handler = DroppingQueueHandler(
+                queue.Queue(self._max_queue))
+            self._logger.addHandler(self._handler)
+            self._start_listener()
+
+    def stop(self):
+        '''
+        Write the queued records and give the handlers back to the logger
+        '''
+        with self._lock:
+            if self._handler is None:
+                return
+
+            self._logger.removeHandler(self._handler)
+            self._stop_listener()
+            self._handler = None
+            for handler in self._handlers:
+                self._logger.addHandler(handler)
+            self._handlers = []
+
+    def _start_listener(self):
+        self._listener = logging.handlers.QueueListener(
+            self._handler.queue, *self._handlers, respect_handler_level=True)
+        self._listener.start()
+
+    def _stop_listener(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def _restart(self):
+        self._stop_listener()
+        self._start_listener()
+
+    def _after_fork(self):
+        # The parent thread is gone, its queue may be left locked
+        self._lock = threading.Lock()
+        if self._handler is None:
+            return
+
+        self._handler.queue = queue.Queue(self._max_queue)
+        self._handler.dropped = 0
+        self._listener = None
+        self._start_listener()
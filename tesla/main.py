@@ -1,23 +1,54 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import functools
 import glob
 import ipaddress
 import os
+import signal
 import sys
-import threading
 import time
 
 import actionslog as log
 import ModSecurity
 from core import BaseApplication
+from tesla.balancer import Backend, Balancer
 from tesla.proxy import Proxy
+from tesla.proxy_settings import ProxySettings
+from tesla.router import HostRouter, Route
+from tesla.rule_generations import RuleGenerations
+from tesla.response_templates import ResponseTemplates
 from tesla.server import Server
 from tesla.tesla_exception import TeslaException
+from tesla.upstream_pool import UpstreamPool
+from tesla.workers import WorkerSupervisor
 from tesla.modsec import ModSecurityParser
+from tesla.exporter import ExporterProcess, ExporterTask
+from tesla.bulk_exporter import BulkExporter
+from tesla.config import Config, Target
+from tesla.event_bus import EventBus
+from tesla.event_sinks import ElasticsearchSink, FileSink, StdoutSink
+from tesla.ip_table import IpTable
+from tesla.rate_limiter import RateLimiter
+from tesla.admission import AdmissionControl, RejectedConnection
+from tesla.rule_descriptions import RuleDescriptions
+from tesla.inspection_policy import ResponseInspectionPolicy
+from tesla.log_writer import QueueLogWriter
+from tesla.timer_wheel import TimerWheel
 
 """Main module."""
 
 
 class Tesla(BaseApplication):
+    EXPORTER_TASK = 'task'
+    EXPORTER_PROCESS = 'process'
+    EXPORTER_OFF = 'off'
+    EXPORTERS = (EXPORTER_TASK, EXPORTER_PROCESS, EXPORTER_OFF)
+
+    SINK_FILE = 'file'
+    SINK_ELASTICSEARCH = 'elasticsearch'
+    SINK_STDOUT = 'stdout'
+    SINKS = (SINK_FILE, SINK_ELASTICSEARCH, SINK_STDOUT)
+
     def __init__(self):
         super(Tesla, self).__init__(
             'tesla', description='Tesla Web Application Firewall')
@@ -25,18 +56,261 @@ class Tesla(BaseApplication):
         self.add_argument('dst_host', 'Destination host')
         self.add_argument('dst_port', 'Destination port', type=int)
         self.add_argument('rule_set', 'ModSecurity rule set', nargs='+')
-        self.add_argument('--es_host', 'Elasticsearch host')
+        self.add_argument(
+            '--es_host', 'Elasticsearch host, https://host connects with TLS')
         self.add_argument('--es_port', 'Elasticsearch port', type=int)
         self.add_argument('--es_user', 'Elasticsearch user')
         self.add_argument('--es_secret', 'Elasticsearch secret')
+        self.add_argument(
+            '--es_ca', 'CA bundle checking the Elasticsearch certificate')
         self.add_argument('--src-host', 'Source host', default='0.0.0.0')
         self.add_argument('--src-port', 'Source port', type=int, default=9090)
+        self.add_argument(
+            '--keep-alive-timeout',
+            'Seconds an idle keep-alive client connection is kept open',
+            type=float,
+            default=5.0)
+        self.add_argument(
+            '--idle-timeout',
+            'Seconds a new client connection may wait before its first '
+            'request (0 for no limit)',
+            type=float,
+            default=10.0)
+        self.add_argument(
+            '--header-timeout',
+            'Seconds a client may take to send the headers of a request (0 '
+            'for no limit)',
+            type=float,
+            default=10.0)
+        self.add_argument(
+            '--body-timeout',
+            'Seconds a client may wait between two reads of a request body (0 '
+            'for no limit)',
+            type=float,
+            default=10.0)
+        self.add_argument(
+            '--request-timeout',
+            'Seconds a client may take to send a whole request (0 for no '
+            'limit)',
+            type=float,
+            default=60.0)
+        self.add_argument(
+            '--max-requests',
+            'Max requests per client connection (0 for no limit)',
+            type=int,
+            default=100)
+        self.add_argument(
+            '--upstream-max-idle',
+            'Max idle connections kept per target (0 disables pooling)',
+            type=int,
+            default=32)
+        self.add_argument(
+            '--upstream-max-total',
+            'Max connections per target',
+            type=int,
+            default=256)
+        self.add_argument(
+            '--upstream-idle-timeout',
+            'Seconds an idle target connection is kept',
+            type=float,
+            default=30.0)
+        self.add_argument(
+            '--intervention-checks',
+            'When to check for ModSecurity interventions: after each header '
+            'or only at the phase boundaries',
+            choices=ProxySettings.INTERVENTION_MODES,
+            default=ProxySettings.INTERVENTION_HEADER)
+        self.add_argument(
+            '--request-body-policy',
+            'Hold request bodies until ModSecurity accepts them (buffer) or '
+            'forward them while they are inspected (stream)',
+            choices=ProxySettings.BODY_POLICIES,
+            default=ProxySettings.BODY_BUFFER)
+        self.add_argument(
+            '--request-body-memory',
+            'Bytes of a held request body kept in memory before spilling to '
+            'a temporary file',
+            type=int,
+            default=64 * 1024)
+        self.add_argument(
+            '--request-body-max-length',
+            'Bytes of a held request body, larger requests get a 413 (0 for '
+            'no limit)',
+            type=int,
+            default=13107200)
+        self.add_argument(
+            '--inspect-response-types',
+            'Comma separated media types of the response bodies inspected, '
+            '"*" inspects all of them and "default" skips the binary ones '
+            '(%s)' % ','.join(ResponseInspectionPolicy.DEFAULT_TYPES),
+            default='*')
+        self.add_argument(
+            '--inspect-response-max-length',
+            'Response bodies with a larger Content-Length are not inspected '
+            '(0 for no limit)',
+            type=int,
+            default=0)
+        self.add_argument(
+            '--templates',
+            'Directory of the block (403.txt) and redirect (302.txt) '
+            'response templates',
+            default='etc/templates')
+        self.add_argument(
+            '--log-sample-every',
+            'Log one of every N per-packet events (0 disables them)',
+            type=int,
+            default=64)
+        self.add_argument(
+            '--log-max-bytes',
+            'Size of modsecurity.log before it is rotated and backed up',
+            type=int,
+            default=10 * 1024 * 1024)
+        self.add_argument(
+            '--backup-count',
+            'Log backups kept (0 for no limit)',
+            type=int,
+            default=30)
+        self.add_argument(
+            '--backup-max-bytes',
+            'Total size of the log backups kept (0 for no limit)',
+            type=int,
+            default=1024 * 1024 * 1024)
+        self.add_argument(
+            '--exporter',
+            'How the ModSecurity log is shipped to Elasticsearch: a task of '
+            'the proxy event loop, a separate process or not at all',
+            choices=self.EXPORTERS,
+            default=self.EXPORTER_TASK)
+        self.add_argument(
+            '--export-interval',
+            'Seconds between two shipments of the ModSecurity log',
+            type=float,
+            default=10.0)
+        self.add_argument(
+            '--event-sinks',
+            'Comma separated sinks (file, elasticsearch, stdout) the '
+            'ModSecurity events go to straight from memory. They are still '
+            'written to modsecurity.log for the exporter unless the '
+            'elasticsearch sink replaces it',
+            default='')
+        self.add_argument(
+            '--event-capacity',
+            'ModSecurity events held in memory before the oldest are dropped',
+            type=int,
+            default=10000)
+        self.add_argument(
+            '--deny-list',
+            'File of the client addresses and CIDR prefixes denied before '
+            'ModSecurity, one per line')
+        self.add_argument(
+            '--allow-list',
+            'File of the prefixes excepted from the deny list, the longest '
+            'matching prefix wins')
+        self.add_argument(
+            '--trust-list',
+            'File of the prefixes whose clients are tunneled to the target '
+            'without any inspection, nor rate limit, the longest matching '
+            'prefix wins')
+        self.add_argument(
+            '--rate-limit',
+            'Requests per second allowed to a client address by each worker '
+            '(0 for no limit)',
+            type=float,
+            default=0.0)
+        self.add_argument(
+            '--rate-burst',
+            'Requests a client may send at once (0 for the rate limit)',
+            type=float,
+            default=0.0)
+        self.add_argument(
+            '--rate-max-clients',
+            'Client addresses tracked by the rate limiter, the least recently '
+            'seen are forgotten first and get a full bucket back',
+            type=int,
+            default=100000)
+        self.add_argument(
+            '--rate-ipv6-prefix',
+            'Prefix length of the IPv6 networks rate limited as one client',
+            type=int,
+            default=64)
+        self.add_argument(
+            '--max-connections',
+            'Client connections held by each worker, the next ones get a 503 '
+            '(0 for no limit)',
+            type=int,
+            default=0)
+        self.add_argument(
+            '--max-in-flight',
+            'Requests inspected and proxied at once by each worker (0 for no '
+            'limit)',
+            type=int,
+            default=0)
+        self.add_argument(
+            '--admission-queue',
+            'Requests waiting for an in-flight slot, the next ones get a 503',
+            type=int,
+            default=64)
+        self.add_argument(
+            '--admission-timeout',
+            'Seconds a request waits for an in-flight slot before a 503',
+            type=float,
+            default=1.0)
+        self.add_argument(
+            '--target-latency',
+            'Seconds a request should take, the in-flight limit adapts to '
+            'keep them under it (0 keeps --max-in-flight fixed)',
+            type=float,
+            default=0.0)
+        self.add_argument(
+            '--accept-backlog',
+            'Connections the kernel queues before they are accepted',
+            type=int,
+            default=100)
+        self.add_argument(
+            '--config',
+            'TOML file of the listeners ([server.*]) and targets ([target.*]), '
+            'the destination is the target of the servers without one')
+        self.add_argument(
+            '--workers',
+            'Number of worker processes sharing the source port',
+            type=int,
+            default=1)
 
-        self._server = None
+        self._servers = []
+        self._balancers = {}
+        self._rule_sets = {}
+        self._rule_counts = {}
+        self._rule_generations = RuleGenerations()
+        self._reload_task = None
+        self._config = None
+        self._supervisor = None
+        self._templates = None
+        self._log_writer = None
+        self._exporter = None
+        self._event_sinks = []
+        self._event_bus = None
+        self._upstream_pool = None
+        self._proxy_settings = None
 
     @property
     def server(self):
-        return self._server
+        return self._servers[0] if self._servers else None
+
+    @property
+    def servers(self):
+        return list(self._servers)
+
+    @property
+    def config(self):
+        return self._config
+
+    @property
+    def balancers(self):
+        return dict(self._balancers)
+
+    @property
+    def upstream_pool(self):
+        return self._upstream_pool
 
     def setup(self, args=sys.argv[1:]):
 
@@ -59,6 +333,16 @@ class Tesla(BaseApplication):
             if not type(self._src_port) == int:
                 raise TeslaException('Please inform a valid source port.')
 
+            self._event_sinks = [
+                s.strip() for s in self.args.event_sinks.split(',')
+                if s.strip()
+            ]
+            for sink in self._event_sinks:
+                if sink not in self.SINKS:
+                    raise TeslaException(
+                        'Unknown event sink "%s", choose from %s' %
+                        (sink, ', '.join(self.SINKS)))
+
             # dst_host could be a domain
             self._dst_host = self.args.dst_host
 
@@ -66,6 +350,42 @@ class Tesla(BaseApplication):
             if not type(self._dst_port) == int:
                 raise TeslaException('Please inform a valid destination port.')
 
+            if self.args.config:
+                self._config = Config.load(
+                    self.args.config,
+                    default_target=Target('default', self._dst_host,
+                                          self._dst_port))
+
+            if self.args.upstream_max_idle > 0:
+                self._upstream_pool = UpstreamPool(
+                    max_idle=self.args.upstream_max_idle,
+                    max_total=self.args.upstream_max_total,
+                    idle_timeout=self.args.upstream_idle_timeout)
+
+            self._templates = ResponseTemplates(self.args.templates)
+
+            self._proxy_settings = ProxySettings(
+                keep_alive_timeout=self.args.keep_alive_timeout,
+                idle_timeout=self.args.idle_timeout,
+                header_timeout=self.args.header_timeout,
+                body_timeout=self.args.body_timeout,
+                request_timeout=self.args.request_timeout,
+                timer_wheel=TimerWheel(),
+                max_requests=self.args.max_requests,
+                upstream_pool=self._upstream_pool,
+                intervention_mode=self.args.intervention_checks,
+                body_policy=self.args.request_body_policy,
+                body_memory_limit=self.args.request_body_memory,
+                body_max_length=self.args.request_body_max_length,
+                response_policy=self._create_response_policy(),
+                templates=self._templates,
+                log_sample_every=self.args.log_sample_every,
+                log_interventions=not self._bus_ships_events(),
+                ip_table=self._load_ip_table(),
+                rate_limiter=self._create_rate_limiter(
+                    self.args.rate_limit, self.args.rate_burst),
+                admission=self._create_admission())
+
             log.debug('Initializing ModSecurity', component='ModSecurity')
 
             self._configure_log_handlers()
@@ -73,40 +393,246 @@ class Tesla(BaseApplication):
             self._modsec = ModSecurity.ModSecurity()
             self._modsec.setServerLogCb(self.modsecurity_log_callback)
             self._load_modsec_rules()
+            self._load_rule_sets()
 
-            self._server = self._create_server(
-                self._src_host,
-                self._src_port,
-                self._dst_host,
-                self._dst_port,
-                proxy_creator_func=self._create_proxy)
+            if self.args.workers > 1:
+                # Rules are loaded once here and shared with the workers
+                self._supervisor = WorkerSupervisor(self.args.workers,
+                                                    self._run_worker)
+            else:
+                self._servers = self._create_servers()
         except Exception as e:
             log.error(e)
             raise
         
         if not 'pytest' in sys.modules:
-            self._modsec_parser = ModSecurityParser(self.args.es_host, self.args.es_port, self.args.es_user, self.args.es_secret)
-            thr = threading.Thread(target=self._start_parser)
-            thr.start()
+            self._exporter = self._create_exporter()
+
+    @property
+    def templates(self):
+        return self._templates
+
+    @property
+    def exporter(self):
+        return self._exporter
+
+    @property
+    def event_bus(self):
+        return self._event_bus
+
+    def run(self):
+        try:
+            if isinstance(self._exporter, ExporterProcess):
+                self._exporter.start()
+
+            if self._supervisor is not None:
+                return self._supervisor.run()
+
+            if isinstance(self._exporter, ExporterTask):
+                self._exporter.start()
+            self._start_event_bus()
+            asyncio.get_event_loop().add_signal_handler(signal.SIGHUP,
+                                                        self.reload)
+            return super(Tesla, self).run()
+        finally:
+            if self._exporter is not None:
+                self._exporter.stop()
+            self._stop_balancers()
+            self._stop_event_bus()
+            self._log_timeouts()
+            self._stop_log_writer()
+
+    def reload(self):
+        '''
+        Pick up configuration changes without a restart (SIGHUP)
+        '''
+        log.info('Reloading')
+        try:
+            self._templates.reload()
+        except Exception as e:
+            # Keep serving the previous templates
+            log.error(e)
+
+        if self._reload_task is not None and not self._reload_task.done():
+            log.warn('A reload is already running')
+            return
+        self._reload_task = asyncio.get_event_loop().create_task(
+            self._reload_async())
+
+    async def _reload_async(self):
+        await self.reload_ip_table()
+        await self.reload_rules()
+
+    async def reload_ip_table(self):
+        '''
+        Load the deny, allow and trust lists again in the executor and swap
+        the table in for the new connections
+        :return bool True if the new table is used
+        '''
+        if not self._has_ip_lists():
+            return False
+
+        loop = asyncio.get_event_loop()
+        try:
+            table = await loop.run_in_executor(None, self._load_ip_table)
+        except Exception as e:
+            log.error(e)
+            log.warn('Reload failed, keeping the current IP table')
+            return False
+
+        self._proxy_settings.ip_table = table
+        return True
+
+    async def reload_rules(self):
+        '''
+        Parse the rule sets again and swap them in for the new
+        transactions, the running ones finish on the rules they started
+        with. Nothing is swapped if any rule set fails to load
+        :return bool True if the new rules are used
+        '''
+        started = time.monotonic()
+        try:
+            rules = await self._parse_rules(self.args.rule_set)
+            rule_sets = {}
+            if self._config is not None:
+                for name, patterns in self._config.rule_sets.items():
+                    rule_sets[name] = await self._parse_rules(
+                        patterns, name=name)
+        except Exception as e:
+            log.error(e, component='ModSecurity')
+            log.warn('Reload failed, keeping the current rules')
+            return False
+
+        # Nothing is awaited from here, transactions see either all the
+        # previous rules or all the new ones
+        self._swap_rules(None, *rules)
+        for name, (new_rules, count) in rule_sets.items():
+            self._swap_rules(name, new_rules, count)
+
+        log.info(
+            'ModSecurity rules reloaded',
+            seconds=round(time.monotonic() - started, 3),
+            retired=self._rule_generations.stats()['retired'])
+        return True
+
+    async def _parse_rules(self, patterns, name=None):
+        '''
+        Load a new ModSecurity.Rules in the executor, one file at a time so
+        the event loop runs in between
+        @param patterns: list(str) glob patterns of the rule files
+        @param name: str name of the rule set, None for the default rules
+        :return tuple(ModSecurity.Rules, int) rules and their count
+        '''
+        loop = asyncio.get_event_loop()
+        rules = ModSecurity.Rules()
+        count = 0
+        for pattern in patterns:
+            paths = glob.glob(pattern, recursive=True)
+            if not paths and name is not None:
+                raise TeslaException('Rule set "%s": no file matches "%s"' %
+                                     (name, pattern))
+            for path in paths:
+                loaded = await loop.run_in_executor(None, rules.loadFromUri,
+                                                    path)
+                # As on startup: an empty or wrong file is an error, never
+                # an empty rule set swapped in
+                if loaded <= 0:
+                    raise TeslaException('Could not load "%s": %s' %
+                                         (path, rules.getParserError()))
+                count += loaded
+
+        if count == 0:
+            raise TeslaException('Rule set "%s" has no rules' %
+                                 (name or 'default'))
+        return rules, count
+
+    def _swap_rules(self, name, rules, count):
+        if name is None:
+            previous = self._modsec_rules
+            self._modsec_rules = rules
+        else:
+            previous = self._rule_sets.get(name)
+            self._rule_sets[name] = rules
+
+        previous_count = self._rule_counts.pop(previous, 0)
+        self._rule_counts[rules] = count
+        if previous is not None:
+            self._rule_generations.retire(previous)
+
+        log.info(
+            'Rule set reloaded',
+            rule_set=name or 'default',
+            rules=count,
+            rules_delta=count - previous_count,
+            component='ModSecurity')
+
+    def _run_worker(self, worker_id):
+        '''
+        Entry point of a worker process: serve on a new event loop until
+        SIGTERM or SIGINT is received
+        '''
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, loop.stop)
+        # Each worker parses the rules again: rules parsed by the supervisor
+        # after the fork could not be shared with the workers
+        loop.add_signal_handler(signal.SIGHUP, self.reload)
+
+        log.info('Starting worker', worker_id=worker_id, pid=os.getpid())
+        self._servers = self._create_servers()
+
+        # A single worker ships the log
+        exporter = None
+        if worker_id == 0 and isinstance(self._exporter, ExporterTask):
+            exporter = self._exporter
+            exporter.start(loop)
+        self._start_event_bus(worker_id)
+        try:
+            loop.run_forever()
+        finally:
+            if exporter is not None:
+                exporter.stop()
+            self._stop_balancers()
+            self._stop_event_bus()
+            self._log_timeouts()
+            if self._upstream_pool is not None:
+                self._upstream_pool.close()
+            loop.close()
+            self._stop_log_writer()
+
+        return 0
+
+    @property
+    def log_writer(self):
+        return self._log_writer
 
     def _configure_log_handlers(self):
         import logging
+        import logging.handlers
         instance = log.get_instance()
-        modsec_handler = logging.FileHandler(
+        # Opened again once the backup rotated it
+        modsec_handler = logging.handlers.WatchedFileHandler(
             instance.get_log_path('modsecurity.log'))
 
         def modsec_filter(record):
-            component = getattr(record, 'component', None)
-            print('component:', component, '-' * 80)
-
-            if component == 'ModSecurity':
-                return 1
-            return 0
+            return getattr(record, 'component', None) == 'ModSecurity'
 
         modsec_handler.addFilter(modsec_filter)
         instance.addHandler(modsec_handler)
 
+        # The files are written by a background thread, the loop only
+        # queues the records
+        self._log_writer = QueueLogWriter(instance)
+        self._log_writer.start()
+
+    def _stop_log_writer(self):
+        if self._log_writer is not None:
+            # Write what is still queued
+            self._log_writer.stop()
+
     def modsecurity_log_callback(self, data, msg):
+        # The events go to the bus from the interventions, once
         log.info(
             'Log from modsecurity',
             component='ModSecurity-Internal',
@@ -122,28 +648,177 @@ class Tesla(BaseApplication):
 
         log.debug('Finished loading core rules')
 
-    def _load_modsec_rule_from_filename(self, filename):
+    def _load_rule_sets(self):
+        '''
+        Load the rule sets of the virtual hosts, once for every transaction
+        and every worker
+        '''
+        if self._config is None:
+            return
+
+        for name, patterns in self._config.rule_sets.items():
+            rules = ModSecurity.Rules()
+            for pattern in patterns:
+                paths = glob.glob(pattern, recursive=True)
+                if not paths:
+                    raise TeslaException(
+                        'Rule set "%s": no file matches "%s"' %
+                        (name, pattern))
+                for path in paths:
+                    self._load_modsec_rule_from_filename(path, rules)
+            self._rule_sets[name] = rules
+            log.debug('Finished loading rule set', rule_set=name)
+
+    def _load_modsec_rule_from_filename(self, filename, rules=None):
+        if rules is None:
+            rules = self._modsec_rules
         log.debug(
             'Loading core rule set "%s"...' % filename,
             component='ModSecurity')
-        if self._modsec_rules.loadFromUri(filename) == 0:
+        loaded = rules.loadFromUri(filename)
+        if loaded <= 0:
             log.error(
-                Exception(self._modsec_rules.getParserError()),
+                Exception(rules.getParserError()),
                 component='ModSecurity')
+        else:
+            # Logged as a delta on reload
+            self._rule_counts[rules] = self._rule_counts.get(rules, 0) + \
+                loaded
+
+    def _create_servers(self):
+        '''
+        Servers of this process, all in the current event loop. Their
+        transactions share the rules loaded once by `_load_modsec_rules`
+        :return list(Server)
+        '''
+        if self._config is None or not self._config.listeners:
+            return [
+                self._create_server(
+                    self._src_host,
+                    self._src_port,
+                    self._dst_host,
+                    self._dst_port,
+                    proxy_creator_func=self._create_proxy)
+            ]
+
+        self._proxy_settings.router = self._create_router()
+
+        servers = []
+        for listener in self._config.listeners:
+            proxy_creator_func = self._create_proxy
+            balancer = self._create_balancer(listener.target)
+            if balancer is not None:
+                proxy_creator_func = functools.partial(
+                    self._create_proxy, balancer=balancer)
+
+            servers.append(
+                self._create_server(
+                    listener.host,
+                    listener.port,
+                    listener.target.host,
+                    listener.target.port,
+                    proxy_creator_func=proxy_creator_func,
+                    name=listener.name,
+                    use_ssl=listener.ssl,
+                    cert=listener.cert,
+                    key=listener.key))
+        return servers
+
+    def _create_router(self):
+        '''
+        Route of each virtual host, their rules are shared by all the
+        transactions
+        :return HostRouter|None
+        '''
+        if not self._config.vhosts:
+            return None
+
+        router = HostRouter()
+        for vhost in self._config.vhosts:
+            route = Route(vhost.name)
+            if vhost.rules is not None:
+                # Looked up by name, a reload swaps the rules
+                route.transaction_factory = functools.partial(
+                    self._create_rule_set_transaction, vhost.rules)
+            route.rate_limiter = self._create_rate_limiter(
+                vhost.rate_limit, vhost.rate_burst)
+            if vhost.target is not None:
+                route.dst_host = vhost.target.host
+                route.dst_port = vhost.target.port
+                route.balancer = self._create_balancer(vhost.target)
+            for host in vhost.hosts:
+                router.add(host, route)
+        return router
+
+    def _create_rate_limiter(self, rate, burst):
+        '''
+        :return RateLimiter|None None if `rate` is 0
+        '''
+        if not rate:
+            return None
+        return RateLimiter(
+            rate,
+            burst,
+            max_clients=self.args.rate_max_clients,
+            ipv6_prefix=self.args.rate_ipv6_prefix)
+
+    def _create_admission(self):
+        '''
+        :return AdmissionControl|None None if nothing is limited
+        '''
+        if not self.args.max_connections and not self.args.max_in_flight:
+            return None
+        return AdmissionControl(
+            max_connections=self.args.max_connections,
+            max_in_flight=self.args.max_in_flight,
+            queue_size=self.args.admission_queue,
+            queue_timeout=self.args.admission_timeout,
+            target_latency=self.args.target_latency)
+
+    def _create_balancer(self, target):
+        '''
+        Balancer of a target with backends, shared by its listeners. Its
+        health checks run in the event loop of this process
+        :return Balancer|None
+        '''
+        if not target.backends:
+            return None
+
+        balancer = self._balancers.get(target.name)
+        if balancer is None:
+            balancer = Balancer(
+                [Backend.parse(address) for address in target.backends],
+                policy=target.balance,
+                health_check_interval=target.health_check_interval)
+            balancer.start()
+            self._balancers[target.name] = balancer
+        return balancer
+
+    def _stop_balancers(self):
+        for balancer in self._balancers.values():
+            balancer.stop()
 
     def _create_server(self,
                        src_host,
                        src_port,
                        dst_host,
                        dst_port,
-                       proxy_creator_func=None):
+                       proxy_creator_func=None,
+                       name='server',
+                       use_ssl=False,
+                       cert='',
+                       key=''):
         return Server(
-            'server',
+            name,
             src_host,
             src_port,
             dst_host,
             dst_port,
-            proxy_creator_func=proxy_creator_func)
+            use_ssl=use_ssl,
+            cert=cert,
+            key=key,
+            proxy_creator_func=proxy_creator_func,
+            backlog=self.args.accept_backlog)
 
     def _is_valid_address(self, address):
         try:
@@ -152,17 +827,151 @@ class Tesla(BaseApplication):
         except:
             return False
 
-    def _create_proxy(self, dst_host, dst_port):
-        transaction = ModSecurity.Transaction(self._modsec, self._modsec_rules)
+    def _create_response_policy(self):
+        types = [
+            t.strip() for t in self.args.inspect_response_types.split(',')
+            if t.strip()
+        ]
+        max_length = self.args.inspect_response_max_length
+        if types == ['*'] and not max_length:
+            # Every response body is inspected
+            return None
+
+        if types == ['default']:
+            types = ResponseInspectionPolicy.DEFAULT_TYPES
+        return ResponseInspectionPolicy(types=types, max_length=max_length)
+
+    def _create_transaction(self, rules=None):
+        if rules is None:
+            rules = self._modsec_rules
+        transaction = ModSecurity.Transaction(self._modsec, rules)
         if transaction is None:
             log.error(
                 Exception('Could not create a new ModSecurity transaction!'),
                 component='ModSecurity')
-        p = Proxy(dst_host, dst_port, transaction)
+        else:
+            # Retired rules live as long as their transactions
+            self._rule_generations.track(transaction, rules)
+        return transaction
+
+    def _load_ip_table(self):
+        '''
+        :return IpTable|None None without deny, allow nor trust list
+        '''
+        if not self._has_ip_lists():
+            return None
+
+        table = IpTable()
+        for path, action in ((self.args.deny_list, IpTable.DENY),
+                             (self.args.allow_list, IpTable.ALLOW),
+                             (self.args.trust_list, IpTable.TRUST)):
+            if path:
+                try:
+                    table.load(path, action)
+                except OSError as e:
+                    raise TeslaException('Could not read "%s": %s' %
+                                         (path, e))
+
+        log.info('IP table loaded', **table.stats())
+        return table
+
+    def _has_ip_lists(self):
+        return bool(self.args.deny_list or self.args.allow_list or
+                    self.args.trust_list)
+
+    def _create_rule_set_transaction(self, name):
+        return self._create_transaction(self._rule_sets[name])
+
+    def _create_exporter(self):
+        if self.args.exporter == self.EXPORTER_OFF:
+            return None
+        if self._bus_ships_events():
+            log.info('ModSecurity events are shipped by the event bus')
+            return None
+
+        cls = ExporterTask if self.args.exporter == self.EXPORTER_TASK \
+            else ExporterProcess
+        return cls(
+            self._create_modsec_parser,
+            log.get_instance().get_log_path(),
+            interval=self.args.export_interval)
+
+    def _bus_ships_events(self):
+        '''
+        :return bool True if the event bus replaces the exporter, which then
+            has no log to read
+        '''
+        return self.SINK_ELASTICSEARCH in self._event_sinks
+
+    def _start_event_bus(self, worker_id=None):
+        '''
+        Event bus of this process, its thread does not survive a fork
+        '''
+        if not self._event_sinks:
+            return
+
+        bus = EventBus(
+            capacity=self.args.event_capacity,
+            descriptions=RuleDescriptions())
+        for sink in self._event_sinks:
+            bus.add_sink(self._create_event_sink(sink, worker_id))
+
+        bus.start()
+        self._event_bus = bus
+        self._proxy_settings.event_bus = bus
+
+    def _stop_event_bus(self):
+        if self._event_bus is not None:
+            self._proxy_settings.event_bus = None
+            self._event_bus.stop()
+            log.info('Event bus stopped', **self._event_bus.stats())
+            self._event_bus = None
+
+    def _log_timeouts(self):
+        wheel = self._proxy_settings.timer_wheel
+        if wheel is not None:
+            log.info('Client timeouts', **wheel.stats())
+
+    def _create_event_sink(self, sink, worker_id=None):
+        if sink == self.SINK_FILE:
+            # One file per worker, batches are not interleaved
+            name = 'modsecurity.events.json' if worker_id is None else \
+                'modsecurity.events.%d.json' % worker_id
+            return FileSink(log.get_instance().get_log_path(name))
+        if sink == self.SINK_ELASTICSEARCH:
+            return ElasticsearchSink(
+                BulkExporter(
+                    self.args.es_host,
+                    self.args.es_port,
+                    user=self.args.es_user,
+                    secret=self.args.es_secret,
+                    ca_file=self.args.es_ca))
+        return StdoutSink()
+
+    def _create_modsec_parser(self):
+        # Created where it runs, its threads do not survive a fork
+        return ModSecurityParser(
+            self.args.es_host,
+            self.args.es_port,
+            self.args.es_user,
+            self.args.es_secret,
+            max_segment_bytes=self.args.log_max_bytes,
+            backup_count=self.args.backup_count,
+            backup_max_bytes=self.args.backup_max_bytes,
+            ca_file=self.args.es_ca)
+
+    def _create_proxy(self, dst_host, dst_port, balancer=None):
+        admission = self._proxy_settings.admission
+        if admission is not None and not admission.accepts_connection():
+            # Full, nothing is allocated for this client
+            return RejectedConnection(self._templates.deny(503))
+
+        # The transaction is created once the client passed the IP table
+        p = Proxy(
+            dst_host,
+            dst_port,
+            None,
+            transaction_factory=self._create_transaction,
+            settings=self._proxy_settings,
+            balancer=balancer)
         return p
-    
-    def _start_parser(self):
-	    instance = log.get_instance()
-	    while True:
-		    time.sleep(10)
-		    self._modsec_parser.send(instance.get_log_path())
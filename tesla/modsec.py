@@ -2,102 +2,146 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import asyncio
 import datetime
 import json
 import os
-import re
-import shutil
-import time
-import zipfile
-from elasticsearch import Elasticsearch
 import actionslog as log
+from tesla.bulk_exporter import BulkExporter
+from tesla.log_backup import LogBackup
+from tesla.log_tailer import LogTailer
+from tesla.modsec_event import ModSecurityEvent
+from tesla.rule_descriptions import RuleDescriptions
 
 __author__ = "Cristian Souza <cristianmsbr@gmail.com>"
 __copyright__ = "Copyright 2018, Actions Security"
 
 class ModSecurityParser():
-	def __init__(self, host, port, user, secret):
-		self.es = Elasticsearch([host + ':' + str(port)], http_auth = (user, secret))
-		self.descriptions_file = open("tesla/descriptions.txt", "r").readlines()
+	def __init__(self, host, port, user, secret, max_segment_bytes = 10 * 1024 * 1024, backup_count = 30, backup_max_bytes = 1024 * 1024 * 1024, ca_file = None):
+		self.exporter = BulkExporter(host, port, user = user, secret = secret, ca_file = ca_file)
+		self.descriptions = RuleDescriptions("tesla/descriptions.txt")
 
 		self.dir_count = 0
 		self.file_count = 0
-		self.zip_path = None
 		self.backup_path = os.path.expanduser("~") + "/modsec_logs_backup/"
+		self.backup = LogBackup(self.backup_path, max_segment_bytes = max_segment_bytes, max_count = backup_count, max_bytes = backup_max_bytes, hold = self.holds_segment)
+		self.backup.start()
+		self.tailer = None
 
 		self.today = datetime.datetime.now().strftime("%Y/%m/%d")
 
-	def send(self, path_to_directory):
-		print("[!] Searching for files...")
-		self.zip_path = self.backup_path + str(datetime.datetime.now()) + ".zip"
-
-		file_obj = open(path_to_directory + "/modsecurity.log", "r")
-		text = file_obj.read()
-
-		if (len(text) > 0):
-			for item in text.split("\n"):
-				if ("ModSecurity" in item):
-					data = self.parse(item)
+	def get_tailer(self, path_to_directory):
+		path = path_to_directory + "/modsecurity.log"
+		if self.tailer is None or self.tailer.path != path:
+			if self.tailer is not None:
+				self.tailer.close()
 
-					if (data is not None):
-						self.send_to_elasticsearch(data)
-						self.make_backup(path_to_directory)
+			# Kept with the backups, a restart resumes from there
+			self.tailer = LogTailer(path, checkpoint_path = self.backup_path + "modsecurity.log.checkpoint")
+			self.backup.submit_pending(path)
 
-			print("[*] File {} sent!".format(path_to_directory + "/modsecurity.log"))
+		return self.tailer
 
-		file_obj.close()
+	def send(self, path_to_directory):
+		tailer = self.get_tailer(path_to_directory)
+		self.descriptions.reload_if_changed()
+		sent = 0
+
+		# Only the lines appended since the last call, in bounded batches
+		lines = tailer.read_lines()
+		while lines:
+			shipped = self.ship(self.parse_lines(lines))
+			if (shipped is None):
+				tailer.rewind()
+				return
+			sent += shipped
+			tailer.commit()
+			lines = tailer.read_lines()
+
+		self.finish_send(tailer, sent)
+
+	async def send_async(self, path_to_directory):
+		'''
+		send() for an event loop: the log is read, parsed and shipped by a
+		thread of the loop executor, the loop only waits for it
+		'''
+		loop = asyncio.get_event_loop()
+		await loop.run_in_executor(None, self.send, path_to_directory)
+
+	def parse_lines(self, lines):
+		docs = []
+		for item in lines:
+			if ("ModSecurity" in item):
+				data = self.parse(item)
+
+				if (data is not None):
+					docs.append(data)
+
+		return docs
+
+	def ship(self, docs):
+		'''
+		:return int documents shipped, None if some could not be sent, the
+			lines are then read again by the next call
+		'''
+		for data in docs:
+			self.send_to_elasticsearch(data)
+
+		# Shipped before the position is saved
+		unshipped = self.exporter.flush(wait = True)
+		if (unshipped > 0):
+			log.warn("Log lines not shipped, reading them again next time", documents = unshipped)
+			return None
+		return len(docs)
+
+	def finish_send(self, tailer, sent):
+		'''
+		Called once every line read was shipped, never after a failed ship:
+		the lines to read again would be rotated away
+		'''
+		if (sent > 0):
+			log.debug("Log file sent", path = tailer.path, events = sent)
+
+		# Also moves the checkpoint to a new file the tailer followed
+		tailer.commit()
+		# The tailer reads the rest of the segment through its open file
+		self.backup.rotate(tailer.path)
+
+	def holds_segment(self, segment):
+		'''
+		Called by the backup thread before a segment is compressed
+		:return bool True while the checkpoint is in `segment`, its lines
+			may still have to be read
+		'''
+		tailer = self.tailer
+		if (tailer is None or tailer.committed_inode is None):
+			return False
+		try:
+			return os.stat(segment).st_ino == tailer.committed_inode
+		except FileNotFoundError:
+			return False
 
 	def parse(self, item):
-		items = {}
-
-		line = item.strip()
-		start_msg_modsec = line.find("ModSecurity:")
-		end_msg_modesec = line.find("[file")
-		line_without_msg = line[:start_msg_modsec] + line[end_msg_modesec:]
-		split = re.findall("\[.*?\]", line_without_msg)
-
-		if ("[\\d.:]" in split):
-			split.remove("[\\d.:]")
+		event = ModSecurityEvent.parse(item)
+		if (event is None):
+			return None
 
-		for item in split:
-			item = item.replace("[", "")
-			item = item.replace("]", "")
+		items = event.to_dict()
 
-			tag = item.split(" ")
-			tag_name = tag[0]
+		attack_type = self.descriptions.lookup(event.file)
+		if (attack_type is not None):
+			items["type"] = attack_type
 
-			item = re.findall(r'"([^"]*)"', item)
-			try:
-				if (item[0] is not None):
-					items[tag_name] = item[0]
-			except:
-				pass
-
-		print(items)
-
-		for line in self.descriptions_file:
-			line = line.split("|")
-			if (line[0] in items["file"]):
-				items["type"] = line[1]
-
-		items["backup"] = self.zip_path
+		items["backup"] = self.backup_path
 		items["date"] = self.today
 
 		return json.dumps(items)
 
 	def send_to_elasticsearch(self, data):
-		self.es.index(index = "modsecurity_logs", doc_type = "modsecurity", body = data)
-
-	def make_backup(self, path):
-		if not os.path.exists(self.backup_path):
-			os.makedirs(self.backup_path)
-
-		self.zip_file = zipfile.ZipFile(self.zip_path, "w", zipfile.ZIP_DEFLATED)
-
-		for root, dirs, files in os.walk(path):
-			for file in files:
-				self.zip_file.write(os.path.join(root, file))
-				open(os.path.join(root, file), 'w').close() # truncate
+		self.exporter.add(data)
 
-		self.zip_file.close()
-		print("[!] Backup done, file saved in: " + self.zip_path)
+	def close(self):
+		if self.tailer is not None:
+			self.tailer.close()
+		self.exporter.close()
+		self.backup.stop()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import re
+
+
+def _to_int(value):
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+class ModSecurityEvent(object):
+    '''
+    A ModSecurity log line, parsed from its `[name "value"]` tags.
+
+    The values are kept as the strings of the line and the numeric fields
+    are converted when read, most events are only turned into a dict once.
+    '''
+
+    FIELDS = ('file', 'line', 'id', 'rev', 'msg', 'data', 'severity', 'ver',
+              'maturity', 'accuracy', 'hostname', 'uri', 'unique_id', 'ref')
+    INT_FIELDS = ('line', 'id', 'severity', 'maturity', 'accuracy')
+
+    __slots__ = ('_fields', 'tags')
+
+    _NAMES = frozenset(FIELDS)
+    _INTS = frozenset(INT_FIELDS)
+
+    # `[name "value"]`, the value ends at the `"]` closing the tag. Values
+    # may hold quotes and brackets coming from the request
+    _TAG = re.compile(
+        r'\[(\w+) "([^"]*(?:"(?!\] \[\w+ "|\]\s*$)[^"]*)*)"\]')
+
+    def __init__(self, fields, tags=None):
+        '''
+        @param fields: dict name: str value, taken over by the event. The
+            last value of a repeated tag wins
+        @param tags: list(str) values of the `tag` tags
+        '''
+        fields.pop('tag', None)
+        self._fields = fields
+        self.tags = tags or []
+
+    def __getattr__(self, name):
+        # Only called for the FIELDS, the slots are found first
+        if name not in self._NAMES:
+            raise AttributeError(name)
+        value = self._fields.get(name)
+        if name in self._INTS:
+            return _to_int(value)
+        return value
+
+    @property
+    def extra(self):
+        '''
+        :return dict tags of the line that are not FIELDS
+        '''
+        return {
+            name: value
+            for name, value in self._fields.items() if name not in self._NAMES
+        }
+
+    @classmethod
+    def parse(cls, line):
+        '''
+        @param line: str log line
+        :return ModSecurityEvent|None None if the line has no rule `file`
+        '''
+        # Tags start after the message, which may hold anything
+        start = line.find('[file "')
+        if start < 0:
+            return None
+
+        # Fast path, C splits only: `file "a"] [line "1"] [tag "t"] [...`.
+        # The `tag` values are split apart first, they are the only repeated
+        # ones; the other names and values alternate once both separators
+        # are the same
+        parts = line[start + 1:line.rindex('"]')].split('"] [tag "')
+        head = parts[0]
+        tags = parts[1:]
+        if tags and '"] [' in tags[-1]:
+            # hostname, uri... follow the tags
+            tags[-1], _, rest = tags[-1].partition('"] [')
+            head += '"] [' + rest
+        count = head.count('"] [') + 1
+        tokens = head.replace('"] [', ' "').split(' "')
+        if len(tokens) == 2 * count and '"] [' not in '\n'.join(tags):
+            fields = dict(zip(tokens[::2], tokens[1::2]))
+        else:
+            # A value holds `"] [` or ` "`, or tags are not contiguous
+            pairs = cls._TAG.findall(line, start)
+            fields = dict(pairs)
+            tags = [value for name, value in pairs if name == 'tag']
+        return cls(fields, tags)
+
+    def to_dict(self):
+        '''
+        :return dict fields of the event, `tag` is its last tag and `tags`
+            all of them
+        '''
+        data = dict(self._fields)
+        for name in self.INT_FIELDS:
+            value = data.get(name)
+            if value is not None:
+                data[name] = _to_int(value)
+
+        if self.tags:
+            data['tag'] = self.tags[-1]
+            data['tags'] = list(self.tags)
+        return data
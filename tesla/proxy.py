@@ -1,20 +1,28 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import socket
+import time
 
 import httptools
 
 import actionslog as log
 from ModSecurity import ModSecurityIntervention
+from tesla.body_spool import BodySpool
 from tesla.http_parser_protocol import HttpParserProtocol
+from tesla.ip_table import IpTable
+from tesla.connection_log import ConnectionLog
+from tesla.proxy_settings import ProxySettings
+from tesla.response_templates import ResponseTemplates
 from tesla.sized_buffer import SizedBuffer
 from tesla.tesla_exception import TeslaException
+from tesla.timer_wheel import TimerWheel
 
 
 class Proxy(asyncio.Protocol):
     @classmethod
     def StrToBytes(cls, data):
-        if not isinstance(data, bytes):
+        if isinstance(data, str):
             return bytes(data, 'utf-8')
         else:
             return data
@@ -26,31 +34,120 @@ class Proxy(asyncio.Protocol):
         else:
             return str(data)
 
-    def __init__(self, dst_host, dst_port, transaction):
+    def __init__(self,
+                 dst_host,
+                 dst_port,
+                 transaction,
+                 transaction_factory=None,
+                 settings=None,
+                 balancer=None):
         '''
         @param dst_host: str host to connect to
         @param dst_port: int port to connect to
-        @param transaction: ModSecurity.Transaction
+        @param transaction: ModSecurity.Transaction, if None the first one is
+            created by `transaction_factory` once the client is accepted
+        @param transaction_factory: callable() -> ModSecurity.Transaction used
+            to start a new transaction for each request of a keep-alive
+            connection, if None the connection is closed after the first
+            response
+        @param settings: ProxySettings options, if None the defaults are used
+        @param balancer: Balancer choosing the backend of each target
+            connection, if None `dst_host:dst_port` is used
         '''
         self._dst_host = dst_host
         self._dst_port = dst_port
         self._transport = None
         self._target_transport = None
+        self._target_task = None
+        self._target = None
         self._transaction = transaction
-        self._body_processed = False
-        if transaction is None:
+        self._transaction_factory = transaction_factory
+        self._settings = settings or ProxySettings()
+        self._balancer = balancer
+
+        # Routing by virtual host: the request is inspected by the default
+        # transaction until its Host is known, then replayed into a
+        # transaction on the rules of its route
+        self._default_route = (transaction_factory, dst_host, dst_port,
+                               balancer)
+        self._transaction_route = None
+        self._sni = None
+        self._request_host = None
+        self._request_uri = None
+        self._request_headers = []
+        self._backend = None
+        self._request_sent_at = None
+        self._response_latency = None
+        self._body_spool = None
+        self._pending_body = None
+
+        self._client_host = None
+        self._client_port = None
+        self._sockname = None
+        self._client_gone = False
+
+        # Admission control: the connection is counted once made, a request
+        # holds an in-flight slot from its first bytes to the end of its
+        # response. Data received while waiting for a slot is held here
+        self._admission = None
+        self._admitted_at = None
+        self._held_data = None
+
+        # Trusted clients are tunneled to the target as is, nothing is parsed
+        # nor inspected
+        self._tunnel = False
+
+        self._requests = 0
+        self._in_request = False
+        self._awaiting_response = False
+        self._keep_alive = False
+        # A single deadline per connection: the earliest of the timeouts of
+        # the current state (idle, header, body, request or keep-alive)
+        self._timer_wheel = self._settings.timer_wheel
+        if self._timer_wheel is None:
+            self._timer_wheel = TimerWheel.default()
+        self._deadline = None
+        self._request_started_at = None
+        self._request_chunked = False
+        self._response_chunked = False
+        self._response_head_sent = False
+        self._response_content_type = None
+        self._response_content_length = None
+        self._inspect_response_body = True
+
+        self._client_reading_paused = False
+        self._client_write_paused = False
+        self._target_reading_paused = False
+        self._target_write_paused = False
+
+        self._log = ConnectionLog(
+            sample_every=self._settings.log_sample_every,
+            dst_host=dst_host,
+            dst_port=dst_port)
+
+        if transaction is None and transaction_factory is None:
             self.abort()
             e = TeslaException(
                 'Could not create a proxy without a transaction')
             log.error(e, component='ModSecurity')
             raise e
 
-        self._client_buffer = SizedBuffer()
-        self._target_buffer = SizedBuffer()
+        self._client_buffer = SizedBuffer(
+            soft_limit=self._settings.buffer_soft_limit,
+            hard_limit=self._settings.buffer_hard_limit)
+        self._target_buffer = SizedBuffer(
+            soft_limit=self._settings.buffer_soft_limit,
+            hard_limit=self._settings.buffer_hard_limit)
 
         self._request_url = None
 
+        # Raw bytes of the request head being received, None once the head
+        # is complete. Forwarded as is instead of serializing each header
+        self._request_head = bytearray()
+
         self._request_parser_handler = HttpParserProtocol()
+        self._request_parser_handler.on_message_begin.add_callback(
+            self.on_request_message_begin)
         self._request_parser_handler.on_url.add_callback(self.on_request_url)
         self._request_parser_handler.on_header.add_callback(
             self.on_request_header)
@@ -65,6 +162,8 @@ class Proxy(asyncio.Protocol):
             self._request_parser_handler)
 
         self._response_parser_handler = HttpParserProtocol()
+        self._response_parser_handler.on_message_begin.add_callback(
+            self.on_response_message_begin)
         self._response_parser_handler.on_header.add_callback(
             self.on_response_header)
         self._response_parser_handler.on_headers_complete.add_callback(
@@ -79,6 +178,8 @@ class Proxy(asyncio.Protocol):
             self._response_parser_handler)
 
     def cleanup(self):
+        self._set_deadline(None, None)
+        self._close_body_spools()
         self._request_parser_handler.disconnect()
         self._response_parser_handler.disconnect()
 
@@ -110,10 +211,9 @@ class Proxy(asyncio.Protocol):
 
         self._client_host = peername[0]
         self._client_port = peername[1]
-        log.info(
-            'New client',
-            client_host=self._client_host,
-            client_port=self._client_port)
+        self._log.bind(
+            client_host=self._client_host, client_port=self._client_port)
+        self._log.info('New client')
 
         sockname = transport.get_extra_info('sockname')
 
@@ -121,59 +221,149 @@ class Proxy(asyncio.Protocol):
             e = TeslaException('Invalid sockname was returned!')
             log.error(e, sockname=sockname)
             raise e
+        self._sockname = sockname
+
+        self._admission = self._settings.admission
+        if self._admission is not None:
+            self._admission.connection_opened()
+
+        ip_table = self._settings.ip_table
+        action = ip_table.lookup(self._client_host) \
+            if ip_table is not None else None
+        if action == IpTable.DENY:
+            # Decided without ModSecurity, no transaction is created
+            self._log.debug('Client denied by the IP table')
+            self._reject(403)
+            return
+
+        if action == IpTable.TRUST:
+            self._log.debug('Client trusted by the IP table, not inspected')
+            self._tunnel = True
+            self._create_target_connection()
+            return
+
+        if not self._check_rate(self._settings.rate_limiter):
+            return
+
+        self._set_deadline(
+            'idle', self._deadline_after(self._settings.idle_timeout))
+
+        if self._transaction is None:
+            self._transaction = self._transaction_factory()
+            if self._transaction is None:
+                e = TeslaException('Could not create a new transaction')
+                log.error(e, component='ModSecurity')
+                self.close()
+                return
 
         self._transaction.processConnection(
             self._client_host, self._client_port, sockname[0], sockname[1])
 
         if self._process_intervention():
-            log.info('ModSecurity got a disruptive intervention. Skipping')
+            self._log.info(
+                'ModSecurity got a disruptive intervention. Skipping')
+            return
+
+        if self._settings.router is not None:
+            ssl_object = transport.get_extra_info('ssl_object')
+            self._sni = getattr(ssl_object, 'sni', None)
+            # The target is known once the Host header is
             return
 
         self._create_target_connection()
 
     def _create_target_connection(self):
-        log.info(
-            'Estabilshing connection to target',
-            dst_host=self._dst_host,
-            dst_port=self._dst_port,
-        )
+        self._log.info('Estabilshing connection to target')
         loop = asyncio.get_event_loop()
-        self._target_coro = loop.create_connection(
-            lambda: ProxyTarget(self), self._dst_host, self._dst_port)
+        pool = self._settings.upstream_pool
+        if self._balancer is not None:
+            self._target_coro = self._balancer.connect(self, pool)
+        elif pool is not None:
+            self._target_coro = pool.acquire(self._dst_host, self._dst_port,
+                                             self)
+        else:
+            self._target_coro = loop.create_connection(
+                lambda: ProxyTarget(self), self._dst_host, self._dst_port)
         task = loop.create_task(self._target_coro)
         task.add_done_callback(self._create_target_connection_callback)
+        self._target_task = task
         return task
 
     def _create_target_connection_callback(self, future):
-        if not future.cancelled():
-            exc = future.exception()
-            if exc is not None:
-                # TODO: should we send something to the client?
-                log.warn(
-                    'Error trying to connect to dst_host',
-                    dst_host=self._dst_host,
-                    dst_port=self._dst_port)
-                self.close()
+        self._target_task = None
+        if future.cancelled():
+            return
+
+        exc = future.exception()
+        if exc is not None:
+            # TODO: should we send something to the client?
+            self._log.warn('Error trying to connect to dst_host')
+            self.close()
+            return
+
+        if self._balancer is not None:
+            self._backend, self._target = future.result()
+            if self._response_latency is not None:
+                # The response head came before this callback
+                self._balancer.observe(self._backend, self._response_latency)
+                self._response_latency = None
+        elif self._settings.upstream_pool is not None:
+            self._target = future.result()
+        else:
+            self._target = future.result()[1]
+
+        if self._client_gone:
+            # The client left while connecting, a pooled connection would
+            # count against the pool limit for good
+            self._target.close()
+            self._release_backend()
 
     def connection_lost(self, exc):
-        log.info(
-            'Client connection lost',
-            client_host=self._client_host,
-            client_port=self._client_port,
-            reason=exc if exc is not None else 'EOF')
+        if self._log.info_enabled:
+            self._log.info(
+                'Client connection lost',
+                reason=exc if exc is not None else 'EOF')
 
+        self._set_deadline(None, None)
+        self._close_body_spools()
         self._transport = None
+        self._client_gone = True
+        self._release_backend()
+        if self._admission is not None:
+            self._release_admission(completed=False)
+            self._admission.connection_closed()
         if self._target_transport is not None:
             # Wait buffer to be flushed
             self._process_buffers()
             self._target_transport.close()
 
+    def pause_writing(self):
+        self._client_write_paused = True
+        self._update_target_reading()
+
+    def resume_writing(self):
+        self._client_write_paused = False
+        self._update_target_reading()
+
     def data_received(self, data):
-        log.info(
-            'Client sent data',
-            client_host=self._client_host,
-            client_port=self._client_port,
-            length=len(data))
+        if self._log.sample():
+            self._log.info_sampled('Client sent data', length=len(data))
+
+        if self._tunnel:
+            self.send_to_target(data)
+            self._process_buffers()
+            return
+
+        if self._held_data is not None:
+            self._held_data += data
+            return
+
+        if self._admission is not None and self._admitted_at is None and \
+                not self._admit(data):
+            return
+
+        if self._request_head is not None:
+            self._request_head += data
 
         try:
             self._request_parser.feed_data(data)
@@ -185,33 +375,46 @@ class Proxy(asyncio.Protocol):
     #  TARGET CALLBACKS
     ############################################################################
     def target_connection_made(self, transport):
-        log.info(
-            'Connection to target established',
-            dst_host=self._dst_host,
-            dst_port=self._dst_port,
-        )
+        self._log.info('Connection to target established')
         self._target_transport = transport
 
         self._process_buffers()
+        self._drain_pending_body()
+
+    def target_pause_writing(self):
+        self._target_write_paused = True
+        self._update_client_reading()
+
+    def target_resume_writing(self):
+        self._target_write_paused = False
+        self._update_client_reading()
+        self._drain_pending_body()
 
     def target_connection_lost(self, exc):
-        log.info(
-            'Connection to target was lost',
-            dst_host=self._dst_host,
-            dst_port=self._dst_port,
-            reason=exc if exc is not None else 'EOF')
+        if self._log.info_enabled:
+            self._log.info(
+                'Connection to target was lost',
+                reason=exc if exc is not None else 'EOF')
 
         self._target_transport = None
-        if self._transport is not None:
+        self._target = None
+        self._release_backend()
+        self._target_reading_paused = False
+        self._target_write_paused = False
+        self._update_client_reading()
+        if self._transport is not None and (self._in_request or
+                                            self._tunnel):
             # Wait buffer to be flushed
             self._transport.close()
 
     def target_data_received(self, data):
-        log.info(
-            'Target sent data',
-            dst_host=self._dst_host,
-            dst_port=self._dst_port,
-            length=len(data))
+        if self._log.sample():
+            self._log.info_sampled('Target sent data', length=len(data))
+
+        if self._tunnel:
+            self.send_to_client(data)
+            self._process_buffers()
+            return
 
         try:
             self._response_parser.feed_data(data)
@@ -222,12 +425,51 @@ class Proxy(asyncio.Protocol):
     ############################################################################
     #   Request Callbacks
     ############################################################################
+    def on_request_message_begin(self):
+        self._set_deadline(None, None)
+
+        if self._awaiting_response:
+            # HTTP pipelining is not supported. Stop parsing this client and
+            # close the connection once the current response is sent
+            self._log.info(
+                'Pipelined request received, closing after response')
+            self._request_parser_handler.disconnect()
+            self._request_head = None
+            self._keep_alive = False
+            return
+
+        if self._requests > 0 and (
+                not self._check_rate(self._settings.rate_limiter) or
+                not self._start_transaction()):
+            return
+
+        self._requests += 1
+        self._in_request = True
+        self._request_started_at = self._timer_wheel.time()
+        self._arm_request_deadline('header')
+        self._request_chunked = False
+        # Left set by the previous response of a keep-alive connection
+        self._response_head_sent = False
+        self._request_url = None
+
+        if self._settings.router is not None:
+            self._request_host = None
+            self._request_uri = None
+            self._request_headers.clear()
+            return
+
+        if self._target_transport is None and self._target_task is None:
+            # The target closed its side while this connection was idle
+            self._create_target_connection()
+
     def on_request_url(self, url):
         self._request_url = url
 
     def _process_url(self):
         url = self._request_url
         self._request_url = None
+        if self._settings.router is not None:
+            self._request_uri = url
 
         if not self._transaction.processURI(
                 url, self._request_parser.get_method(),
@@ -238,10 +480,15 @@ class Proxy(asyncio.Protocol):
                 method=self._request_parser.get_method(),
                 http_version=self._request_parser.get_http_version())
 
-        if self._process_intervention():
-            log.info('ModSecurity got a disruptive intervention. Skipping')
+        if self._process_header_intervention():
+            self._log.info(
+                'ModSecurity got a disruptive intervention. Skipping')
             return False
 
+        if self._request_head:
+            # The whole head is forwarded once it is accepted
+            return True
+
         data = '{method} {url} HTTP/{version}\n'
         data = data.format(
             method=Proxy.BytesToStr(self._request_parser.get_method()),
@@ -262,8 +509,22 @@ class Proxy(asyncio.Protocol):
                 value=value,
                 component='ModSecurity')
 
-        if self._process_intervention():
-            log.info('ModSecurity got a disruptive intervention. Skipping')
+        if self._settings.router is not None:
+            self._request_headers.append((name, value))
+            if Proxy.StrToBytes(name).lower() == b'host':
+                self._request_host = value
+
+        if self._process_header_intervention():
+            self._log.info(
+                'ModSecurity got a disruptive intervention. Skipping')
+            return
+
+        if isinstance(name, bytes) and \
+                name.lower() == b'transfer-encoding' and \
+                b'chunked' in value.lower():
+            self._request_chunked = True
+
+        if self._request_head:
             return
 
         data = '{}: {}\n'.format(
@@ -271,7 +532,21 @@ class Proxy(asyncio.Protocol):
         self.send_to_target(data)
 
     def on_request_headers_complete(self):
-        log.info('Request headers completed')
+        self._log.info('Request headers completed')
+        head = self._request_head
+        self._arm_request_deadline('body')
+
+        if self._request_url is not None:
+            # Requests without headers. The head is still pending, so the URL
+            # is not serialized on its own
+            if not self._process_url():
+                self._request_head = None
+                return
+        self._request_head = None
+
+        if self._settings.router is not None and not self._route_request():
+            return
+
         if not self._transaction.processRequestHeaders():
             log.warn(
                 'ModSecurity could not process request headers',
@@ -279,33 +554,188 @@ class Proxy(asyncio.Protocol):
         # TODO check for upgrade headers
 
         if self._process_intervention():
-            log.info('ModSecurity got a disruptive intervention. Skipping')
+            self._log.info(
+                'ModSecurity got a disruptive intervention. Skipping')
             return
 
-        self.send_to_target('\n')
+        if head:
+            self._send_request_head(head)
+        else:
+            self.send_to_target('\n')
+        self._process_buffers()
+        if self._balancer is not None:
+            self._request_sent_at = time.monotonic()
+
+    def _route_request(self):
+        '''
+        Move the request to the rules and the target of its virtual host
+        :return True if the request can go on, False otherwise
+        '''
+        route = self._settings.router.lookup(self._request_host or self._sni)
+        if route is not None and not self._check_rate(route.rate_limiter):
+            return False
+
+        factory, dst_host, dst_port, balancer = self._default_route
+        if route is not None:
+            factory = route.transaction_factory or factory
+            if route.dst_host is not None:
+                dst_host = route.dst_host
+                dst_port = route.dst_port
+                balancer = route.balancer
+
+        if self._log.info_enabled:
+            self._log.info(
+                'Request routed',
+                host=self._request_host,
+                route=route.name if route is not None else None)
+
+        if route is not self._transaction_route:
+            self._transaction_route = route
+            # Later requests start on the rules of this route
+            self._transaction_factory = factory
+            if not self._replay_transaction(factory):
+                return False
+
+        if (dst_host, dst_port, balancer) != \
+                (self._dst_host, self._dst_port, self._balancer):
+            self._drop_target()
+            self._dst_host = dst_host
+            self._dst_port = dst_port
+            self._balancer = balancer
+            self._log.bind(dst_host=dst_host, dst_port=dst_port)
+
+        if self._target_transport is None and self._target_task is None:
+            self._create_target_connection()
+        return True
+
+    def _replay_transaction(self, factory):
+        '''
+        Start a transaction with `factory` and feed it what the current one
+        got so far: connection, URI and headers
+        :return True if the request can go on, False otherwise
+        '''
+        transaction = factory() if factory is not None else None
+        if transaction is None:
+            e = TeslaException('Could not create a routed transaction')
+            log.error(e, component='ModSecurity')
+            self.close()
+            return False
+
+        self._transaction = transaction
+        transaction.processConnection(self._client_host, self._client_port,
+                                      self._sockname[0], self._sockname[1])
+        if self._process_intervention():
+            self._log.info(
+                'ModSecurity got a disruptive intervention. Skipping')
+            return False
+
+        transaction.processURI(self._request_uri,
+                               self._request_parser.get_method(),
+                               self._request_parser.get_http_version())
+        for name, value in self._request_headers:
+            transaction.addRequestHeader(name, value)
+        return True
+
+    def _drop_target(self):
+        '''
+        Let go of the target connection of the previous request, it goes to
+        another target
+        '''
+        if self._target_task is not None:
+            self._target_task.cancel()
+            self._target_task = None
+
+        target = self._target
+        if target is None or self._release_target():
+            return
+
+        self._target = None
+        self._target_transport = None
+        self._release_backend()
+        target.detach()
+        target.close()
+
+    def _send_request_head(self, head):
+        '''
+        Forward the request head as it was received
+        @param head: bytearray data received since the request started, it
+            may contain the beginning of the body
+        '''
+        start, end = Proxy._find_head_bounds(head)
+        segment = memoryview(head)[start:end]
+
+        if self._target_transport is not None and \
+                not self._target_transport.is_closing() and \
+                self._target_buffer.tell() == 0:
+            self._target_transport.write(segment)
+        else:
+            self.send_to_target(segment)
+
+    @classmethod
+    def _find_head_bounds(cls, head):
+        '''
+        :return tuple(int, int) offsets of the request line and of the end
+            of the empty line closing the head
+        '''
+        start = 0
+        while start < len(head) and head[start] in b'\r\n':
+            # Empty lines before the request line are ignored by parsers
+            start += 1
+
+        lf = head.find(b'\n\n', start)
+        crlf = head.find(b'\n\r\n', start)
+        if crlf != -1 and (lf == -1 or crlf < lf):
+            return start, crlf + 3
+        if lf != -1:
+            return start, lf + 2
+        return start, len(head)
 
     def on_request_body(self, body):
-        log.info('Request body received')
-        self._body_processed = True
+        if self._log.sample():
+            self._log.info_sampled('Request body received', length=len(body))
+        self._arm_request_deadline('body')
+        # The body rules run once, when the request is complete
         if not self._transaction.appendRequestBody(body):
             log.warn(
                 'ModSecurity could not feed request body',
                 component='ModSecurity')
 
-        if not self._transaction.processRequestBody():
-            log.warn(
-                'ModSecurity could not process request body',
-                component='ModSecurity')
-
-        if self._process_intervention():
-            log.info('ModSecurity got a disruptive intervention. Skipping')
+        if self._settings.body_policy == ProxySettings.BODY_STREAM:
+            self._send_body_to_target(body)
             return
 
-        self.send_to_target(body)
+        if self._body_spool is None:
+            self._body_spool = BodySpool(self._settings.body_memory_limit,
+                                         self._settings.body_spool_dir)
+        max_length = self._settings.body_max_length
+        if max_length and self._body_spool.length + len(body) > max_length:
+            # Never spool an endless body to disk
+            self._log.info('Request body too large', max_length=max_length)
+            self._request_parser_handler.disconnect()
+            self._reject(413)
+            return
+        self._body_spool.write(body)
+
+    def _send_body_to_target(self, body):
+        if self._request_chunked:
+            # httptools hands the body without the chunked framing
+            self.send_to_target(b'%x\r\n' % len(body))
+            self.send_to_target(body)
+            self.send_to_target(b'\r\n')
+        else:
+            self.send_to_target(body)
+        self._process_buffers()
 
     ############################################################################
     #   Response Callbacks
     ############################################################################
+    def on_response_message_begin(self):
+        self._response_chunked = False
+        self._response_head_sent = False
+        self._response_content_type = None
+        self._response_content_length = None
+        self._inspect_response_body = True
+
     def on_response_header(self, name, value):
         if not self._transaction.addResponseHeader(name, value):
             log.warn(
@@ -314,18 +744,41 @@ class Proxy(asyncio.Protocol):
                 value=value,
                 component='ModSecurity')
 
-        if self._process_intervention():
-            log.info('ModSecurity got a disruptive intervention. Skipping')
+        if self._process_header_intervention():
+            self._log.info(
+                'ModSecurity got a disruptive intervention. Skipping')
             return
-        
+
+        if isinstance(name, bytes):
+            lower_name = name.lower()
+            if lower_name == b'content-type':
+                self._response_content_type = value
+            elif lower_name == b'content-length':
+                try:
+                    self._response_content_length = int(value)
+                except ValueError:
+                    pass
+
         if not value == b'chunked':
             data = '{}: {}\n'.format(
             Proxy.BytesToStr(name), Proxy.BytesToStr(value))
 
             self.send_to_client(data)
+        else:
+            # The body is sent without the chunked framing, so the client
+            # can only find its end when the connection is closed
+            self._response_chunked = True
 
     def on_response_headers_complete(self):
-        log.info('Response headers completed')
+        self._log.info('Response headers completed')
+        if self._request_sent_at is not None:
+            latency = time.monotonic() - self._request_sent_at
+            self._request_sent_at = None
+            if self._backend is not None:
+                self._balancer.observe(self._backend, latency)
+            else:
+                self._response_latency = latency
+
         if not self._transaction.processResponseHeaders(
                 self._response_parser.get_status_code(),
                 self._response_parser.get_http_version()):
@@ -334,13 +787,26 @@ class Proxy(asyncio.Protocol):
                 component='ModSecurity')
 
         if self._process_intervention():
-            log.info('ModSecurity got a disruptive intervention. Skipping')
+            self._log.info(
+                'ModSecurity got a disruptive intervention. Skipping')
             return
 
+        policy = self._settings.response_policy
+        if policy is not None:
+            self._inspect_response_body = policy.should_inspect(
+                self._response_content_type, self._response_content_length)
+
         self.send_to_client('\n')
+        if self._process_buffers()[1] > 0:
+            self._response_head_sent = True
 
     def on_response_body(self, body):
-        log.info('Response body received', length=len(body))
+        if self._log.sample():
+            self._log.info_sampled('Response body received', length=len(body))
+        if not self._inspect_response_body:
+            self._pass_through_to_client(body)
+            return
+
         if not self._transaction.appendResponseBody(body):
             log.warn(
                 'ModSecurity could not feed response body',
@@ -352,13 +818,15 @@ class Proxy(asyncio.Protocol):
                 component='ModSecurity')
 
         if self._process_intervention():
-            log.info('ModSecurity got a disruptive intervention. Skipping')
+            self._log.info(
+                'ModSecurity got a disruptive intervention. Skipping')
             return
 
         self.send_to_client(body)
+        self._process_buffers()
 
     def on_response_status(self, status):
-        log.info('Response status received')
+        self._log.info('Response status received')
 
         if not self._transaction.addResponseHeader(
                 'HTTP/%s' % self._response_parser.get_http_version(),
@@ -369,8 +837,9 @@ class Proxy(asyncio.Protocol):
                 status=status,
                 component='ModSecurity')
 
-        if self._process_intervention():
-            log.info('ModSecurity got a disruptive intervention. Skipping')
+        if self._process_header_intervention():
+            self._log.info(
+                'ModSecurity got a disruptive intervention. Skipping')
             return
 
         data = 'HTTP/{version} {status_code} {status}\n'
@@ -383,29 +852,301 @@ class Proxy(asyncio.Protocol):
         self.send_to_client(data)
     
     def on_request_message_completed(self):
-        if not self._body_processed:
-            if not self._transaction.processRequestBody():
-                log.warn(
+        # The client is done, waiting for the target is not its fault
+        self._set_deadline(None, None)
+        self._request_started_at = None
+        self._awaiting_response = True
+        self._keep_alive = self._can_keep_alive()
+        self._request_head = bytearray()
+
+        if not self._transaction.processRequestBody():
+            log.warn(
                 'ModSecurity could not process request body',
                 component='ModSecurity')
 
-            if self._process_intervention():
-                log.info('ModSecurity got a disruptive intervention. Skipping')
+        if self._process_intervention():
+            self._log.info(
+                'ModSecurity got a disruptive intervention. Skipping')
+            return
+
+        # The body was accepted, forward what was held
+        self._pending_body = self._body_spool
+        self._body_spool = None
+        if self._pending_body is None:
+            self._finish_request_body()
+        else:
+            self._drain_pending_body()
+
+    def _drain_pending_body(self):
+        '''
+        Forward the held body as fast as the target takes it. Called again
+        when the target connects or asks to resume writing
+        '''
+        while self._pending_body is not None and \
+                self._target_transport is not None and \
+                not self._target_write_paused:
+            data = self._pending_body.read()
+            if not data:
+                self._pending_body.close()
+                self._pending_body = None
+                self._finish_request_body()
                 return
 
+            self._send_body_to_target(data)
+
+    def _finish_request_body(self):
+        if self._request_chunked:
+            self.send_to_target(b'0\r\n\r\n')
+            self._process_buffers()
+
+    def _close_body_spools(self):
+        if self._body_spool is not None:
+            self._body_spool.close()
+            self._body_spool = None
+
+        if self._pending_body is not None:
+            self._pending_body.close()
+            self._pending_body = None
+
     def on_response_message_completed(self):
-        self._process_buffers() 
+        self._process_buffers()
+        self._in_request = False
+        self._awaiting_response = False
+        if self._admission is not None:
+            self._release_admission(completed=True)
+
+        if self._pending_body is not None:
+            # The target answered before taking the whole body
+            self.close()
+            return
+        self._release_target()
+
+        if not self._keep_alive or self._response_chunked or \
+                not self._response_parser.should_keep_alive():
+            self.close()
+            return
+
+        self._schedule_keep_alive_timeout()
+
+    ############################################################################
+    #   Keep-alive
+    ############################################################################
+    def _can_keep_alive(self):
+        '''
+        Check if the client connection may serve another request after the
+        current one. `should_keep_alive` handles both `Connection: close` and
+        HTTP/1.0 semantics
+        '''
+        if self._transaction_factory is None:
+            return False
+
+        max_requests = self._settings.max_requests
+        if max_requests and self._requests >= max_requests:
+            return False
+
+        return self._request_parser.should_keep_alive()
+
+    def _start_transaction(self):
+        '''
+        Start a new ModSecurity transaction for the next request of a
+        keep-alive connection
+        :return True if the request can go on, False otherwise
+        '''
+        transaction = self._transaction_factory()
+        if transaction is None:
+            e = TeslaException('Could not create a new transaction')
+            log.error(e, component='ModSecurity')
+            self.close()
+            return False
+
+        self._transaction = transaction
+        self._transaction.processConnection(
+            self._client_host, self._client_port, self._sockname[0],
+            self._sockname[1])
+
+        if self._process_intervention():
+            self._log.info(
+                'ModSecurity got a disruptive intervention. Skipping')
+            return False
+
+        return True
+
+    def _release_target(self):
+        '''
+        Give the target connection back to the upstream pool, if any, so
+        other requests can reuse it
+        :return True if the connection was released, False otherwise
+        '''
+        pool = self._settings.upstream_pool
+        if pool is None or self._target is None or \
+                not self._response_parser.should_keep_alive():
+            return False
+
+        target = self._target
+        self._target = None
+        self._target_transport = None
+        self._release_backend()
+        if self._target_reading_paused:
+            # The next owner must get a connection that is reading
+            target.transport.resume_reading()
+            self._target_reading_paused = False
+        self._target_write_paused = False
+        pool.release(target)
+        self._update_client_reading()
+        return True
+
+    def _release_backend(self):
+        '''
+        Stop counting the target connection as active on its backend
+        '''
+        if self._backend is not None:
+            self._balancer.release(self._backend)
+            self._backend = None
+
+    def _schedule_keep_alive_timeout(self):
+        self._set_deadline(
+            'keep_alive',
+            self._deadline_after(self._settings.keep_alive_timeout))
+
+    def _on_keep_alive_timeout(self):
+        self._log.info('Keep-alive connection timed out')
         self.close()
 
+    ############################################################################
+    #   Deadlines
+    ############################################################################
+    def _deadline_after(self, timeout, start=None):
+        '''
+        :return float|None time of the wheel `timeout` seconds after
+            `start` (now by default), None if `timeout` is 0
+        '''
+        if not timeout:
+            return None
+        if start is None:
+            start = self._timer_wheel.time()
+        return start + timeout
+
+    def _set_deadline(self, name, deadline):
+        '''
+        Replace the deadline of the connection
+        @param name: str timeout that expires at `deadline`
+        @param deadline: float|None time of the wheel, None cancels it
+        '''
+        if deadline is None:
+            if self._deadline is not None:
+                self._deadline.cancel()
+                self._deadline = None
+        elif self._deadline is None:
+            self._deadline = self._timer_wheel.call_at(
+                deadline, self._on_deadline, name)
+        else:
+            self._timer_wheel.move(self._deadline, deadline, name)
+
+    def _arm_request_deadline(self, name):
+        '''
+        Give the client `<name>_timeout` seconds from now to send more of the
+        request, within the whole request deadline
+        '''
+        deadline = self._deadline_after(
+            getattr(self._settings, name + '_timeout'))
+        end = self._deadline_after(self._settings.request_timeout,
+                                   self._request_started_at)
+        if end is not None and (deadline is None or end < deadline):
+            name, deadline = 'request', end
+        self._set_deadline(name, deadline)
+
+    def _on_deadline(self):
+        name = self._deadline.name
+        self._deadline = None
+        if self._transport is None:
+            return
+
+        if name == 'keep_alive':
+            self._on_keep_alive_timeout()
+            return
+
+        if self._client_reading_paused:
+            # Not read on purpose, the client is not the slow one
+            self._set_deadline(name, self._deadline_after(
+                getattr(self._settings, name + '_timeout')))
+            return
+
+        self._log.info('Client timed out', timeout=name)
+        self._timer_wheel.timeouts[name] += 1
+        self._request_parser_handler.disconnect()
+        if self._response_head_sent:
+            self.close()
+        else:
+            self._reject(408)
+
+    ############################################################################
+    #   Admission
+    ############################################################################
+    def _admit(self, data):
+        '''
+        Take an in-flight slot for the request starting with `data`. When
+        none is free the data is held and the client is not read until a
+        slot is, or the request is answered 503 if it can not wait
+        :return True if the data can be parsed now, False otherwise
+        '''
+        admitted = self._admission.acquire(self._on_admitted,
+                                           self._on_admission_timeout)
+        if admitted:
+            self._admitted_at = time.monotonic()
+            return True
+
+        if admitted is None:
+            self._log.debug('Request waiting for admission')
+            self._held_data = bytearray(data)
+            self._update_client_reading()
+            return False
+
+        self._log.debug('Request shed, too many requests in flight')
+        self._reject(503)
+        return False
+
+    def _on_admitted(self):
+        self._admitted_at = time.monotonic()
+        # Called while another connection releases its slot
+        asyncio.get_event_loop().call_soon(self._feed_held_data)
+
+    def _feed_held_data(self):
+        data, self._held_data = self._held_data, None
+        if self._transport is None or data is None:
+            return
+        self._update_client_reading()
+        self.data_received(bytes(data))
+
+    def _on_admission_timeout(self):
+        self._log.debug('Request shed, waited too long for admission')
+        self._held_data = None
+        self._reject(503)
+
+    def _release_admission(self, completed):
+        '''
+        Give the in-flight slot back, or leave the queue
+        @param completed: bool the response was sent, its latency tunes the
+            limit
+        '''
+        if self._admitted_at is not None:
+            latency = time.monotonic() - self._admitted_at \
+                if completed else None
+            self._admitted_at = None
+            self._admission.release(latency)
+        elif self._held_data is not None:
+            self._held_data = None
+            self._admission.cancel(self._on_admitted)
+
     ############################################################################
     #   Other
     ############################################################################
     def _flush_buffer(self, buffer, transport):
-        length = 0
+        length = buffer.tell()
 
-        if buffer.tell() > 0:
-            length = transport.write(buffer.getvalue())
+        if length > 0:
+            transport.write(buffer.getvalue())
             buffer.seek(0)
+            buffer.truncate()
 
         return length
 
@@ -413,14 +1154,71 @@ class Proxy(asyncio.Protocol):
         """
         Make sure the buffers are empty and all data
         are flushed to their destination
+        :return tuple(int, int) bytes flushed to the target and to the client
         """
+        target_length = 0
+        client_length = 0
+
         if self._target_transport is not None and \
                 not self._target_transport.is_closing():
-            self._flush_buffer(self._target_buffer, self._target_transport)
+            target_length = self._flush_buffer(self._target_buffer,
+                                               self._target_transport)
 
         if self._transport is not None and \
                 not self._transport.is_closing():
-            self._flush_buffer(self._client_buffer, self._transport)
+            client_length = self._flush_buffer(self._client_buffer,
+                                               self._transport)
+
+        self._update_client_reading()
+        self._update_target_reading()
+        return target_length, client_length
+
+    def _update_client_reading(self):
+        '''
+        Pause reading the client while the target can not take more data,
+        either because its transport asked so or because the data waiting
+        for the target reached the buffer soft limit
+        '''
+        paused = self._target_write_paused or \
+            self._target_buffer.soft_reached or self._held_data is not None
+        if paused == self._client_reading_paused or self._transport is None or \
+                self._transport.is_closing():
+            return
+
+        self._client_reading_paused = paused
+        if paused:
+            self._transport.pause_reading()
+        else:
+            self._transport.resume_reading()
+
+    def _update_target_reading(self):
+        '''
+        Pause reading the target while the client can not take more data
+        '''
+        paused = self._client_write_paused or self._client_buffer.soft_reached
+        if paused == self._target_reading_paused or \
+                self._target_transport is None or \
+                self._target_transport.is_closing():
+            return
+
+        self._target_reading_paused = paused
+        if paused:
+            self._target_transport.pause_reading()
+        else:
+            self._target_transport.resume_reading()
+
+    def _pass_through_to_client(self, data):
+        '''
+        Send data that ModSecurity does not need to see, straight to the
+        client transport when nothing is waiting before it
+        '''
+        if self._transport is not None and \
+                not self._transport.is_closing() and \
+                self._client_buffer.tell() == 0:
+            self._transport.write(data)
+        else:
+            self.send_to_client(data)
+            self._process_buffers()
 
     def send_to_client(self, data, overwrite=False):
         """
@@ -428,7 +1226,8 @@ class Proxy(asyncio.Protocol):
         :param list(bytes) data:
         """
         if overwrite:
-            self._client_buffer = SizedBuffer()
+            self._client_buffer.seek(0)
+            self._client_buffer.truncate()
             self._client_buffer.write(Proxy.StrToBytes(data))
         else:
             self._client_buffer.write(Proxy.StrToBytes(data))
@@ -440,6 +1239,18 @@ class Proxy(asyncio.Protocol):
         """
         self._target_buffer.write(Proxy.StrToBytes(data))
 
+    def _process_header_intervention(self):
+        '''
+        Check for an intervention after an URI, status or header was added.
+        ModSecurity only runs the rules at the phase boundaries, so the
+        `phase` intervention mode skips these checks
+        :return True if we got a disruptive intervention, false otherwise
+        '''
+        if self._settings.intervention_mode == ProxySettings.INTERVENTION_PHASE:
+            return False
+
+        return self._process_intervention()
+
     def _process_intervention(self):
         '''
         Process and check if there's a ModSecurity intervention
@@ -455,7 +1266,25 @@ class Proxy(asyncio.Protocol):
         if self._transaction.intervention(intervention):
 
             if intervention.log is not None:
-                log.info(intervention.log, component='ModSecurity')
+                bus = self._settings.event_bus
+                if bus is not None:
+                    bus.push(
+                        'intervention',
+                        intervention.log,
+                        client_host=self._client_host,
+                        client_port=self._client_port)
+                if bus is None or self._settings.log_interventions:
+                    self._log.info(intervention.log, component='ModSecurity')
+
+            if self._response_head_sent and \
+                    (intervention.url is not None or
+                     intervention.status != 200 or intervention.disruptive):
+                # The response is already being streamed to the client,
+                # there is no way to answer it properly anymore
+                self._log.info('Disruptive intervention after the response '
+                               'started, aborting')
+                self.abort()
+                return True
 
             if intervention.url is not None:
                 self.send_redirect_to_client(
@@ -472,26 +1301,46 @@ class Proxy(asyncio.Protocol):
 
             return intervention.disruptive
         else:
-            log.debug('ModSecurity found no interventions')
+            self._log.debug('ModSecurity found no interventions')
 
         return False
 
-    def send_redirect_to_client(self, url, status_code=302):
-        f = open('etc/templates/302.txt', mode='r')
-        redirect_template = f.read()
-        f.close()
+    @property
+    def templates(self):
+        return self._settings.templates or ResponseTemplates.default()
 
-        body = redirect_template
-        print('---------------------------- redirect')
-        self.send_to_client(body, overwrite=True)
+    def _check_rate(self, rate_limiter):
+        '''
+        Take a request from the client's bucket, answer 429 when it is
+        empty
+        :return True if the request can go on, False otherwise
+        '''
+        if rate_limiter is None or rate_limiter.allow(
+                rate_limiter.client_key(self._client_host)):
+            return True
 
-    def send_deny_to_client(self, status_code=403):
-        f = open('etc/templates/403.txt', mode='r')
-        forbidden_template = f.read()
-        f.close()
+        self._log.debug('Client is over its rate limit')
+        # Nothing else is read from this client
+        self._request_parser_handler.disconnect()
+        self._reject(429)
+        return False
 
-        body = forbidden_template
-        self.send_to_client(body, overwrite=True)
+    def _reject(self, status_code):
+        '''
+        Answer with a ready-made response and close, without ModSecurity
+        '''
+        self.send_deny_to_client(status_code)
+        self._process_buffers()
+        self.close()
+
+    def send_redirect_to_client(self, url, status_code=302):
+        response = self.templates.redirect(
+            Proxy.BytesToStr(url), status=status_code)
+        self.send_to_client(response, overwrite=True)
+
+    def send_deny_to_client(self, status_code=403):
+        response = self.templates.deny(status_code)
+        self.send_to_client(response, overwrite=True)
 
 
 class ProxyTarget(asyncio.Protocol):
@@ -499,16 +1348,91 @@ class ProxyTarget(asyncio.Protocol):
     This is an internal class and the main purpose is to create
     a proxy callback-based with the target. Idealy all events
     here must be emitted to and treated in `Proxy`.
+    When it belongs to an `UpstreamPool` it can be detached from its
+    parent while idle and attached to another one later.
     """
 
-    def __init__(self, parent):
+    def __init__(self, parent, pool=None, key=None):
         self._parent = parent
+        self._pool = pool
+        self._key = key
+        self._transport = None
+        self._released_at = None
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def transport(self):
+        return self._transport
+
+    @property
+    def released_at(self):
+        return self._released_at
+
+    def attach(self, parent):
+        self._parent = parent
+        self._released_at = None
+        parent.target_connection_made(self._transport)
+
+    def detach(self):
+        self._parent = None
+        self._released_at = time.monotonic()
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+    def is_alive(self):
+        '''
+        Check if an idle connection can be reused: it must be open and
+        the target must not have sent anything (EOF included)
+        '''
+        if self._transport is None or self._transport.is_closing():
+            return False
+
+        sock = self._transport.get_extra_info('socket')
+        if sock is None:
+            return True
+
+        # Transport sockets do not allow recv, peek through a detached copy
+        peek = socket.socket(fileno=sock.fileno())
+        try:
+            peek.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            return False
+        finally:
+            peek.detach()
+
+        return False
 
     def connection_made(self, transport):
-        self._parent.target_connection_made(transport)
+        self._transport = transport
+        if self._parent is not None:
+            self._parent.target_connection_made(transport)
 
     def connection_lost(self, exc):
-        self._parent.target_connection_lost(exc)
+        self._transport = None
+        if self._pool is not None:
+            self._pool.discard(self)
+
+        if self._parent is not None:
+            self._parent.target_connection_lost(exc)
+
+    def pause_writing(self):
+        if self._parent is not None:
+            self._parent.target_pause_writing()
+
+    def resume_writing(self):
+        if self._parent is not None:
+            self._parent.target_resume_writing()
 
     def data_received(self, data):
-        self._parent.target_data_received(data)
+        if self._parent is not None:
+            self._parent.target_data_received(data)
+        else:
+            # Idle connections must not receive anything
+            self.close()
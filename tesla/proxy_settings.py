@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from tesla.auto_property import autoproperty
+from tesla.tesla_exception import TeslaException
+
+
+@autoproperty(keep_alive_timeout=5.0)
+@autoproperty(idle_timeout=10.0)
+@autoproperty(header_timeout=10.0)
+@autoproperty(body_timeout=10.0)
+@autoproperty(request_timeout=60.0)
+@autoproperty(timer_wheel=None)
+@autoproperty(max_requests=100)
+@autoproperty(upstream_pool=None)
+@autoproperty(buffer_soft_limit=64 * 1024)
+@autoproperty(buffer_hard_limit=1024 * 1024)
+@autoproperty(intervention_mode='header')
+@autoproperty(body_policy='buffer')
+@autoproperty(body_memory_limit=64 * 1024)
+@autoproperty(body_spool_dir=None)
+@autoproperty(body_max_length=13107200)
+@autoproperty(response_policy=None)
+@autoproperty(templates=None)
+@autoproperty(log_sample_every=64)
+@autoproperty(event_bus=None)
+@autoproperty(log_interventions=True)
+@autoproperty(router=None)
+@autoproperty(ip_table=None)
+@autoproperty(rate_limiter=None)
+@autoproperty(admission=None)
+class ProxySettings(object):
+    INTERVENTION_HEADER = 'header'
+    INTERVENTION_PHASE = 'phase'
+    INTERVENTION_MODES = (INTERVENTION_HEADER, INTERVENTION_PHASE)
+
+    BODY_BUFFER = 'buffer'
+    BODY_STREAM = 'stream'
+    BODY_POLICIES = (BODY_BUFFER, BODY_STREAM)
+
+    def __init__(self, **kwargs):
+        '''
+        Options shared by all the `Proxy` objects of a server
+
+        @param keep_alive_timeout: float seconds an idle keep-alive client
+            connection is kept open, 0 disables the timeout
+        @param idle_timeout: float seconds a new client connection may wait
+            before sending its first request
+        @param header_timeout: float seconds a client may take to send the
+            headers of a request
+        @param body_timeout: float seconds a client may wait between two
+            reads of a request body
+        @param request_timeout: float seconds a client may take to send a
+            whole request. Expired clients get a 408, 0 disables a timeout
+        @param timer_wheel: TimerWheel of the timeouts, if None the shared
+            default is used
+        @param max_requests: int max requests served by a single client
+            connection, 0 means no limit
+        @param upstream_pool: UpstreamPool shared by the proxies to reuse
+            target connections, if None a connection is made per client
+        @param buffer_soft_limit: int bytes waiting for one side after which
+            the other side stops being read
+        @param buffer_hard_limit: int bytes waiting for one side after which
+            writing raises an IOError
+        @param intervention_mode: str `header` checks for interventions after
+            each header, `phase` only at the phase boundaries
+        @param body_policy: str `buffer` holds the request body until
+            ModSecurity accepts it, `stream` forwards it while it is received
+            and only the verdict waits for the end of the request
+        @param body_memory_limit: int bytes of a held request body kept in
+            memory, larger bodies are spilled to a temporary file
+        @param body_spool_dir: str directory of the spilled bodies, if None
+            the system default is used
+        @param body_max_length: int bytes of a held request body, larger
+            requests get a 413. 0 for no limit, the disk is then the limit
+        @param response_policy: ResponseInspectionPolicy deciding which
+            response bodies go through ModSecurity, if None all of them do
+        @param templates: ResponseTemplates block and redirect responses, if
+            None the shared default is used
+        @param log_sample_every: int log one of every `log_sample_every`
+            per-chunk events (data received, body chunks), 0 disables them
+        @param event_bus: EventBus where the intervention logs go, if None
+            they are written to the log
+        @param log_interventions: bool also write the intervention logs to
+            the log when they go to the event bus, the exporter reads them
+            there
+        @param router: HostRouter choosing the rules and the target of each
+            request from its Host header, if None every request uses the
+            rules and the target of its server
+        @param ip_table: IpTable of the client addresses denied before any
+            transaction is created, if None every client is inspected
+        @param rate_limiter: RateLimiter of the requests of each client
+            address, if None the requests are not limited
+        @param admission: AdmissionControl bounding the requests in flight,
+            the requests over it wait or get a 503, if None every request is
+            admitted
+        '''
+        for key, value in kwargs.items():
+            if key not in self.__properties__:
+                raise TeslaException('Unknown proxy setting "%s"' % key)
+            setattr(self, key, value)
+
+        if self.intervention_mode not in self.INTERVENTION_MODES:
+            raise TeslaException(
+                'Unknown intervention mode "%s"' % self.intervention_mode)
+
+        if self.body_policy not in self.BODY_POLICIES:
+            raise TeslaException(
+                'Unknown request body policy "%s"' % self.body_policy)
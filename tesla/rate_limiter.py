@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import collections
+import socket
+import time
+
+from tesla.tesla_exception import TeslaException
+
+
+class RateLimiter(object):
+    '''
+    Token bucket per client: a bucket holds up to `burst` tokens, refills
+    at `rate` tokens per second and every request takes one.
+
+    Buckets live in an LRU table of at most `max_clients` entries. A
+    bucket is refilled lazily when its client comes back, so an idle
+    client costs nothing but its entry; the least recently seen clients
+    are evicted first and come back with a full bucket. The memory stays
+    bounded however many distinct addresses are seen.
+
+    An eviction forgives the client its debt: a source cycling through
+    more than `max_clients` keys gets full buckets back. Such evictions of
+    buckets that were not full are counted as `resets`, a growing count
+    means `max_clients` is too small for the traffic.
+
+    IPv6 clients are keyed by their `ipv6_prefix` network (see
+    `client_key`), a host owning a whole /64 can not get a new bucket per
+    address.
+    '''
+
+    def __init__(self, rate, burst=None, max_clients=100000,
+                 clock=time.monotonic, ipv6_prefix=64):
+        '''
+        @param rate: float requests per second allowed to a client
+        @param burst: float requests a client may send at once, defaults to
+            `rate` (at least 1)
+        @param max_clients: int clients tracked at once
+        @param clock: callable() -> float seconds
+        @param ipv6_prefix: int bits of an IPv6 address that make a client
+        '''
+        if rate <= 0:
+            raise TeslaException('The rate limit should be positive')
+        if max_clients <= 0:
+            raise TeslaException('max_clients should be positive')
+        if not 0 < ipv6_prefix <= 128:
+            raise TeslaException('ipv6_prefix should be between 1 and 128')
+
+        self._rate = float(rate)
+        self._burst = float(burst) if burst else max(self._rate, 1.0)
+        self._max_clients = max_clients
+        self._clock = clock
+        self._ipv6_shift = 128 - ipv6_prefix
+        # key: [tokens, last refill]
+        self._buckets = collections.OrderedDict()
+
+        self.allowed = 0
+        self.limited = 0
+        self.evicted = 0
+        self.resets = 0
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def burst(self):
+        return self._burst
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def stats(self):
+        '''
+        :return dict requests allowed and limited, clients tracked and
+            evicted from the table, evicted while not full
+        '''
+        return {
+            'allowed': self.allowed,
+            'limited': self.limited,
+            'clients': len(self._buckets),
+            'evicted': self.evicted,
+            'resets': self.resets,
+        }
+
+    def client_key(self, address):
+        '''
+        @param address: str client IP address
+        :return str|int `address` for IPv4 (and IPv4-mapped IPv6), the int of
+            its network for IPv6
+        '''
+        if ':' not in address:
+            return address
+        try:
+            ip = int.from_bytes(
+                socket.inet_pton(socket.AF_INET6, address), 'big')
+        except (OSError, ValueError):
+            return address
+        if ip >> 32 == 0xffff:
+            # ::ffff:a.b.c.d from a dual-stack socket
+            return socket.inet_ntop(socket.AF_INET,
+                                    (ip & 0xffffffff).to_bytes(4, 'big'))
+        return ip >> self._ipv6_shift
+
+    def allow(self, key, cost=1.0):
+        '''
+        Take `cost` tokens from the bucket of `key`
+        @param key: hashable client key, usually its address
+        :return bool False if the client is over its rate
+        '''
+        now = self._clock()
+        buckets = self._buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self._max_clients:
+                _, evicted = buckets.popitem(last=False)
+                self.evicted += 1
+                if evicted[0] + (now - evicted[1]) * self._rate < \
+                        self._burst:
+                    self.resets += 1
+            bucket = buckets[key] = [self._burst, now]
+        else:
+            buckets.move_to_end(key)
+            tokens = bucket[0] + (now - bucket[1]) * self._rate
+            bucket[0] = tokens if tokens < self._burst else self._burst
+            bucket[1] = now
+
+        if bucket[0] < cost:
+            self.limited += 1
+            return False
+
+        bucket[0] -= cost
+        self.allowed += 1
+        return True
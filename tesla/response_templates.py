@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import html
+import os
+from http import HTTPStatus
+from string import Template
+
+import actionslog as log
+
+
+class ResponseTemplates(object):
+    '''
+    Block and redirect responses sent on disruptive interventions.
+    Templates are read and rendered once into ready-to-send bytes, the
+    status line, Content-Length and Location are filled in here.
+
+    A template is an HTTP response where `$status`, `$reason` and `$url`
+    are replaced. Its status line and Content-Length are ignored.
+    '''
+
+    DENY = '403.txt'
+    REDIRECT = '302.txt'
+
+    # Statuses rendered when the templates are loaded
+    DENY_STATUSES = (400, 403, 404, 405, 406, 408, 413, 429, 500, 501, 502,
+                     503)
+
+    MAX_REDIRECTS = 256
+
+    _default = None
+
+    @classmethod
+    def default(cls):
+        '''
+        :return ResponseTemplates shared instance using `etc/templates`
+        '''
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def __init__(self, directory='etc/templates'):
+        '''
+        @param directory: str directory of the 403.txt and 302.txt templates
+        '''
+        self._directory = directory
+        self._deny_template = None
+        self._redirect_template = None
+        self._deny = {}
+        self._redirects = {}
+        self.reload()
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def reload(self):
+        '''
+        Read the templates again and render the responses
+        '''
+        deny_template = self._load(self.DENY)
+        redirect_template = self._load(self.REDIRECT)
+
+        deny = {}
+        for status in self.DENY_STATUSES:
+            deny[status] = self._render(deny_template, status)
+
+        # Swap everything at once, requests never see a partial reload
+        self._deny_template = deny_template
+        self._redirect_template = redirect_template
+        self._deny = deny
+        self._redirects = {}
+
+        log.debug('Response templates loaded', directory=self._directory)
+
+    def deny(self, status=403):
+        '''
+        :return bytes response blocking the request with `status`
+        '''
+        response = self._deny.get(status)
+        if response is None:
+            response = self._render(self._deny_template, status)
+            self._deny[status] = response
+        return response
+
+    def redirect(self, url, status=302):
+        '''
+        :return bytes response redirecting the request to `url`
+        '''
+        if not 300 <= status < 400:
+            status = 302
+
+        key = (status, url)
+        response = self._redirects.get(key)
+        if response is None:
+            if len(self._redirects) >= self.MAX_REDIRECTS:
+                self._redirects.clear()
+            response = self._render(self._redirect_template, status, url)
+            self._redirects[key] = response
+        return response
+
+    def _load(self, name):
+        with open(os.path.join(self._directory, name), mode='r') as f:
+            text = f.read()
+
+        head, _, body = text.replace('\r\n', '\n').partition('\n\n')
+        headers = [
+            line for line in head.split('\n')[1:]
+            if line and not line.lower().startswith('content-length:')
+        ]
+        return Template('\r\n'.join(headers)), Template(body)
+
+    def _render(self, template, status, url=''):
+        try:
+            reason = HTTPStatus(status).phrase
+        except ValueError:
+            reason = 'Unknown'
+
+        headers, body = template
+        # The url comes from the rules, never let it break the head
+        header_url = url.replace('\r', '').replace('\n', '')
+
+        body = body.safe_substitute(
+            status=status, reason=reason,
+            url=html.escape(url)).encode('utf-8')
+        head = headers.safe_substitute(
+            status=status, reason=reason, url=header_url)
+
+        lines = ['HTTP/1.1 %d %s' % (status, reason)]
+        if head:
+            lines.append(head)
+        lines.append('Content-Length: %d' % len(body))
+        lines.append('Connection: close')
+
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8') + body
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from tesla.tesla_exception import TeslaException
+
+
+class Route(object):
+    '''
+    Where the requests of a virtual host go and which rules inspect them
+    '''
+
+    def __init__(self,
+                 name,
+                 transaction_factory=None,
+                 dst_host=None,
+                 dst_port=None,
+                 balancer=None,
+                 rate_limiter=None):
+        '''
+        @param name: str name of the route
+        @param transaction_factory: callable() -> ModSecurity.Transaction on
+            the rules of the route, None for the rules of the server
+        @param dst_host: str host to connect to, None for the target of the
+            server
+        @param dst_port: int port to connect to
+        @param balancer: Balancer of the target, None to use dst_host:dst_port
+        @param rate_limiter: RateLimiter of the requests of each client to
+            this route, on top of the server one, None for no limit
+        '''
+        self.name = name
+        self.transaction_factory = transaction_factory
+        self.dst_host = dst_host
+        self.dst_port = dst_port
+        self.balancer = balancer
+        self.rate_limiter = rate_limiter
+
+    def __repr__(self):
+        return 'Route(%s)' % self.name
+
+
+class HostRouter(object):
+    '''
+    Finds the route of a request from its Host header, or the TLS SNI
+    when it has none.
+
+    Exact names and wildcards (`*.example.com`) are kept in two dicts, a
+    lookup costs one dict access per label of the host. The most specific
+    name wins: `a.b.example.com` is looked for as is, then as
+    `*.b.example.com` and `*.example.com`.
+    '''
+
+    def __init__(self):
+        self._exact = {}
+        self._wildcards = {}
+
+    def __len__(self):
+        return len(self._exact) + len(self._wildcards)
+
+    def add(self, pattern, route):
+        '''
+        @param pattern: str host name, `*.` matches any subdomain
+        @param route: Route
+        '''
+        pattern = pattern.strip().lower().rstrip('.')
+        if pattern.startswith('*.'):
+            table, name = self._wildcards, pattern[2:]
+        else:
+            table, name = self._exact, pattern
+        if not name or '*' in name:
+            raise TeslaException('Invalid host pattern "%s"' % pattern)
+        if name in table:
+            raise TeslaException('Host "%s" is routed twice' % pattern)
+        table[name] = route
+
+    def lookup(self, host):
+        '''
+        @param host: str|bytes Host header or SNI, with or without port
+        :return Route|None None when no route matches
+        '''
+        if not host:
+            return None
+        if isinstance(host, bytes):
+            host = host.decode('latin-1')
+        host = self.normalize(host)
+
+        route = self._exact.get(host)
+        if route is not None or not self._wildcards:
+            return route
+
+        dot = host.find('.')
+        while dot != -1:
+            route = self._wildcards.get(host[dot + 1:])
+            if route is not None:
+                return route
+            dot = host.find('.', dot + 1)
+        return None
+
+    @staticmethod
+    def normalize(host):
+        '''
+        :return str lowercase host without port nor trailing dot
+        '''
+        host = host.strip().lower()
+        if host.startswith('['):
+            # [::1]:8080
+            return host[1:host.find(']')]
+        if host.count(':') == 1:
+            host = host[:host.find(':')]
+        return host.rstrip('.')
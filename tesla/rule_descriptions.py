@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import os
+
+import actionslog as log
+
+
+class RuleDescriptions(object):
+    '''
+    Attack type of a ModSecurity event, from the file of the rule that
+    matched. `descriptions.txt` lines are `RULE-FILE-NAME|Attack type`.
+
+    The file is indexed once by rule file name, names that are not in the
+    index are looked up by substring and the answer is remembered.
+    '''
+
+    MAX_CACHE = 1024
+
+    def __init__(self, path='tesla/descriptions.txt'):
+        '''
+        @param path: str descriptions file
+        '''
+        self._path = path
+        self._mtime = None
+        self._index = {}
+        self._cache = {}
+        self.reload()
+
+    @property
+    def path(self):
+        return self._path
+
+    def __len__(self):
+        return len(self._index)
+
+    def reload(self):
+        '''
+        Read the descriptions file again
+        '''
+        mtime = os.stat(self._path).st_mtime
+        index = {}
+        with open(self._path, 'r') as f:
+            for line in f:
+                name, sep, attack_type = line.strip().partition('|')
+                if sep and name:
+                    index[name] = attack_type
+
+        # Lookups never see a half built index
+        self._index = index
+        self._cache = {}
+        self._mtime = mtime
+        log.debug('Rule descriptions loaded', path=self._path, count=len(index))
+
+    def reload_if_changed(self):
+        '''
+        :return True if the file changed and was read again
+        '''
+        try:
+            if os.stat(self._path).st_mtime == self._mtime:
+                return False
+            self.reload()
+        except (OSError, ValueError) as e:
+            # Keep the index we have
+            log.warn('Could not reload the rule descriptions', error=str(e))
+            return False
+
+        return True
+
+    def lookup(self, rule_file):
+        '''
+        @param rule_file: str path of the rule file
+            (/etc/.../REQUEST-942-APPLICATION-ATTACK-SQLI.conf)
+        :return str|None attack type
+        '''
+        if not rule_file:
+            return None
+
+        name = os.path.basename(rule_file).split('.', 1)[0]
+        attack_type = self._index.get(name)
+        if attack_type is not None:
+            return attack_type
+
+        try:
+            return self._cache[rule_file]
+        except KeyError:
+            pass
+
+        # Custom rule files named after the CRS ones
+        attack_type = None
+        for name, description in self._index.items():
+            if name in rule_file:
+                attack_type = description
+
+        if len(self._cache) >= self.MAX_CACHE:
+            self._cache.clear()
+        self._cache[rule_file] = attack_type
+        return attack_type
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import collections
+import weakref
+
+import actionslog as log
+
+
+class RuleGenerations(object):
+    '''
+    Keeps the ModSecurity rules replaced by a reload alive while
+    transactions created on them are still running.
+
+    A transaction only points to its rules, they must outlive it. Every
+    transaction is counted against its rules until it is collected; rules
+    that were retired are dropped with their last transaction.
+    '''
+
+    def __init__(self):
+        self._live = collections.Counter()
+        self._retired = {}
+        self._tracking = True
+
+    def stats(self):
+        '''
+        :return dict retired rules still in use and their transactions
+        '''
+        return {
+            'retired': len(self._retired),
+            'transactions': sum(self._live[key] for key in self._retired),
+        }
+
+    def track(self, transaction, rules):
+        '''
+        Count `transaction` against `rules` until it is collected
+        '''
+        if not self._tracking:
+            return
+
+        key = id(rules)
+        try:
+            weakref.finalize(transaction, self._release, key)
+        except TypeError:
+            # No weak references to the transactions, retired rules are
+            # then kept for good
+            log.warn('Transactions can not be tracked, retired rules are '
+                     'never freed')
+            self._tracking = False
+            return
+        self._live[key] += 1
+
+    def retire(self, rules):
+        '''
+        `rules` are no longer used by new transactions
+        '''
+        key = id(rules)
+        if not self._tracking or self._live[key] > 0:
+            self._retired[key] = rules
+
+    def _release(self, key):
+        self._live[key] -= 1
+        if self._live[key] <= 0:
+            del self._live[key]
+            self._retired.pop(key, None)
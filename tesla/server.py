@@ -15,6 +15,7 @@ from tesla.proxy import Proxy
 @autoproperty(ssl=False)
 @autoproperty(cert='')
 @autoproperty(key='')
+@autoproperty(backlog=100)
 class Server(object):
     def __init__(self,
                  name,
@@ -25,7 +26,8 @@ class Server(object):
                  use_ssl=False,
                  cert='',
                  key='',
-                 proxy_creator_func=None):
+                 proxy_creator_func=None,
+                 backlog=100):
         '''
         @param name: str name of the server
         @param src_host: str host to bind the server
@@ -37,6 +39,8 @@ class Server(object):
         @param key: str path to the private key
         @param proxy_creator_func: callable(dst_host: str, dst_port: int) callable to
             creator proxy objects when needed, if none a default will be used
+        @param backlog: int connections the kernel queues before they are
+            accepted, kept short so an overloaded server refuses them early
         '''
         self.name = name
         self.src_host = src_host
@@ -46,17 +50,20 @@ class Server(object):
         self.ssl = use_ssl
         self.cert = cert
         self.key = key
+        self.backlog = backlog
         self._proxy_creator_func = proxy_creator_func or self._default_proxy_creator
 
         if self.ssl:
             self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
             self._ssl_context.load_cert_chain(self.cert, self.key)
+            self._ssl_context.sni_callback = Server._record_sni
         else:
             self._ssl_context = None
 
         log.info(
             'Starting server at {}:{} to {}:{}'.format(
                 self.src_host, self.src_port, self.dst_host, self.dst_port),
+            server=self.name,
             src_host=self.src_host,
             src_port=self.src_port,
             dst_host=self.dst_host,
@@ -68,18 +75,25 @@ class Server(object):
             self.src_host,
             self.src_port,
             ssl=self._ssl_context,
+            backlog=self.backlog,
             reuse_address=True,
             reuse_port=True)
         self._server_future = loop.create_task(self._coro)
         log.info(
             'Server is ready at {}:{} to {}:{}'.format(
                 self.src_host, self.src_port, self.dst_host, self.dst_port),
+            server=self.name,
             src_host=self.src_host,
             src_port=self.src_port,
             dst_host=self.dst_host,
             dst_port=self.dst_port,
         )
 
+    @staticmethod
+    def _record_sni(ssl_object, server_name, ssl_context):
+        # Read by the proxy to route requests without a Host header
+        ssl_object.sni = server_name
+
     def _default_proxy_creator(self, dst_host, dst_port):
         p = Proxy(dst_host, dst_port)
         return p
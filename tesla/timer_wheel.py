@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import math
+import time
+
+import actionslog as log
+
+
+class Timer(object):
+    __slots__ = ('deadline', 'callback', 'name', '_wheel', '_tick')
+
+    def __init__(self, wheel, deadline, callback, name):
+        self.deadline = deadline
+        self.callback = callback
+        self.name = name
+        self._wheel = wheel
+        self._tick = None
+
+    @property
+    def pending(self):
+        return self._tick is not None
+
+    def cancel(self):
+        self._wheel.cancel(self)
+
+
+class TimerWheel(object):
+    '''
+    Coarse timers for deadlines that are set and moved much more often than
+    they fire, such as the read deadlines of every client connection.
+
+    Timers are bucketed by tick of `resolution` seconds in a dict of sets:
+    adding, moving or cancelling one is a set operation, and a single loop
+    callback per tick fires the due buckets instead of one loop handle per
+    timer. A timer never fires before its deadline, and up to two
+    resolutions after it.
+
+    `timeouts` counts by name the timeouts that the owners of the timers
+    acted upon; a timer firing is not one by itself, it may be re-armed or
+    end an idle connection.
+    '''
+
+    _default = None
+
+    @classmethod
+    def default(cls):
+        '''
+        :return TimerWheel shared instance
+        '''
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def __init__(self, resolution=0.5, clock=time.monotonic):
+        '''
+        @param resolution: float seconds between two ticks
+        @param clock: callable() -> float seconds, monotonic
+        '''
+        self._resolution = resolution
+        self._clock = clock
+        # tick: set(Timer)
+        self._buckets = {}
+        self._count = 0
+        self._loop = None
+        self._handle = None
+
+        self.timeouts = collections.Counter()
+
+    @property
+    def resolution(self):
+        return self._resolution
+
+    def __len__(self):
+        return self._count
+
+    def time(self):
+        return self._clock()
+
+    def stats(self):
+        '''
+        :return dict timers pending and timeouts of each name
+        '''
+        return {
+            'pending': self._count,
+            'timeouts': dict(self.timeouts),
+        }
+
+    def call_at(self, deadline, callback, name=None):
+        '''
+        @param deadline: float time of the clock the timer fires at
+        @param callback: callable() called once the deadline is past
+        @param name: str what the timer stands for
+        :return Timer
+        '''
+        timer = Timer(self, deadline, callback, name)
+        self._insert(timer)
+        return timer
+
+    def call_later(self, delay, callback, name=None):
+        return self.call_at(self._clock() + delay, callback, name)
+
+    def move(self, timer, deadline, name=None):
+        '''
+        Change the deadline of a timer, pending or not. Within the same tick
+        the timer stays in its bucket
+        '''
+        if name is not None:
+            timer.name = name
+        timer.deadline = deadline
+        if timer._tick is not None:
+            if timer._tick == self._tick_of(deadline):
+                return
+            self._remove(timer)
+        self._insert(timer)
+
+    def cancel(self, timer):
+        if timer._tick is not None:
+            self._remove(timer)
+
+    def _tick_of(self, deadline):
+        # The first tick starting after the deadline: a tick is due once the
+        # clock reaches its start, ceil would fire up to a resolution early
+        return math.floor(deadline / self._resolution) + 1
+
+    def _insert(self, timer):
+        tick = self._tick_of(timer.deadline)
+        bucket = self._buckets.get(tick)
+        if bucket is None:
+            bucket = self._buckets[tick] = set()
+        bucket.add(timer)
+        timer._tick = tick
+        self._count += 1
+
+        loop = asyncio.get_event_loop()
+        if self._handle is None or self._loop is not loop:
+            self._loop = loop
+            self._handle = loop.call_later(self._resolution, self._run)
+
+    def _remove(self, timer):
+        bucket = self._buckets[timer._tick]
+        bucket.discard(timer)
+        if not bucket:
+            del self._buckets[timer._tick]
+        timer._tick = None
+        self._count -= 1
+
+    def _run(self):
+        self._handle = None
+        now = math.floor(self._clock() / self._resolution)
+        due = [tick for tick in self._buckets if tick <= now]
+        due.sort()
+        for tick in due:
+            # Callbacks may cancel or move timers of this bucket
+            bucket = self._buckets.pop(tick, ())
+            self._count -= len(bucket)
+            for timer in bucket:
+                timer._tick = None
+            for timer in bucket:
+                try:
+                    timer.callback()
+                except Exception as e:
+                    log.error(e, timer=timer.name)
+
+        if self._buckets and self._handle is None:
+            self._handle = self._loop.call_later(self._resolution, self._run)
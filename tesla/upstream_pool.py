@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import time
+
+import actionslog as log
+from tesla.proxy import ProxyTarget
+
+
+class UpstreamPool(object):
+    '''
+    Pool of idle keep-alive connections to the targets.
+    Connections are keyed by (dst_host, dst_port) and handed to new
+    requests instead of opening a new upstream connection each time.
+    '''
+
+    def __init__(self, max_idle=32, max_total=256, idle_timeout=30.0):
+        '''
+        @param max_idle: int max idle connections kept for each target
+        @param max_total: int max connections (idle and in use) for each
+            target, `acquire` waits for a release once it is reached
+        @param idle_timeout: float seconds an idle connection is kept
+        '''
+        self._max_idle = max_idle
+        self._max_total = max_total
+        self._idle_timeout = idle_timeout
+
+        self._idle = {}
+        self._total = collections.Counter()
+        self._waiters = {}
+        self._evict_handle = None
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_idle(self):
+        return self._max_idle
+
+    @property
+    def max_total(self):
+        return self._max_total
+
+    @property
+    def idle_timeout(self):
+        return self._idle_timeout
+
+    def stats(self):
+        '''
+        :return dict with the pool counters
+        '''
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'reuse_ratio': self.hits / requests if requests else 0.0,
+            'idle': sum(len(idle) for idle in self._idle.values()),
+            'total': sum(self._total.values()),
+        }
+
+    async def acquire(self, dst_host, dst_port, parent, connect_timeout=None):
+        '''
+        Get a connection to the target attached to `parent`
+        @param dst_host: str host to connect to
+        @param dst_port: int port to connect to
+        @param parent: Proxy that will receive the target events
+        @param connect_timeout: float seconds a new connection may take, the
+            wait for a free slot is not bounded by it. None for no limit
+        :rtype ProxyTarget:
+        '''
+        key = (dst_host, dst_port)
+
+        while True:
+            target = self._pop_idle(key)
+            if target is not None:
+                self.hits += 1
+                target.attach(parent)
+                return target
+
+            if self._total[key] < self._max_total:
+                break
+
+            waiter = asyncio.get_event_loop().create_future()
+            waiters = self._waiters.setdefault(key, collections.deque())
+            waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in waiters:
+                    waiters.remove(waiter)
+
+        self.misses += 1
+        self._total[key] += 1
+
+        loop = asyncio.get_event_loop()
+        try:
+            _, target = await asyncio.wait_for(
+                loop.create_connection(
+                    lambda: ProxyTarget(parent, pool=self, key=key),
+                    dst_host, dst_port), connect_timeout)
+        except BaseException:
+            self._total[key] -= 1
+            self._wake_waiter(key)
+            raise
+
+        return target
+
+    def release(self, target):
+        '''
+        Give back a connection whose last response was completed
+        @param target: ProxyTarget
+        '''
+        key = target.key
+        target.detach()
+
+        idle = self._idle.setdefault(key, collections.deque())
+        if not target.is_alive() or len(idle) >= self._max_idle:
+            # connection_lost will discard it from the pool
+            target.close()
+            return
+
+        idle.append(target)
+        self._wake_waiter(key)
+        self._schedule_eviction()
+
+    def discard(self, target):
+        '''
+        Forget a connection that was lost
+        @param target: ProxyTarget
+        '''
+        key = target.key
+        idle = self._idle.get(key)
+        if idle is not None and target in idle:
+            idle.remove(target)
+
+        self._total[key] -= 1
+        if self._total[key] <= 0:
+            del self._total[key]
+
+        self._wake_waiter(key)
+
+    def close(self):
+        '''
+        Close all idle connections
+        '''
+        if self._evict_handle is not None:
+            self._evict_handle.cancel()
+            self._evict_handle = None
+
+        for idle in list(self._idle.values()):
+            for target in list(idle):
+                target.close()
+
+    def _pop_idle(self, key):
+        idle = self._idle.get(key)
+        now = time.monotonic()
+
+        while idle:
+            # Most recently used first, it is the least likely to be closed
+            # by the target
+            target = idle.pop()
+            if now - target.released_at < self._idle_timeout and \
+                    target.is_alive():
+                return target
+
+            target.close()
+
+        return None
+
+    def _wake_waiter(self, key):
+        waiters = self._waiters.get(key)
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def _schedule_eviction(self):
+        if self._evict_handle is None and self._idle_timeout:
+            loop = asyncio.get_event_loop()
+            self._evict_handle = loop.call_later(self._idle_timeout / 2,
+                                                 self._evict)
+
+    def _evict(self):
+        self._evict_handle = None
+        deadline = time.monotonic() - self._idle_timeout
+        evicted = 0
+
+        for idle in list(self._idle.values()):
+            # Oldest connections are on the left
+            while idle and idle[0].released_at < deadline:
+                idle.popleft().close()
+                evicted += 1
+
+        if evicted:
+            log.debug('Evicted idle target connections', count=evicted)
+
+        if any(self._idle.values()):
+            self._schedule_eviction()
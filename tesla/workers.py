@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import os
+import signal
+import time
+
+import actionslog as log
+
+
+class WorkerSupervisor(object):
+    '''
+    Pre-fork supervisor.
+    Everything loaded before `run` (e.g. the ModSecurity rules) is shared
+    with the workers, which are restarted when they die and receive the
+    signals sent to the supervisor.
+    '''
+
+    STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+    FORWARD_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+
+    def __init__(self, count, target, restart_delay=1.0):
+        '''
+        @param count: int number of workers
+        @param target: callable(worker_id: int) -> int run in each worker,
+            the returned value is used as the worker exit code
+        @param restart_delay: float seconds to wait before restarting a
+            worker that died
+        '''
+        self._count = count
+        self._target = target
+        self._restart_delay = restart_delay
+        self._workers = {}
+        self._stopping = False
+        self._previous_handlers = {}
+
+    @property
+    def workers(self):
+        '''
+        :return dict pid -> worker id of the running workers
+        '''
+        return dict(self._workers)
+
+    def run(self):
+        '''
+        Start the workers and wait for them, restarting the ones that die
+        until a stop signal is received
+        :return int exit code
+        '''
+        self._install_signal_handlers()
+        try:
+            for worker_id in range(self._count):
+                if self._stopping:
+                    break
+                self._spawn(worker_id)
+
+            while self._workers:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+
+                worker_id = self._workers.pop(pid, None)
+                if worker_id is None:
+                    continue
+
+                if self._stopping:
+                    log.info(
+                        'Worker stopped', worker_id=worker_id, pid=pid)
+                    continue
+
+                log.warn(
+                    'Worker died, restarting',
+                    worker_id=worker_id,
+                    pid=pid,
+                    status=status)
+                time.sleep(self._restart_delay)
+                if not self._stopping:
+                    self._spawn(worker_id)
+        finally:
+            self._restore_signal_handlers()
+
+        return 0
+
+    def stop(self):
+        self._stopping = True
+        self._forward(signal.SIGTERM)
+
+    def _spawn(self, worker_id):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                for signum in self.FORWARD_SIGNALS:
+                    signal.signal(signum, signal.SIG_DFL)
+                code = self._target(worker_id) or 0
+            except BaseException as e:
+                log.error(e, worker_id=worker_id)
+            finally:
+                os._exit(code)
+
+        self._workers[pid] = worker_id
+        if self._stopping:
+            # A stop signal arrived before the worker was registered
+            os.kill(pid, signal.SIGTERM)
+
+        log.info('Worker started', worker_id=worker_id, pid=pid)
+        return pid
+
+    def _forward(self, signum):
+        for pid in list(self._workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _on_signal(self, signum, frame):
+        if signum in self.STOP_SIGNALS:
+            self._stopping = True
+
+        self._forward(signum)
+
+    def _install_signal_handlers(self):
+        for signum in self.FORWARD_SIGNALS:
+            self._previous_handlers[signum] = signal.signal(
+                signum, self._on_signal)
+
+    def _restore_signal_handlers(self):
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler)
+        self._previous_handlers.clear()
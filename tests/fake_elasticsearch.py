@@ -0,0 +1,100 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeElasticsearchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        es = self.server.elasticsearch
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        if self.path != '/_bulk':
+            return self._reply(404, {'error': 'not found'})
+
+        status, items = es.handle_bulk(self.headers, body)
+        if status != 200:
+            return self._reply(status, {'error': 'rejected'})
+
+        self._reply(200, {
+            'took': 1,
+            'errors': any(i['index']['status'] >= 300 for i in items),
+            'items': items,
+        })
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeElasticsearch(object):
+    '''
+    In-process Elasticsearch `_bulk` endpoint.
+    `fail_requests` whole requests are answered with `fail_status`, and
+    documents listed by `reject_docs` are answered with their item status.
+    '''
+
+    def __init__(self):
+        self.docs = []
+        self.requests = []
+        self.fail_requests = 0
+        self.fail_status = 429
+        # {doc field value: [item statuses, one per attempt]}
+        self.reject_docs = {}
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                           FakeElasticsearchHandler)
+        self._server.daemon_threads = True
+        self._server.elasticsearch = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={'poll_interval': 0.05},
+            daemon=True)
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle_bulk(self, headers, body):
+        lines = body.decode('utf-8').splitlines()
+        actions = [json.loads(l) for l in lines[0::2]]
+        docs = [json.loads(l) for l in lines[1::2]]
+
+        with self._lock:
+            self.requests.append({'headers': dict(headers), 'docs': docs,
+                                  'actions': actions})
+            if self.fail_requests > 0:
+                self.fail_requests -= 1
+                return self.fail_status, None
+
+            items = []
+            for doc in docs:
+                statuses = self.reject_docs.get(doc.get('id'))
+                status = statuses.pop(0) if statuses else 201
+                if status < 300:
+                    self.docs.append(doc)
+                items.append({'index': {'status': status}})
+            return 200, items
@@ -70,3 +70,12 @@ def http_request_with_body():
 def http_response():
     with open('etc/http_response.txt') as f:
         return bytes(f.read(), 'utf-8')
+
+
+@pytest.yield_fixture
+def elasticsearch():
+    from .fake_elasticsearch import FakeElasticsearch
+    es = FakeElasticsearch()
+    es.start()
+    yield es
+    es.stop()
@@ -13,6 +13,9 @@ class MockTransport(object):
     def write(self, data):
         self.data_in.append(data)
 
+    def writelines(self, data):
+        self.data_in.extend(bytes(d) for d in data)
+
     def get_extra_info(self, key):
         return self.extra_info.get(key, None)
 
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from tesla.admission import AdmissionControl, RejectedConnection
+from tesla.tesla_exception import TeslaException
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_unlimited():
+    admission = AdmissionControl()
+
+    for _ in range(1000):
+        admission.connection_opened()
+        assert admission.accepts_connection()
+        assert admission.acquire(None, None)
+    assert admission.limit == 0
+
+
+def test_max_connections():
+    admission = AdmissionControl(max_connections=2)
+
+    for _ in range(2):
+        assert admission.accepts_connection()
+        admission.connection_opened()
+    assert not admission.accepts_connection()
+
+    admission.connection_closed()
+    assert admission.accepts_connection()
+    assert admission.stats()['rejected_connections'] == 1
+
+
+@pytest.mark.asyncio
+async def test_queue(mocker):
+    admission = AdmissionControl(max_in_flight=1, queue_size=1)
+    admitted = mocker.Mock()
+    rejected = mocker.Mock()
+
+    assert admission.acquire(None, None) is True
+    assert admission.acquire(admitted, rejected) is None
+    # the queue is full
+    assert admission.acquire(None, None) is False
+
+    admission.release(0.01)
+    admitted.assert_called_once_with()
+    assert admission.in_flight == 1
+    assert admission.stats()['waiting'] == 0
+
+    # its timer was cancelled
+    await asyncio.sleep(1.1)
+    rejected.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout(mocker):
+    admission = AdmissionControl(
+        max_in_flight=1, queue_size=2, queue_timeout=0.01)
+    admitted = mocker.Mock()
+    rejected = mocker.Mock()
+
+    admission.acquire(None, None)
+    admission.acquire(admitted, rejected)
+    await asyncio.sleep(0.05)
+
+    rejected.assert_called_once_with()
+    admission.release()
+    admitted.assert_not_called()
+    assert admission.stats()['rejected_requests'] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancel(mocker):
+    admission = AdmissionControl(max_in_flight=1)
+    admitted = mocker.Mock()
+
+    admission.acquire(None, None)
+    admission.acquire(admitted, None)
+    admission.cancel(admitted)
+
+    admission.release()
+    admitted.assert_not_called()
+    assert admission.in_flight == 0
+
+
+def test_adaptive_limit(clock):
+    admission = AdmissionControl(
+        max_in_flight=100, target_latency=0.1, min_in_flight=10, clock=clock)
+
+    admission.acquire(None, None)
+    admission.release(0.5)
+    assert admission.limit == 90
+
+    # a single cut per target latency
+    admission.acquire(None, None)
+    admission.release(0.5)
+    assert admission.limit == 90
+
+    for _ in range(30):
+        clock.now += 1
+        admission.acquire(None, None)
+        admission.release(0.5)
+    assert admission.limit == 10
+
+    # about one more slot per `limit` fast requests
+    for _ in range(25):
+        admission.acquire(None, None)
+        admission.release(0.05)
+    assert admission.limit == 12
+
+    for _ in range(10000):
+        admission.acquire(None, None)
+        admission.release(0.05)
+    assert admission.limit == 100
+
+
+def test_invalid_limits():
+    with pytest.raises(TeslaException):
+        AdmissionControl(max_connections=-1)
+
+    with pytest.raises(TeslaException):
+        AdmissionControl(target_latency=0.1)
+
+
+def test_rejected_connection(transport_factory):
+    transport = transport_factory()
+    protocol = RejectedConnection(b'HTTP/1.1 503 Service Unavailable\r\n\r\n')
+
+    protocol.connection_made(transport)
+    protocol.data_received(b'GET / HTTP/1.1\r\n\r\n')
+    assert transport.data_in == [b'HTTP/1.1 503 Service Unavailable\r\n\r\n']
+    assert transport.close.called
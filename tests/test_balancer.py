@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+from tesla.balancer import Backend, Balancer
+from tesla.tesla_exception import TeslaException
+from tesla.upstream_pool import UpstreamPool
+
+
+@pytest.fixture
+def parent(mocker):
+    return mocker.Mock(
+        spec=[
+            'target_connection_made', 'target_connection_lost',
+            'target_data_received'
+        ])
+
+
+def backends(count):
+    return [Backend('127.0.0.%d' % (i + 1), 80) for i in range(count)]
+
+
+def test_parse_backend():
+    backend = Backend.parse('example.com:8080')
+    assert (backend.host, backend.port) == ('example.com', 8080)
+    backend = Backend.parse('[::1]:80')
+    assert (backend.host, backend.port) == ('::1', 80)
+
+    for address in ('example.com', ':80', 'example.com:a'):
+        with pytest.raises(TeslaException):
+            Backend.parse(address)
+
+
+def test_invalid_balancer():
+    with pytest.raises(TeslaException):
+        Balancer([])
+    with pytest.raises(TeslaException):
+        Balancer(backends(1), policy='random')
+
+
+def test_round_robin():
+    balancer = Balancer(backends(3))
+    chosen = [balancer.choose() for _ in range(6)]
+    assert chosen == balancer.backends * 2
+
+
+def test_least_conn():
+    balancer = Balancer(backends(3), policy=Balancer.LEAST_CONN)
+    first, second, third = balancer.backends
+    first.active = 2
+    second.active = 1
+    assert balancer.choose() is third
+
+    third.active = 1
+    assert {balancer.choose(), balancer.choose()} == {second, third}
+
+
+def test_ewma():
+    balancer = Balancer(
+        backends(2), policy=Balancer.EWMA, ewma_alpha=0.5)
+    fast, slow = balancer.backends
+    balancer.observe(fast, 0.010)
+    # never measured yet, it gets a try
+    assert balancer.choose() is slow
+
+    balancer.observe(slow, 0.100)
+    assert balancer.choose() is fast
+
+    balancer.observe(slow, 0.0)
+    assert slow.latency == pytest.approx(0.050)
+    # its connections in use make the fast one more costly
+    fast.active = 5
+    assert balancer.choose() is slow
+
+
+def test_choose_skips_unavailable():
+    balancer = Balancer(backends(2))
+    down, up = balancer.backends
+    down.healthy = False
+    assert {balancer.choose() for _ in range(4)} == {up}
+
+    # all down, the balancer fails open
+    up.healthy = False
+    assert balancer.choose() in balancer.backends
+    assert balancer.choose(exclude=balancer.backends) is None
+
+
+@pytest.mark.asyncio
+async def test_connect_retries_another_backend(parent, tcp_server,
+                                               unused_tcp_port_factory):
+    closed_port = unused_tcp_port_factory()
+    open_port = unused_tcp_port_factory()
+    await tcp_server.listen('127.0.0.1', open_port)
+
+    closed = Backend('127.0.0.1', closed_port)
+    opened = Backend('127.0.0.1', open_port)
+    balancer = Balancer([closed, opened], max_fails=1)
+
+    backend, target = await balancer.connect(parent)
+    assert backend is opened
+    assert opened.active == 1
+    assert parent.target_connection_made.call_count == 1
+
+    # the failing backend was ejected
+    assert closed.fails == 1
+    assert not closed.available(0.0) or closed.ejected_until > 0
+    assert balancer.choose() is opened
+
+    balancer.release(backend)
+    assert opened.active == 0
+    target.close()
+
+
+@pytest.mark.asyncio
+async def test_connect_gives_up(parent, unused_tcp_port_factory):
+    balancer = Balancer(
+        [Backend('127.0.0.1', unused_tcp_port_factory()) for _ in range(3)],
+        retries=1)
+
+    with pytest.raises(OSError):
+        await balancer.connect(parent)
+    assert sum(b.fails for b in balancer.backends) == 2
+
+
+@pytest.mark.asyncio
+async def test_connect_waits_for_full_pool(parent, tcp_server,
+                                           unused_tcp_port_factory):
+    port = unused_tcp_port_factory()
+    await tcp_server.listen('127.0.0.1', port)
+    backend = Backend('127.0.0.1', port)
+    balancer = Balancer([backend], max_fails=1, connect_timeout=0.05)
+    pool = UpstreamPool(max_total=1)
+
+    _, target = await balancer.connect(parent, pool)
+    pending = asyncio.ensure_future(balancer.connect(parent, pool))
+    # waiting for a slot longer than the connect timeout
+    await asyncio.sleep(0.2)
+    assert not pending.done()
+
+    pool.release(target)
+    assert (await pending) == (backend, target)
+    assert backend.fails == 0
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_health_check(tcp_server, unused_tcp_port_factory):
+    closed_port = unused_tcp_port_factory()
+    open_port = unused_tcp_port_factory()
+    await tcp_server.listen('127.0.0.1', open_port)
+
+    balancer = Balancer([
+        Backend('127.0.0.1', closed_port),
+        Backend('127.0.0.1', open_port)
+    ])
+    closed, opened = balancer.backends
+    opened.healthy = False
+    opened.ejected_until = float('inf')
+
+    await balancer.check()
+    assert not closed.healthy
+    assert opened.healthy
+    assert opened.ejected_until == 0.0
+    assert [s['available'] for s in balancer.stats()] == [False, True]
+
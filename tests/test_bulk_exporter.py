@@ -0,0 +1,207 @@
+import http.client
+import json
+import threading
+import time
+
+import pytest
+
+from tesla.bulk_exporter import BulkExporter
+from tesla.tesla_exception import TeslaException
+
+
+@pytest.fixture
+def exporter_factory(elasticsearch):
+    exporters = []
+
+    def factory(**kwargs):
+        kwargs.setdefault('flush_interval', 0)
+        kwargs.setdefault('backoff', 0.001)
+        exporter = BulkExporter(elasticsearch.host, elasticsearch.port,
+                                **kwargs)
+        exporters.append(exporter)
+        return exporter
+
+    yield factory
+    for exporter in exporters:
+        exporter.close()
+
+
+def test_batch_by_size(elasticsearch, exporter_factory):
+    exporter = exporter_factory(max_docs=10)
+
+    for i in range(25):
+        exporter.add({'id': i})
+    exporter.flush(wait=True)
+
+    assert sorted(len(r['docs']) for r in elasticsearch.requests) == [5, 10, 10]
+    assert sorted(d['id'] for d in elasticsearch.docs) == list(range(25))
+    assert elasticsearch.requests[0]['actions'][0] == {
+        'index': {'_index': 'modsecurity_logs', '_type': 'modsecurity'}
+    }
+    assert exporter.stats() == {
+        'docs': 25, 'sent': 25, 'failed': 0, 'batches': 3, 'retries': 0
+    }
+
+
+def test_batch_by_bytes(elasticsearch, exporter_factory):
+    exporter = exporter_factory(max_bytes=1024)
+
+    for i in range(10):
+        exporter.add(json.dumps({'id': i, 'data': 'x' * 200}))
+    exporter.flush(wait=True)
+
+    assert len(elasticsearch.requests) > 2
+    assert len(elasticsearch.docs) == 10
+
+
+def test_batch_by_time(elasticsearch, exporter_factory):
+    exporter = exporter_factory(flush_interval=0.05)
+
+    exporter.add({'id': 1})
+    assert elasticsearch.requests == []
+
+    deadline = time.monotonic() + 2
+    while not elasticsearch.docs and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert elasticsearch.docs == [{'id': 1}]
+
+
+def test_compress_and_auth(elasticsearch, exporter_factory):
+    exporter = exporter_factory(compress=True, user='elastic', secret='pw',
+                                doc_type=None)
+
+    exporter.add('{"id": 1}')
+    exporter.flush(wait=True)
+
+    headers = elasticsearch.requests[0]['headers']
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Authorization'] == 'Basic ZWxhc3RpYzpwdw=='
+    assert elasticsearch.requests[0]['actions'][0] == {
+        'index': {'_index': 'modsecurity_logs'}
+    }
+    assert elasticsearch.docs == [{'id': 1}]
+
+
+def test_retry_request(elasticsearch, exporter_factory):
+    elasticsearch.fail_requests = 2
+    exporter = exporter_factory()
+
+    exporter.add({'id': 1})
+    exporter.flush(wait=True)
+
+    assert len(elasticsearch.requests) == 3
+    assert elasticsearch.docs == [{'id': 1}]
+    assert exporter.stats()['retries'] == 2
+
+
+def test_retry_gives_up(elasticsearch, exporter_factory):
+    elasticsearch.fail_requests = 10
+    exporter = exporter_factory(max_retries=2)
+
+    exporter.add({'id': 1})
+    # reported once, so the caller can send it again
+    assert exporter.flush(wait=True) == 1
+    assert exporter.flush(wait=True) == 0
+
+    assert len(elasticsearch.requests) == 3
+    assert exporter.stats()['failed'] == 1
+
+
+def test_no_retry_on_client_error(elasticsearch, exporter_factory):
+    elasticsearch.fail_requests = 1
+    elasticsearch.fail_status = 400
+    exporter = exporter_factory()
+
+    exporter.add({'id': 1})
+    # dropped, sending it again would fail the same way
+    assert exporter.flush(wait=True) == 0
+
+    assert len(elasticsearch.requests) == 1
+    assert exporter.stats()['failed'] == 1
+
+
+def test_retry_rejected_documents(elasticsearch, exporter_factory):
+    elasticsearch.reject_docs = {1: [429, 429], 2: [400]}
+    exporter = exporter_factory()
+
+    for i in range(4):
+        exporter.add({'id': i})
+    # the rejected document is dropped, not reported
+    assert exporter.flush(wait=True) == 0
+
+    # Only the retryable document is sent again
+    assert [len(r['docs']) for r in elasticsearch.requests] == [4, 1, 1]
+    assert sorted(d['id'] for d in elasticsearch.docs) == [0, 1, 3]
+    stats = exporter.stats()
+    assert stats['sent'] == 3
+    assert stats['failed'] == 1
+
+
+def test_in_flight_window(elasticsearch, exporter_factory, mocker):
+    exporter = exporter_factory(max_docs=1, max_in_flight=2)
+
+    release = threading.Event()
+    in_flight = []
+    post = exporter._post
+
+    def slow_post(batch):
+        in_flight.append(batch)
+        release.wait(2)
+        return post(batch)
+
+    mocker.patch.object(exporter, '_post', side_effect=slow_post)
+
+    exporter.add({'id': 1})
+    exporter.add({'id': 2})
+
+    blocked = threading.Thread(target=exporter.add, args=({'id': 3}, ))
+    blocked.start()
+    blocked.join(0.1)
+    # The third batch waits for a free slot
+    assert blocked.is_alive()
+    assert len(in_flight) <= 2
+
+    release.set()
+    blocked.join(2)
+    assert not blocked.is_alive()
+    exporter.flush(wait=True)
+    assert sorted(d['id'] for d in elasticsearch.docs) == [1, 2, 3]
+
+
+def test_closed(exporter_factory):
+    exporter = exporter_factory()
+    exporter.close()
+    with pytest.raises(TeslaException):
+        exporter.add({'id': 1})
+
+
+def test_throughput(elasticsearch, exporter_factory):
+    exporter = exporter_factory(max_docs=500, compress=True)
+
+    for i in range(5000):
+        exporter.add({'id': i, 'msg': 'ModSecurity: Access denied'})
+    exporter.flush(wait=True)
+
+    assert len(elasticsearch.docs) == 5000
+    assert len(elasticsearch.requests) == 10
+
+
+@pytest.mark.parametrize('host, cls, address', [
+    ('es.local', 'HTTPConnection', ('es.local', 9200)),
+    ('http://es.local', 'HTTPConnection', ('es.local', 9200)),
+    ('https://es.local', 'HTTPSConnection', ('es.local', 9200)),
+    ('https://es.local:9243/', 'HTTPSConnection', ('es.local', 9243)),
+])
+def test_connection_scheme(host, cls, address):
+    exporter = BulkExporter(host, 9200, flush_interval=0)
+    try:
+        connection = exporter._connection()
+        assert type(connection) is getattr(http.client, cls)
+        assert (connection.host, connection.port) == address
+    finally:
+        exporter.close()
+
+
+def test_invalid_scheme():
+    with pytest.raises(TeslaException):
+        BulkExporter('ftp://es.local', 9200, flush_interval=0)
@@ -0,0 +1,128 @@
+import pytest
+
+from tesla.config import Config, Target
+from tesla.tesla_exception import TeslaException
+
+
+def test_load_etc_config():
+    config = Config.load('etc/config.toml')
+
+    assert sorted(config.targets) == ['local']
+    local = config.targets['local']
+    assert (local.host, local.port) == ('localhost', 8090)
+
+    listeners = {l.name: l for l in config.listeners}
+    assert sorted(listeners) == ['http', 'https']
+    assert listeners['http'].port == 8080
+    assert not listeners['http'].ssl
+    assert listeners['https'].ssl
+    assert listeners['https'].cert == 'etc/selfsigned.cert'
+    assert listeners['https'].key == 'etc/selfsigned.key'
+    # the targets are shared, not copied
+    assert listeners['http'].target is listeners['https'].target is local
+
+
+def test_default_target():
+    default = Target('default', 'example.com', 80)
+    config = Config.from_dict({'server': {'a': {'port': 8080}}}, default)
+
+    listener, = config.listeners
+    assert listener.host == '0.0.0.0'
+    assert listener.target is default
+
+
+def test_no_default_target():
+    with pytest.raises(TeslaException):
+        Config.from_dict({'server': {'a': {'port': 8080}}})
+
+
+@pytest.mark.parametrize('data', [
+    {'server': {'a': {'port': 8080, 'target': 'missing'}}},
+    {'server': {'a': {'port': '8080'}}},
+    {'server': {'a': {'port': True}}},
+    {'server': {'a': {'host': '0.0.0.0'}}},
+    {'server': {'a': {'port': 8080, 'ssl': True, 'cert': 'a.cert'}}},
+    {'server': {'a': {'port': 8080}, 'b': {'port': 8080}}},
+    {'target': {'a': {'host': 'localhost'}}},
+    {'target': 'a'},
+])
+def test_invalid_config(data):
+    with pytest.raises(TeslaException):
+        Config.from_dict(data, Target('default', 'localhost', 80))
+
+
+def test_load_invalid_toml(tmpdir):
+    path = tmpdir.join('config.toml')
+    path.write('[server.a\nport=1')
+    with pytest.raises(TeslaException):
+        Config.load(str(path))
+
+    with pytest.raises(TeslaException):
+        Config.load(str(tmpdir.join('missing.toml')))
+
+
+def test_target_backends():
+    config = Config.from_dict({
+        'target': {
+            'app': {
+                'backends': ['10.0.0.1:8080', '10.0.0.2:8080'],
+                'balance': 'least-conn',
+                'health_check_interval': 1,
+            }
+        }
+    })
+
+    app = config.targets['app']
+    assert (app.host, app.port) == ('10.0.0.1', 8080)
+    assert app.backends == ['10.0.0.1:8080', '10.0.0.2:8080']
+    assert app.balance == 'least-conn'
+    assert app.health_check_interval == 1.0
+
+
+@pytest.mark.parametrize('backends', [[], 'a:1', [1], ['a']])
+def test_invalid_backends(backends):
+    with pytest.raises(TeslaException):
+        Config.from_dict({'target': {'app': {'backends': backends}}})
+
+
+def test_vhosts():
+    config = Config.from_dict({
+        'target': {'app': {'host': 'localhost', 'port': 8080}},
+        'rules': {'api': {'files': ['etc/basic_rules.conf']}},
+        'vhost': {
+            'api': {'hosts': ['*.example.com'], 'rules': 'api',
+                    'target': 'app'},
+            'www': {'hosts': ['www.example.com']},
+        },
+    })
+
+    assert config.rule_sets == {'api': ['etc/basic_rules.conf']}
+    vhosts = {v.name: v for v in config.vhosts}
+    assert vhosts['api'].hosts == ['*.example.com']
+    assert vhosts['api'].target is config.targets['app']
+    assert vhosts['www'].rules is None
+    assert vhosts['www'].target is None
+
+
+@pytest.mark.parametrize('vhost', [
+    {'hosts': ['a'], 'rules': 'missing'},
+    {'hosts': ['a'], 'target': 'missing'},
+    {'hosts': 'a'},
+    {},
+])
+def test_invalid_vhost(vhost):
+    with pytest.raises(TeslaException):
+        Config.from_dict({'vhost': {'a': vhost}})
+
+
+def test_vhost_rate_limit():
+    config = Config.from_dict({
+        'vhost': {
+            'api': {'hosts': ['a'], 'rate_limit': 20, 'rate_burst': 40.5},
+        },
+    })
+    vhost, = config.vhosts
+    assert (vhost.rate_limit, vhost.rate_burst) == (20.0, 40.5)
+
+    with pytest.raises(TeslaException):
+        Config.from_dict({'vhost': {'a': {'hosts': ['a'], 'rate_limit': -1}}})
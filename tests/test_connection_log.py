@@ -0,0 +1,79 @@
+import logging
+
+import pytest
+
+from tesla.connection_log import ConnectionLog
+
+
+@pytest.fixture
+def mock_log(mocker, log):
+    import actionslog
+    instance = actionslog.get_instance()
+    level = instance.level
+    instance.setLevel(logging.INFO)
+    yield mocker.patch('tesla.connection_log.log', wraps=actionslog)
+    instance.setLevel(level)
+
+
+def test_bound_context(mock_log):
+    conn_log = ConnectionLog(dst_host='localhost', dst_port=80)
+    conn_log.bind(client_host='127.0.0.1', client_port=9090)
+
+    conn_log.info('New client')
+    mock_log.info.assert_called_once_with(
+        'New client',
+        dst_host='localhost',
+        dst_port=80,
+        client_host='127.0.0.1',
+        client_port=9090)
+
+    conn_log.info('Lost', reason='EOF')
+    mock_log.info.assert_called_with(
+        'Lost',
+        dst_host='localhost',
+        dst_port=80,
+        client_host='127.0.0.1',
+        client_port=9090,
+        reason='EOF')
+
+
+def test_level_check(mocker, mock_log):
+    conn_log = ConnectionLog()
+    assert conn_log.info_enabled
+    assert not conn_log.debug_enabled
+
+    conn_log.debug('Not logged')
+    mock_log.debug.assert_not_called()
+
+    instance = mock_log.get_instance()
+    mocker.patch.object(
+        instance,
+        'isEnabledFor',
+        side_effect=lambda level: level >= logging.WARNING)
+    # Only read again on refresh
+    assert conn_log.info_enabled
+    conn_log.refresh()
+    assert not conn_log.info_enabled
+    assert not conn_log.sample()
+
+    conn_log.info('Not logged')
+    mock_log.info.assert_not_called()
+
+
+@pytest.mark.parametrize('sample_every, events, logged', [
+    (0, 10, 0),
+    (1, 10, 10),
+    (4, 10, 3),
+    (64, 10, 1),
+])
+def test_sample(mock_log, sample_every, events, logged):
+    conn_log = ConnectionLog(sample_every=sample_every)
+
+    for _ in range(events):
+        if conn_log.sample():
+            conn_log.info_sampled('Client sent data', length=1)
+
+    assert mock_log.info.call_count == logged
+    if logged:
+        mock_log.info.assert_called_with(
+            'Client sent data', length=1, sample_every=sample_every)
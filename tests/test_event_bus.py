@@ -0,0 +1,187 @@
+import io
+import json
+import time
+
+import pytest
+
+from tesla.bulk_exporter import BulkExporter
+from tesla.event_bus import EventBus
+from tesla.event_sinks import ElasticsearchSink, FileSink, StdoutSink
+from tesla.proxy import Proxy
+from tesla.proxy_settings import ProxySettings
+from tesla.rule_descriptions import RuleDescriptions
+
+LINE = ('ModSecurity: Access denied with code 403 '
+        '[file "/etc/owasp-crs/rules/REQUEST-942-APPLICATION-ATTACK-SQLI.conf"]'
+        ' [id "942100"] [tag "attack-sqli"]')
+
+
+class ListSink(object):
+    def __init__(self, fail=False):
+        self.events = []
+        self.fail = fail
+        self.closed = False
+
+    def write(self, events):
+        if self.fail:
+            raise IOError('sink is down')
+        self.events.extend(events)
+
+    def close(self):
+        self.closed = True
+
+
+def test_push_and_drain():
+    bus = EventBus(batch_size=2, descriptions=RuleDescriptions())
+    sink = ListSink()
+    bus.add_sink(sink)
+
+    bus.push('server', LINE)
+    bus.push('intervention', 'not a rule line', client_host='127.0.0.1')
+    bus.push('server', LINE)
+    assert sink.events == []
+
+    assert bus.drain() == 3
+    assert [e['source'] for e in sink.events] == [
+        'server', 'intervention', 'server'
+    ]
+    assert sink.events[0]['id'] == 942100
+    assert sink.events[0]['type'] == 'SQL injection attack'
+    assert sink.events[0]['tags'] == ['attack-sqli']
+    assert sink.events[0]['date'].endswith('+00:00')
+    assert sink.events[1]['message'] == 'not a rule line'
+    assert sink.events[1]['client_host'] == '127.0.0.1'
+    assert bus.stats() == {
+        'pushed': 3, 'overflow': 0, 'delivered': 3, 'dropped': 0, 'queued': 0
+    }
+
+
+def test_overflow():
+    bus = EventBus(capacity=3)
+    sink = ListSink()
+    bus.add_sink(sink)
+
+    for i in range(5):
+        bus.push('server', 'line %d' % i)
+    bus.drain()
+
+    # The oldest events are overwritten
+    assert [e['message'] for e in sink.events] == [
+        'line 2', 'line 3', 'line 4'
+    ]
+    assert bus.stats()['overflow'] == 2
+
+
+def test_failing_sink():
+    bus = EventBus()
+    failing = ListSink(fail=True)
+    sink = ListSink()
+    bus.add_sink(failing)
+    bus.add_sink(sink)
+
+    bus.push('server', LINE)
+    bus.drain()
+
+    assert len(sink.events) == 1
+    stats = bus.stats()
+    assert stats['dropped'] == 1
+    assert stats['delivered'] == 1
+
+
+def test_background():
+    bus = EventBus(batch_size=10, flush_interval=0.01)
+    sink = ListSink()
+    bus.add_sink(sink)
+    bus.start()
+
+    bus.push('server', LINE)
+    deadline = time.monotonic() + 2
+    while not sink.events and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(sink.events) == 1
+
+    for _ in range(25):
+        bus.push('server', LINE)
+    bus.stop()
+
+    assert len(sink.events) == 26
+    assert sink.closed
+
+
+def test_file_sink(tmpdir):
+    path = str(tmpdir.join('events.json'))
+    sink = FileSink(path)
+    sink.write([{'id': 1}, {'id': 2}])
+    sink.close()
+
+    with open(path) as f:
+        assert [json.loads(l) for l in f] == [{'id': 1}, {'id': 2}]
+
+
+def test_stdout_sink():
+    stream = io.StringIO()
+    StdoutSink(stream).write([{'id': 1}])
+    assert stream.getvalue() == '{"id": 1}\n'
+
+
+def test_elasticsearch_sink(elasticsearch):
+    sink = ElasticsearchSink(
+        BulkExporter(
+            elasticsearch.host, elasticsearch.port, flush_interval=0))
+    bus = EventBus()
+    bus.add_sink(sink)
+
+    bus.push('server', LINE)
+    bus.stop()
+
+    assert elasticsearch.docs[0]['id'] == 942100
+
+
+def test_elasticsearch_sink_dropped(elasticsearch):
+    elasticsearch.fail_requests = 10
+    sink = ElasticsearchSink(
+        BulkExporter(
+            elasticsearch.host,
+            elasticsearch.port,
+            flush_interval=0,
+            max_retries=1,
+            backoff=0.01))
+    bus = EventBus()
+    bus.add_sink(sink)
+
+    bus.push('server', LINE)
+    bus.stop()
+
+    # written to the sink, lost by its exporter
+    stats = bus.stats()
+    assert stats['dropped'] == 1
+    assert stats['delivered'] == 0
+
+
+@pytest.mark.parametrize('log_interventions', [True, False])
+def test_proxy_intervention_log(mocker, log, dst_port, transport_factory,
+                                log_interventions):
+    bus = EventBus()
+    transaction = mocker.Mock()
+
+    def intervention(i):
+        i.log = LINE
+        return True
+
+    transaction.intervention.side_effect = intervention
+    proxy = Proxy('localhost', dst_port, transaction,
+                  settings=ProxySettings(event_bus=bus,
+                                         log_interventions=log_interventions))
+    mocker.patch.object(proxy, '_create_target_connection')
+    info = mocker.patch.object(proxy._log, 'info')
+
+    proxy.connection_made(transport_factory())
+
+    assert bus.stats()['pushed'] == 1
+    assert bus._ring[0][1:] == ('intervention', LINE, {
+        'client_host': '127.0.0.1',
+        'client_port': proxy._client_port
+    })
+    # the exporter still finds it in the log
+    logged = mocker.call(LINE, component='ModSecurity') in info.mock_calls
+    assert logged == log_interventions
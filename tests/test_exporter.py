@@ -0,0 +1,181 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from tesla.bulk_exporter import BulkExporter
+from tesla.exporter import ExporterProcess, ExporterTask
+from tesla.log_tailer import LogTailer
+from tesla.modsec import ModSecurityParser
+
+LINE = ('ModSecurity: Access denied [file "/etc/owasp-crs/rules/'
+        'REQUEST-942-APPLICATION-ATTACK-SQLI.conf"] [id "942100"]\n')
+
+
+class FakeParser(object):
+    def __init__(self, path=None):
+        self.path = path
+        self.sent = []
+        self.closed = False
+
+    def send(self, log_dir):
+        self.sent.append(log_dir)
+        with open(self.path, 'a') as f:
+            f.write('sent\n')
+
+    async def send_async(self, log_dir):
+        self.sent.append(log_dir)
+
+    def close(self):
+        self.closed = True
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.write('closed\n')
+
+
+@pytest.fixture
+def modsec_parser(monkeypatch, tmpdir, elasticsearch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    parser = ModSecurityParser(elasticsearch.host, elasticsearch.port, None,
+                               None)
+    yield parser
+    parser.close()
+
+
+def test_task(event_loop):
+    parser = FakeParser()
+    exporter = ExporterTask(lambda: parser, '/logs', interval=0.01)
+
+    exporter.start(event_loop)
+    assert exporter.running
+    event_loop.run_until_complete(asyncio.sleep(0.1))
+    exporter.stop()
+
+    assert not exporter.running
+    assert len(parser.sent) > 2
+    assert parser.sent[0] == '/logs'
+    assert parser.closed
+
+
+def test_task_send_async(event_loop, modsec_parser, elasticsearch, tmpdir):
+    log_dir = tmpdir.mkdir('logs')
+    log_dir.join('modsecurity.log').write(LINE * 3 + 'other line\n')
+
+    exporter = ExporterTask(lambda: modsec_parser, str(log_dir),
+                            interval=0.01)
+    exporter.start(event_loop)
+
+    deadline = time.monotonic() + 5
+    while len(elasticsearch.docs) < 3 and time.monotonic() < deadline:
+        event_loop.run_until_complete(asyncio.sleep(0.02))
+    exporter.stop()
+
+    assert len(elasticsearch.docs) == 3
+    assert elasticsearch.docs[0]['type'] == 'SQL injection attack'
+
+
+def test_send_async_off_the_loop(event_loop, modsec_parser, elasticsearch,
+                                 tmpdir, mocker):
+    log_dir = tmpdir.mkdir('logs')
+    log_dir.join('modsecurity.log').write(LINE * 3)
+    read_lines = LogTailer.read_lines
+
+    def slow_read(tailer):
+        # a large read
+        time.sleep(0.2)
+        return read_lines(tailer)
+
+    mocker.patch.object(LogTailer, 'read_lines', autospec=True,
+                        side_effect=slow_read)
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(event_loop.time())
+            await asyncio.sleep(0.01)
+
+    task = event_loop.create_task(ticker())
+    event_loop.run_until_complete(modsec_parser.send_async(str(log_dir)))
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        event_loop.run_until_complete(task)
+
+    assert len(elasticsearch.docs) == 3
+    # the loop kept running while the log was read
+    assert len(ticks) > 20
+
+
+def test_rotated_after_failed_ship(modsec_parser, elasticsearch, tmpdir):
+    log_dir = tmpdir.mkdir('logs')
+    path = str(log_dir.join('modsecurity.log'))
+    modsec_parser.exporter.close()
+    modsec_parser.exporter = BulkExporter(
+        elasticsearch.host, elasticsearch.port, max_retries=0,
+        flush_interval=0)
+    backup = modsec_parser.backup
+    backup._settle = 0
+
+    with open(path, 'w') as f:
+        f.write(LINE * 3)
+    modsec_parser.send(str(log_dir))
+    modsec_parser.send(str(log_dir))
+    assert len(elasticsearch.docs) == 3
+
+    with open(path, 'a') as f:
+        f.write(LINE * 2)
+    elasticsearch.fail_requests = 1
+    modsec_parser.send(str(log_dir))
+    assert len(elasticsearch.docs) == 3
+    # not rotated by a failed run
+    assert os.path.exists(path)
+
+    # rotated anyway, the segment is kept while its lines are not shipped
+    segment = path + '.1'
+    os.rename(path, segment)
+    backup.submit(segment)
+    with open(path, 'w') as f:
+        f.write(LINE)
+    time.sleep(0.2)
+    assert os.path.exists(segment)
+
+    modsec_parser.send(str(log_dir))
+    assert len(elasticsearch.docs) == 6
+    backup.stop(timeout=5)
+    assert not os.path.exists(segment)
+    assert len(backup.archives()) == 1
+
+
+def test_rejected_batch_not_sent_again(modsec_parser, elasticsearch, tmpdir):
+    log_dir = tmpdir.mkdir('logs')
+    log_dir.join('modsecurity.log').write(LINE * 2)
+    elasticsearch.fail_requests = 1
+    elasticsearch.fail_status = 413
+
+    modsec_parser.send(str(log_dir))
+    modsec_parser.send(str(log_dir))
+    # dropped, the checkpoint moved past it
+    assert len(elasticsearch.requests) == 1
+    assert modsec_parser.tailer.committed_inode is not None
+
+
+def test_process(tmpdir):
+    path = str(tmpdir.join('sent'))
+    exporter = ExporterProcess(lambda: FakeParser(path), '/logs',
+                               interval=0.01)
+
+    exporter.start()
+    assert exporter.running
+    assert exporter.pid != os.getpid()
+
+    deadline = time.monotonic() + 5
+    while not os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    exporter.stop()
+    assert not exporter.running
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == 'sent'
+    # Stopped cleanly
+    assert lines[-1] == 'closed'
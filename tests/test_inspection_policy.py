@@ -0,0 +1,35 @@
+import pytest
+
+from tesla.inspection_policy import ResponseInspectionPolicy
+
+
+@pytest.mark.parametrize('content_type, content_length, expected', [
+    (b'text/html; charset=UTF-8', 100, True),
+    (b'application/json', None, True),
+    (b'application/problem+json', None, True),
+    (b'Application/XML', None, True),
+    (b'image/png', 100, False),
+    (b'video/mp4', None, False),
+    (b'application/octet-stream', None, False),
+    (b'text/plain', 2 * 1024 * 1024, False),
+    (None, None, True),
+])
+def test_should_inspect(content_type, content_length, expected):
+    policy = ResponseInspectionPolicy()
+    assert policy.should_inspect(content_type, content_length) == expected
+
+
+def test_should_inspect_custom_types():
+    policy = ResponseInspectionPolicy(
+        types=['image/svg+xml'], max_length=0, inspect_unknown=False)
+
+    assert policy.should_inspect('image/svg+xml', 10 * 1024 * 1024)
+    assert not policy.should_inspect('text/html')
+    assert not policy.should_inspect(None)
+
+
+def test_should_inspect_any_type():
+    policy = ResponseInspectionPolicy(types=['*'], max_length=100)
+
+    assert policy.should_inspect('video/mp4', 100)
+    assert not policy.should_inspect('text/html', 101)
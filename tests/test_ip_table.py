@@ -0,0 +1,75 @@
+import pytest
+
+from tesla.ip_table import IpTable
+from tesla.tesla_exception import TeslaException
+
+
+@pytest.fixture
+def table():
+    table = IpTable()
+    table.add('10.0.0.0/8')
+    table.add('10.1.0.0/16', IpTable.ALLOW)
+    table.add('10.1.2.3')
+    table.add('2001:db8::/32')
+    table.add('2001:db8:1::/48', IpTable.ALLOW)
+    return table
+
+
+@pytest.mark.parametrize('address, expected', [
+    ('10.9.9.9', IpTable.DENY),
+    ('10.1.9.9', IpTable.ALLOW),
+    ('10.1.2.3', IpTable.DENY),
+    ('11.0.0.1', None),
+    ('::ffff:10.9.9.9', IpTable.DENY),
+    ('2001:db8:ffff::1', IpTable.DENY),
+    ('2001:db8:1::1', IpTable.ALLOW),
+    ('2001:db9::1', None),
+    ('not an address', None),
+    (None, None),
+])
+def test_lookup(table, address, expected):
+    assert table.lookup(address) == expected
+
+
+def test_host_bits_ignored():
+    table = IpTable()
+    table.add('192.168.1.77/24')
+    assert table.lookup('192.168.1.1') == IpTable.DENY
+    table.add('::ffff:172.16.0.0/112')
+    assert table.lookup('172.16.5.5') == IpTable.DENY
+    assert table.lookup('172.17.0.1') is None
+
+
+def test_remove(table):
+    assert table.remove('10.1.2.3')
+    assert table.lookup('10.1.2.3') == IpTable.ALLOW
+    assert not table.remove('10.1.2.3')
+    assert table.stats() == {'ipv4': 2, 'ipv6': 2, 'lengths': 4}
+
+
+def test_default_route():
+    table = IpTable()
+    table.add('0.0.0.0/0')
+    assert table.lookup('1.2.3.4') == IpTable.DENY
+    assert table.lookup('::1') is None
+
+
+@pytest.mark.parametrize('prefix', [
+    'a.b.c.d', '10.0.0.0/33', '10.0.0.0/a', '::/129', '::ffff:1.2.3.4/95'
+])
+def test_invalid_prefix(prefix):
+    with pytest.raises(TeslaException):
+        IpTable().add(prefix)
+
+
+def test_load(tmpdir):
+    path = tmpdir.join('deny.txt')
+    path.write('# blocked\n10.0.0.0/8\n\n2001:db8::/32  # docs\n')
+    table = IpTable()
+    assert table.load(str(path)) == 2
+    assert len(table) == 2
+
+    path.write('10.0.0.0/8\nbad\n')
+    with pytest.raises(TeslaException) as e:
+        IpTable().load(str(path))
+    assert ':2:' in str(e.value)
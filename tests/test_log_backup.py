@@ -0,0 +1,130 @@
+import gzip
+import os
+
+import pytest
+
+from tesla.log_backup import LogBackup
+
+
+@pytest.fixture
+def log_path(tmpdir):
+    return str(tmpdir.mkdir('logs').join('modsecurity.log'))
+
+
+@pytest.fixture
+def backup_dir(tmpdir):
+    return str(tmpdir.join('backup'))
+
+
+def write(path, data):
+    with open(path, 'a') as f:
+        f.write(data)
+
+
+def test_rotate(log_path, backup_dir, mocker):
+    backup = LogBackup(backup_dir, max_segment_bytes=10)
+    mocker.patch.object(backup, 'submit')
+
+    assert backup.rotate(log_path) is None
+    write(log_path, 'short\n')
+    assert backup.rotate(log_path) is None
+    assert os.path.exists(log_path)
+
+    write(log_path, 'long enough\n')
+    segment = backup.rotate(log_path)
+    assert segment.startswith(log_path + '.')
+    assert not os.path.exists(log_path)
+    backup.submit.assert_called_once_with(segment)
+
+
+def test_compress(log_path, backup_dir):
+    backup = LogBackup(backup_dir, chunk_size=4)
+    segment = log_path + '.1'
+    write(segment, 'a\n' * 100)
+
+    archive = backup.compress(segment)
+    assert archive == os.path.join(backup_dir, 'modsecurity.log.1.gz')
+    assert not os.path.exists(segment)
+    with gzip.open(archive, 'rt') as f:
+        assert f.read() == 'a\n' * 100
+
+
+@pytest.mark.parametrize('max_count, max_bytes, kept', [
+    (0, 0, 5),
+    (3, 0, 3),
+    (0, 100, 2),
+    (4, 130, 2),
+])
+def test_retention(backup_dir, max_count, max_bytes, kept):
+    backup = LogBackup(backup_dir, max_count=max_count, max_bytes=max_bytes)
+    for i in range(5):
+        path = os.path.join(backup_dir, 'modsecurity.log.%d.gz' % i)
+        write(path, 'x' * 50)
+        os.utime(path, (1000 + i, 1000 + i))
+
+    deleted = backup.enforce_retention()
+    assert len(deleted) == 5 - kept
+    # Oldest first
+    assert [os.path.basename(a) for a in backup.archives()] == [
+        'modsecurity.log.%d.gz' % i for i in range(5 - kept, 5)
+    ]
+
+
+def test_background(log_path, backup_dir):
+    backup = LogBackup(backup_dir, max_segment_bytes=1, max_count=2,
+                       settle=0)
+    backup.start()
+
+    for i in range(3):
+        write(log_path, 'line %d\n' % i)
+        assert backup.rotate(log_path)
+    backup.stop(timeout=5)
+
+    archives = backup.archives()
+    assert len(archives) == 2
+    assert os.listdir(os.path.dirname(log_path)) == []
+    with gzip.open(archives[-1], 'rt') as f:
+        assert f.read() == 'line 2\n'
+
+
+def test_hold(log_path, backup_dir):
+    held = set()
+    backup = LogBackup(backup_dir, max_segment_bytes=1, settle=0,
+                       hold=lambda segment: segment in held)
+    write(log_path, 'line\n')
+    segment = log_path + '.1'
+    os.rename(log_path, segment)
+    held.add(segment)
+
+    backup.start()
+    backup.submit(segment)
+    backup.stop(timeout=5)
+    # left for the next run
+    assert os.path.exists(segment)
+    assert backup.archives() == []
+
+    held.clear()
+    backup = LogBackup(backup_dir, settle=0, hold=lambda segment: False)
+    backup.start()
+    backup.submit_pending(log_path)
+    backup.stop(timeout=5)
+    assert not os.path.exists(segment)
+    assert len(backup.archives()) == 1
+
+
+def test_submit_pending(log_path, backup_dir, mocker):
+    backup = LogBackup(backup_dir)
+    mocker.patch.object(backup, 'submit')
+    write(log_path, 'current\n')
+    write(log_path + '.20181001-000000-000000', 'left\n')
+    write(log_path + '.20181001-000000-000000.gz.tmp', 'partial\n')
+
+    backup.submit_pending(log_path)
+    backup.submit.assert_called_once_with(log_path +
+                                          '.20181001-000000-000000')
+
+
+def test_submit_never_blocks(backup_dir):
+    backup = LogBackup(backup_dir, max_queue=1)
+    assert backup.submit('a')
+    assert not backup.submit('b')
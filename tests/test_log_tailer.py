@@ -0,0 +1,150 @@
+import os
+
+import pytest
+
+from tesla.log_tailer import LogTailer
+
+
+@pytest.fixture
+def log_path(tmpdir):
+    return str(tmpdir.join('modsecurity.log'))
+
+
+@pytest.fixture
+def checkpoint_path(tmpdir):
+    return str(tmpdir.join('modsecurity.log.checkpoint'))
+
+
+def append(path, data):
+    with open(path, 'a') as f:
+        f.write(data)
+
+
+def test_read_appended_lines(log_path):
+    tailer = LogTailer(log_path)
+    assert tailer.read_lines() == []
+
+    append(log_path, 'a\nb\n')
+    assert tailer.read_lines() == ['a', 'b']
+    assert tailer.read_lines() == []
+
+    # Incomplete lines wait for their end
+    append(log_path, 'c\nd')
+    assert tailer.read_lines() == ['c']
+    assert tailer.offset == 6
+    append(log_path, 'e\n')
+    assert tailer.read_lines() == ['de']
+
+    tailer.close()
+
+
+def test_bounded_reads(log_path):
+    append(log_path, ''.join('line %03d\n' % i for i in range(100)))
+
+    tailer = LogTailer(log_path, chunk_size=16, max_bytes=90)
+    lines = []
+    batches = 0
+    batch = tailer.read_lines()
+    while batch:
+        assert len(batch) <= 10
+        lines.extend(batch)
+        batches += 1
+        batch = tailer.read_lines()
+
+    assert lines == ['line %03d' % i for i in range(100)]
+    assert batches == 10
+
+    tailer.close()
+
+
+def test_truncation(log_path):
+    append(log_path, 'a\nb\n')
+    tailer = LogTailer(log_path)
+    assert tailer.read_lines() == ['a', 'b']
+
+    open(log_path, 'w').close()
+    append(log_path, 'c\n')
+    assert tailer.read_lines() == ['c']
+
+    tailer.close()
+
+
+def test_rotation(log_path):
+    append(log_path, 'a\n')
+    tailer = LogTailer(log_path)
+    assert tailer.read_lines() == ['a']
+
+    append(log_path, 'b\nlast')
+    os.rename(log_path, log_path + '.1')
+    append(log_path, 'c\n')
+
+    # The rest of the rotated file comes first
+    assert tailer.read_lines() == ['b', 'last', 'c']
+
+    tailer.close()
+
+
+def test_checkpoint(log_path, checkpoint_path):
+    append(log_path, 'a\nb\n')
+
+    tailer = LogTailer(log_path, checkpoint_path=checkpoint_path)
+    assert tailer.read_lines() == ['a', 'b']
+    tailer.commit()
+    append(log_path, 'c\n')
+    assert tailer.read_lines() == ['c']
+    # Not committed
+    tailer.close()
+
+    tailer = LogTailer(log_path, checkpoint_path=checkpoint_path)
+    assert tailer.read_lines() == ['c']
+    tailer.commit()
+    tailer.close()
+
+    tailer = LogTailer(log_path, checkpoint_path=checkpoint_path)
+    assert tailer.read_lines() == []
+    tailer.close()
+
+
+def test_rewind(log_path, checkpoint_path):
+    append(log_path, 'a\nb\n')
+    tailer = LogTailer(log_path, checkpoint_path=checkpoint_path, max_bytes=2)
+    assert tailer.read_lines() == ['a']
+    tailer.commit()
+    assert tailer.read_lines() == ['b']
+
+    tailer.rewind()
+    assert tailer.read_lines() == ['b']
+    tailer.close()
+
+    # without a checkpoint file, back to the start
+    tailer = LogTailer(log_path)
+    assert tailer.read_lines() == ['a', 'b']
+    tailer.rewind()
+    assert tailer.read_lines() == ['a', 'b']
+    tailer.close()
+
+
+def test_checkpoint_rotated_while_stopped(log_path, checkpoint_path):
+    append(log_path, 'a\n')
+    tailer = LogTailer(log_path, checkpoint_path=checkpoint_path)
+    assert tailer.read_lines() == ['a']
+    tailer.commit()
+    tailer.close()
+
+    append(log_path, 'b\n')
+    os.rename(log_path, log_path + '.1')
+    append(log_path, 'c\n')
+
+    tailer = LogTailer(log_path, checkpoint_path=checkpoint_path)
+    assert tailer.read_lines() == ['b', 'c']
+    tailer.close()
+
+
+def test_invalid_checkpoint(log_path, checkpoint_path):
+    append(log_path, 'a\n')
+    with open(checkpoint_path, 'w') as f:
+        f.write('{')
+
+    tailer = LogTailer(log_path, checkpoint_path=checkpoint_path)
+    assert tailer.read_lines() == ['a']
+    tailer.close()
@@ -0,0 +1,118 @@
+import logging
+import logging.handlers
+import os
+import threading
+
+import pytest
+
+from tesla.log_writer import QueueLogWriter
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.records = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.records.append(record)
+        self.threads.add(threading.get_ident())
+
+
+@pytest.fixture
+def logger():
+    logger = logging.getLogger('test_log_writer')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    yield logger
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+
+def test_writer(logger):
+    handler = RecordingHandler()
+    handler.addFilter(lambda r: getattr(r, 'component', None) == 'A')
+    logger.addHandler(handler)
+
+    writer = QueueLogWriter(logger)
+    writer.start()
+    assert writer.running
+    assert handler not in logger.handlers
+
+    for i in range(100):
+        logger.info('Message %d', i, extra={'component': 'A'})
+    logger.info('Filtered', extra={'component': 'B'})
+
+    writer.stop()
+    assert not writer.running
+    assert handler in logger.handlers
+    assert not any(
+        isinstance(h, logging.handlers.QueueHandler) for h in logger.handlers)
+
+    assert [r.getMessage() for r in handler.records] == [
+        'Message %d' % i for i in range(100)
+    ]
+    # Written in the background thread
+    assert threading.get_ident() not in handler.threads
+
+
+def test_writer_formats_in_background(logger, monkeypatch):
+    threads = set()
+    format = logging.Formatter.format
+
+    def recording_format(self, record):
+        threads.add(threading.get_ident())
+        return format(self, record)
+
+    monkeypatch.setattr(logging.Formatter, 'format', recording_format)
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    logger.addHandler(handler)
+
+    writer = QueueLogWriter(logger)
+    writer.start()
+    logger.info('Message %d', 1)
+    writer.stop()
+    handler.stream.close()
+
+    assert threads and threading.get_ident() not in threads
+
+
+def test_writer_drops_when_full(logger, mocker):
+    handler = RecordingHandler()
+    logger.addHandler(handler)
+
+    writer = QueueLogWriter(logger, max_queue=2)
+    writer.start()
+    # Keep the writer from consuming the queue
+    writer._stop_listener()
+
+    for i in range(5):
+        logger.info('Message %d', i)
+    assert writer.dropped == 3
+
+    writer.stop()
+
+
+@pytest.mark.skipif(
+    not hasattr(os, 'fork'), reason='fork is not available')
+def test_writer_after_fork(logger, tmpdir):
+    path = str(tmpdir.join('child.log'))
+    logger.addHandler(logging.FileHandler(path))
+
+    writer = QueueLogWriter(logger)
+    writer.start()
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            logger.info('From the child')
+            writer.stop()
+        finally:
+            os._exit(0)
+
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
+    writer.stop()
+
+    with open(path) as f:
+        assert f.read() == 'From the child\n'
@@ -147,3 +147,288 @@ async def test_dst_refused(tesla, unused_tcp_port_factory, mocker, event_loop):
     url = 'http://localhost:{}/index.html'.format(str(src_port))
     with pytest.raises(requests.exceptions.ConnectionError):
         await event_loop.run_in_executor(None, requests.get, url)
+
+
+def test_workers(tesla, mocker):
+    mocker.patch.object(tesla, '_create_server')
+    tesla.setup(args=['localhost', '80', 'etc/basic_rules.conf', '--workers=2'])
+
+    # servers are only created by the workers
+    tesla._create_server.assert_not_called()
+    assert tesla._supervisor is not None
+
+
+def test_create_servers_from_config(tesla, mocker, tmpdir):
+    mocker.patch.object(tesla, '_create_server')
+    config = tmpdir.join('config.toml')
+    config.write('\n'.join([
+        '[server.a]', 'port=8080', 'target="b"',
+        '[server.c]', 'port=8081', 'host="127.0.0.1"',
+        '[target.b]', 'host="10.0.0.1"', 'port=80',
+    ]))
+    tesla.setup(args=[
+        'localhost', '8090', 'etc/basic_rules.conf',
+        '--config=' + str(config)
+    ])
+
+    assert tesla._create_server.call_count == 2
+    tesla._create_server.assert_any_call(
+        '0.0.0.0', 8080, '10.0.0.1', 80,
+        proxy_creator_func=tesla._create_proxy,
+        name='a', use_ssl=False, cert='', key='')
+    # without a target the destination is used
+    tesla._create_server.assert_any_call(
+        '127.0.0.1', 8081, 'localhost', 8090,
+        proxy_creator_func=tesla._create_proxy,
+        name='c', use_ssl=False, cert='', key='')
+    assert len(tesla.servers) == 2
+
+
+@pytest.mark.asyncio
+async def test_config_listeners_share_rules(tesla, httpserver,
+                                            unused_tcp_port_factory, tmpdir,
+                                            event_loop):
+    httpserver.serve_content(b'ok', 200)
+    dst_port = httpserver.server_address[1]
+    ports = [unused_tcp_port_factory(), unused_tcp_port_factory()]
+
+    config = tmpdir.join('config.toml')
+    config.write('\n'.join(
+        '[server.s%d]\nport=%d\nhost="127.0.0.1"' % (i, port)
+        for i, port in enumerate(ports)))
+    tesla.setup(args=[
+        'localhost', str(dst_port), 'etc/basic_rules.conf',
+        '--config=' + str(config)
+    ])
+    rules = tesla._modsec_rules
+    for server in tesla.servers:
+        await server.ensure_serving()
+
+    for port in ports:
+        url = 'http://127.0.0.1:{}/index.html'.format(port)
+        out = await event_loop.run_in_executor(None, requests.get, url)
+        assert out.content == b'ok'
+
+    # one copy of the rules for every listener
+    assert tesla._modsec_rules is rules
+
+
+@pytest.mark.asyncio
+async def test_config_balanced_target(tesla, httpserver,
+                                      unused_tcp_port_factory, tmpdir,
+                                      event_loop):
+    httpserver.serve_content(b'ok', 200)
+    dst_port = httpserver.server_address[1]
+    src_port = unused_tcp_port_factory()
+    down_port = unused_tcp_port_factory()
+
+    config = tmpdir.join('config.toml')
+    config.write('\n'.join([
+        '[server.a]', 'port=%d' % src_port, 'host="127.0.0.1"',
+        'target="app"', '[target.app]',
+        'backends=["127.0.0.1:%d", "127.0.0.1:%d"]' % (down_port, dst_port),
+        'health_check_interval=0',
+    ]))
+    tesla.setup(args=[
+        'localhost', '80', 'etc/basic_rules.conf', '--config=' + str(config)
+    ])
+    await tesla.server.ensure_serving()
+
+    # the backend that is down is retried on the other one
+    url = 'http://127.0.0.1:{}/index.html'.format(src_port)
+    for _ in range(2):
+        out = await event_loop.run_in_executor(None, requests.get, url)
+        assert out.content == b'ok'
+
+    balancer = tesla.balancers['app']
+    down, up = balancer.backends
+    assert down.fails > 0
+    assert up.latency is not None
+
+
+def test_vhost_rule_sets(tesla, mocker, tmpdir):
+    mocker.patch.object(tesla, '_create_server')
+    config = tmpdir.join('config.toml')
+    config.write('\n'.join([
+        '[server.a]', 'port=8080',
+        '[rules.api]', 'files=["etc/basic_rules.conf"]',
+        '[vhost.api]', 'hosts=["api.example.com", "*.api.example.com"]',
+        'rules="api"',
+    ]))
+    tesla.setup(args=[
+        'localhost', '80', 'etc/basic_rules.conf', '--config=' + str(config)
+    ])
+
+    router = tesla._proxy_settings.router
+    route = router.lookup('v1.api.example.com')
+    assert route is router.lookup('api.example.com')
+    # rules are loaded once, the transactions share them
+    rules = tesla._rule_sets['api']
+    assert rules is not tesla._modsec_rules
+    create = mocker.patch('ModSecurity.Transaction')
+    route.transaction_factory()
+    route.transaction_factory()
+    assert [c[0][1] for c in create.call_args_list] == [rules, rules]
+    assert router.lookup('example.com') is None
+
+
+@pytest.mark.asyncio
+async def test_reload_rules(tesla, mocker, event_loop):
+    mocker.patch.object(tesla, '_create_server')
+    tesla.setup(args=['localhost', '80', 'etc/basic_rules.conf'])
+    previous = tesla._modsec_rules
+    running = tesla._create_transaction()
+
+    assert await tesla.reload_rules()
+    assert tesla._modsec_rules is not previous
+    assert tesla._rule_counts[tesla._modsec_rules] > 0
+    assert previous not in tesla._rule_counts
+    # the running transaction keeps its rules alive
+    assert tesla._rule_generations.stats() == {
+        'retired': 1,
+        'transactions': 1
+    }
+
+    create = mocker.patch('ModSecurity.Transaction')
+    tesla._create_transaction()
+    create.assert_called_once_with(tesla._modsec, tesla._modsec_rules)
+    del running
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('loaded', [-1, 0])
+async def test_reload_rules_invalid(tesla, mocker, event_loop, loaded):
+    mocker.patch.object(tesla, '_create_server')
+    tesla.setup(args=['localhost', '80', 'etc/basic_rules.conf'])
+    previous = tesla._modsec_rules
+
+    import ModSecurity
+    # a wrong file next to a good one
+    tesla.args.rule_set = ['etc/basic_rules.conf'] * 2
+    mocker.patch.object(
+        ModSecurity.Rules, 'loadFromUri', side_effect=[5, loaded])
+    assert not await tesla.reload_rules()
+    assert tesla._modsec_rules is previous
+
+
+@pytest.mark.asyncio
+async def test_reload_on_sighup(tesla, mocker, event_loop):
+    mocker.patch.object(tesla, '_create_server')
+    tesla.setup(args=['localhost', '80', 'etc/basic_rules.conf'])
+    mocker.patch.object(tesla, 'reload_rules')
+
+    tesla.reload()
+    # coalesced while a reload is running
+    tesla.reload()
+    await tesla._reload_task
+    tesla.reload_rules.assert_called_once_with()
+
+
+@pytest.mark.asyncio
+async def test_ip_table(tesla, mocker, tmpdir, event_loop):
+    mocker.patch.object(tesla, '_create_server')
+    deny = tmpdir.join('deny.txt')
+    deny.write('10.0.0.0/8\n')
+    allow = tmpdir.join('allow.txt')
+    allow.write('10.1.0.0/16\n')
+    trust = tmpdir.join('trust.txt')
+    trust.write('10.3.0.1\n')
+    tesla.setup(args=[
+        'localhost', '80', 'etc/basic_rules.conf',
+        '--deny-list=' + str(deny), '--allow-list=' + str(allow),
+        '--trust-list=' + str(trust)
+    ])
+
+    table = tesla._proxy_settings.ip_table
+    assert table.lookup('10.2.0.1') == table.DENY
+    assert table.lookup('10.1.0.1') == table.ALLOW
+    assert table.lookup('10.3.0.1') == table.TRUST
+
+    deny.write('10.0.0.0/8\n192.168.0.0/16\n')
+    assert await tesla.reload_ip_table()
+    assert tesla._proxy_settings.ip_table is not table
+    assert tesla._proxy_settings.ip_table.lookup('192.168.1.1') == table.DENY
+
+    # an invalid list keeps the current table
+    deny.write('nope\n')
+    table = tesla._proxy_settings.ip_table
+    assert not await tesla.reload_ip_table()
+    assert tesla._proxy_settings.ip_table is table
+
+
+def test_rate_limiter(tesla, mocker):
+    mocker.patch.object(tesla, '_create_server')
+    tesla.setup(args=['localhost', '80', 'etc/basic_rules.conf'])
+    assert tesla._proxy_settings.rate_limiter is None
+
+    tesla.setup(args=[
+        'localhost', '80', 'etc/basic_rules.conf', '--rate-limit=5',
+        '--rate-max-clients=10'
+    ])
+    limiter = tesla._proxy_settings.rate_limiter
+    assert (limiter.rate, limiter.burst) == (5.0, 5.0)
+
+
+@pytest.mark.parametrize('sinks, log_interventions', [
+    ('', True),
+    ('file,stdout', True),
+    ('file,elasticsearch', False),
+])
+def test_log_interventions(tesla, mocker, sinks, log_interventions):
+    mocker.patch.object(tesla, '_create_server')
+    tesla.setup(args=[
+        'localhost', '80', 'etc/basic_rules.conf', '--event-sinks=' + sinks
+    ])
+    settings = tesla._proxy_settings
+    assert settings.log_interventions == log_interventions
+    assert (tesla._create_exporter() is None) != log_interventions
+
+
+def test_log_timeouts(tesla, mocker):
+    mocker.patch.object(tesla, '_create_server')
+    tesla.setup(args=['localhost', '80', 'etc/basic_rules.conf'])
+    wheel = tesla._proxy_settings.timer_wheel
+    wheel.timeouts['header'] += 1
+
+    info = mocker.patch('tesla.main.log.info')
+    tesla._log_timeouts()
+    info.assert_called_once_with(
+        'Client timeouts', pending=0, timeouts={'header': 1})
+
+
+def test_admission(tesla, mocker):
+    from tesla.admission import RejectedConnection
+    from tesla.proxy import Proxy
+
+    mocker.patch.object(tesla, '_create_server')
+    tesla.setup(args=['localhost', '80', 'etc/basic_rules.conf'])
+    assert tesla._proxy_settings.admission is None
+
+    tesla.setup(args=[
+        'localhost', '80', 'etc/basic_rules.conf', '--max-connections=1',
+        '--max-in-flight=50', '--target-latency=0.2'
+    ])
+    admission = tesla._proxy_settings.admission
+    assert admission.limit == 50
+
+    assert isinstance(tesla._create_proxy('localhost', 80), Proxy)
+    admission.connection_opened()
+    rejected = tesla._create_proxy('localhost', 80)
+    assert isinstance(rejected, RejectedConnection)
+
+
+def test_response_policy(tesla, mocker):
+    mocker.patch.object(tesla, '_create_server')
+    # every response body is inspected unless asked otherwise
+    tesla.setup(args=['localhost', '80', 'etc/basic_rules.conf'])
+    assert tesla._proxy_settings.response_policy is None
+
+    tesla.setup(args=[
+        'localhost', '80', 'etc/basic_rules.conf',
+        '--inspect-response-types=default',
+        '--inspect-response-max-length=1024'
+    ])
+    policy = tesla._proxy_settings.response_policy
+    assert policy.max_length == 1024
+    assert not policy.should_inspect('image/png')
+    assert policy.should_inspect('text/html')
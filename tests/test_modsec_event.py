@@ -0,0 +1,111 @@
+import pytest
+
+from tesla.modsec_event import ModSecurityEvent
+
+LINE = (
+    '[client 127.0.0.1] ModSecurity: Warning. Matched "Operator `Rx\' with '
+    'parameter `^[\\d.:]+$\' against variable `REQUEST_HEADERS:Host\' '
+    '(Value: `127.0.0.1\' ) '
+    '[file "/etc/owasp-crs/rules/REQUEST-920-PROTOCOL-ENFORCEMENT.conf"] '
+    '[line "733"] [id "920350"] [rev "2"] '
+    '[msg "Host header is a numeric IP address"] [data "127.0.0.1"] '
+    '[severity "4"] [ver "OWASP_CRS/3.0.0"] [maturity "9"] [accuracy "9"] '
+    '[tag "application-multi"] [tag "attack-protocol"] '
+    '[hostname "127.0.0.1"] [uri "/"] [unique_id "153620.1"] '
+    '[ref "o0,9v21,9"]')
+
+
+def test_parse():
+    event = ModSecurityEvent.parse(LINE)
+
+    assert event.file == \
+        '/etc/owasp-crs/rules/REQUEST-920-PROTOCOL-ENFORCEMENT.conf'
+    assert event.line == 733
+    assert event.id == 920350
+    assert event.rev == '2'
+    assert event.msg == 'Host header is a numeric IP address'
+    assert event.data == '127.0.0.1'
+    assert event.severity == 4
+    assert event.maturity == 9
+    assert event.accuracy == 9
+    assert event.tags == ['application-multi', 'attack-protocol']
+    assert event.uri == '/'
+    assert event.unique_id == '153620.1'
+    assert event.ref == 'o0,9v21,9'
+    assert event.extra == {}
+
+
+def test_to_dict():
+    data = ModSecurityEvent.parse(LINE).to_dict()
+
+    assert data['id'] == 920350
+    assert data['tag'] == 'attack-protocol'
+    assert data['tags'] == ['application-multi', 'attack-protocol']
+    assert 'client' not in data
+
+
+@pytest.mark.parametrize('data', [
+    'Matched Data: <a href="x"> found',
+    'Matched Data: ["] found',
+    # Forces the slow path
+    'Matched Data: "] [xy found',
+])
+def test_parse_quoted_data(data):
+    line = ('ModSecurity: Access denied [file "/r/REQUEST-941.conf"] '
+            '[id "941100"] [data "%s"] [tag "attack-xss"] '
+            '[uri "/search"]' % data)
+
+    event = ModSecurityEvent.parse(line)
+    assert event.data == data
+    assert event.id == 941100
+    assert event.tags == ['attack-xss']
+    assert event.uri == '/search'
+
+
+def test_parse_tags_between_fields():
+    event = ModSecurityEvent.parse(
+        'ModSecurity: [file "/r/a.conf"] [tag "a"] [id "1"] [tag "b"] '
+        '[msg "say \\"hi\\" "] [tag "c"] [uri "/"]')
+
+    assert event.tags == ['a', 'b', 'c']
+    assert event.id == 1
+    assert event.uri == '/'
+    assert event.extra == {}
+    assert event.to_dict()['tag'] == 'c'
+
+
+def test_parse_value_with_quote():
+    event = ModSecurityEvent.parse(
+        'ModSecurity: [file "/r/a.conf"] [data "x "y" z"] [id "1"]')
+
+    assert event.data == 'x "y" z'
+    assert event.id == 1
+
+
+def test_parse_unknown_tags():
+    event = ModSecurityEvent.parse(
+        'ModSecurity: [file "/r/a.conf"] [line "x"] [custom "1"]')
+
+    assert event.line == 'x'
+    assert event.extra == {'custom': '1'}
+    assert event.tags == []
+    assert event.to_dict() == {'file': '/r/a.conf', 'line': 'x', 'custom': '1'}
+
+
+@pytest.mark.parametrize('line', [
+    '',
+    'ModSecurity: rules loaded',
+    '[client 127.0.0.1] ModSecurity: Warning. [id "1"]',
+])
+def test_parse_without_file(line):
+    assert ModSecurityEvent.parse(line) is None
+
+
+def test_corpus():
+    with open('tools/modsec_log_corpus.txt') as f:
+        for line in f:
+            event = ModSecurityEvent.parse(line.rstrip('\n'))
+            assert event.file.endswith('.conf')
+            assert isinstance(event.id, int)
+            assert event.tags
+            assert event.unique_id
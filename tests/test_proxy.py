@@ -1,6 +1,20 @@
+import asyncio
+
 import pytest
 
 import ModSecurity
+from tesla.admission import AdmissionControl
+from tesla.balancer import Backend, Balancer
+from tesla.inspection_policy import ResponseInspectionPolicy
+from tesla.ip_table import IpTable
+from tesla.proxy import Proxy
+from tesla.proxy_settings import ProxySettings
+from tesla.rate_limiter import RateLimiter
+from tesla.response_templates import ResponseTemplates
+from tesla.router import HostRouter, Route
+from tesla.tesla_exception import TeslaException
+from tesla.timer_wheel import TimerWheel
+from tesla.upstream_pool import UpstreamPool
 
 
 @pytest.mark.alloc
@@ -45,7 +59,21 @@ def test_on_request_header_after_url(mocker, proxy):
 
 
 def test_on_request_body(mocker, proxy):
-    body = '{"custom_data": "123b"}'
+    body = b'{"custom_data": "123b"}'
+
+    mocker.patch.object(proxy, 'send_to_target')
+    proxy.on_request_body(body)
+    # held until ModSecurity accepts the whole body
+    proxy.send_to_target.assert_not_called()
+
+    proxy.target_connection_made(mocker.Mock())
+    proxy.on_request_message_completed()
+    proxy.send_to_target.assert_called_once_with(body)
+
+
+def test_on_request_body_stream(mocker, proxy):
+    body = b'{"custom_data": "123b"}'
+    proxy._settings.body_policy = ProxySettings.BODY_STREAM
 
     mocker.patch.object(proxy, 'send_to_target')
     proxy.on_request_body(body)
@@ -125,6 +153,573 @@ async def test_tcp_data_received(proxy, dst_port, tcp_server, http_request,
     assert server_data == http_request
 
 
+@pytest.yield_fixture
+def keep_alive_proxy(log, modsecurity, modsecurity_rules, dst_port):
+    def factory():
+        return ModSecurity.Transaction(modsecurity, modsecurity_rules)
+
+    p = Proxy(
+        'localhost',
+        dst_port,
+        factory(),
+        transaction_factory=factory,
+        settings=ProxySettings(max_requests=2))
+    yield p
+    p.cleanup()
+
+
+@pytest.fixture
+def keep_alive_transports(mocker, keep_alive_proxy, transport_factory):
+    mocker.patch.object(keep_alive_proxy, '_create_target_connection')
+    mocker.patch.object(keep_alive_proxy, '_schedule_keep_alive_timeout')
+
+    client = transport_factory()
+    target = transport_factory()
+    keep_alive_proxy.connection_made(client)
+    keep_alive_proxy.target_connection_made(target)
+    return client, target
+
+
+def test_keep_alive(keep_alive_proxy, keep_alive_transports):
+    client, target = keep_alive_transports
+
+    keep_alive_proxy.data_received(b'GET /a HTTP/1.1\r\nHost: a\r\n\r\n')
+    first = keep_alive_proxy._transaction
+    keep_alive_proxy.target_data_received(
+        b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+
+    assert not client.close.called
+    keep_alive_proxy._schedule_keep_alive_timeout.assert_called_once_with()
+
+    keep_alive_proxy.data_received(b'GET /b HTTP/1.1\r\nHost: a\r\n\r\n')
+    assert keep_alive_proxy._transaction is not first
+    assert b'GET /b' in b''.join(target.data_in)
+
+
+@pytest.mark.parametrize('request_data', [
+    b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n',
+    b'GET / HTTP/1.0\r\nHost: a\r\n\r\n',
+])
+def test_keep_alive_disabled_by_request(keep_alive_proxy,
+                                        keep_alive_transports, request_data):
+    client, _ = keep_alive_transports
+
+    keep_alive_proxy.data_received(request_data)
+    keep_alive_proxy.target_data_received(
+        b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+
+    assert client.close.called
+
+
+def test_keep_alive_max_requests(keep_alive_proxy, keep_alive_transports):
+    client, _ = keep_alive_transports
+    response = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'
+
+    keep_alive_proxy.data_received(b'GET /a HTTP/1.1\r\nHost: a\r\n\r\n')
+    keep_alive_proxy.target_data_received(response)
+    assert not client.close.called
+
+    keep_alive_proxy.data_received(b'GET /b HTTP/1.1\r\nHost: a\r\n\r\n')
+    keep_alive_proxy.target_data_received(response)
+    assert client.close.called
+
+
+def test_keep_alive_timeout(keep_alive_proxy, keep_alive_transports):
+    client, _ = keep_alive_transports
+
+    keep_alive_proxy._on_keep_alive_timeout()
+    assert client.close.called
+
+
+def test_stream_request_body(keep_alive_proxy, keep_alive_transports):
+    _, target = keep_alive_transports
+    keep_alive_proxy._settings.body_policy = ProxySettings.BODY_STREAM
+
+    keep_alive_proxy.data_received(
+        b'POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\nhello')
+
+    # the body is forwarded before the request completes
+    assert b''.join(target.data_in).endswith(b'\r\n\r\nhello')
+
+
+def test_stream_chunked_request_body(keep_alive_proxy, keep_alive_transports):
+    _, target = keep_alive_transports
+    keep_alive_proxy._settings.body_policy = ProxySettings.BODY_STREAM
+
+    keep_alive_proxy.data_received(
+        b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+        b'5\r\nhello\r\n0\r\n\r\n')
+
+    assert b''.join(target.data_in).endswith(
+        b'\r\n\r\n5\r\nhello\r\n0\r\n\r\n')
+
+
+def test_backpressure_target_write(keep_alive_proxy, keep_alive_transports):
+    client, _ = keep_alive_transports
+
+    keep_alive_proxy.target_pause_writing()
+    client.pause_reading.assert_called_once_with()
+
+    keep_alive_proxy.target_resume_writing()
+    client.resume_reading.assert_called_once_with()
+
+
+def test_backpressure_client_write(keep_alive_proxy, keep_alive_transports):
+    _, target = keep_alive_transports
+
+    keep_alive_proxy.pause_writing()
+    target.pause_reading.assert_called_once_with()
+
+    keep_alive_proxy.resume_writing()
+    target.resume_reading.assert_called_once_with()
+
+
+def test_backpressure_soft_limit(mocker, log, modsecurity_transaction,
+                                 dst_port, transport_factory):
+    proxy = Proxy(
+        'localhost',
+        dst_port,
+        modsecurity_transaction,
+        settings=ProxySettings(buffer_soft_limit=4))
+    mocker.patch.object(proxy, '_create_target_connection')
+    client = transport_factory()
+    proxy.connection_made(client)
+
+    # the target is not connected yet, data waits in the buffer
+    proxy.data_received(b'POST / HTTP/1.1\r\nContent-Length: 5\r\n\r\n')
+    client.pause_reading.assert_called_once_with()
+
+    proxy.target_connection_made(transport_factory())
+    client.resume_reading.assert_called_once_with()
+    proxy.cleanup()
+
+
+def test_forward_request_head(keep_alive_proxy, keep_alive_transports):
+    _, target = keep_alive_transports
+    head = b'GET /a HTTP/1.1\r\nHost: a\r\nX-Custom:  value \r\n\r\n'
+
+    keep_alive_proxy.data_received(head[:20])
+    keep_alive_proxy.data_received(head[20:])
+
+    assert b''.join(target.data_in) == head
+
+
+def test_forward_request_head_without_headers(keep_alive_proxy,
+                                              keep_alive_transports):
+    _, target = keep_alive_transports
+    head = b'GET / HTTP/1.0\r\n\r\n'
+
+    keep_alive_proxy.data_received(head)
+
+    assert b''.join(target.data_in) == head
+
+
+@pytest.mark.parametrize('body_memory_limit', [1024, 4])
+def test_buffer_request_body(keep_alive_proxy, keep_alive_transports,
+                             body_memory_limit):
+    _, target = keep_alive_transports
+    keep_alive_proxy._settings.body_memory_limit = body_memory_limit
+    head = b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+
+    keep_alive_proxy.data_received(head + b'5\r\nhello\r\n')
+    assert b''.join(target.data_in) == head
+    assert keep_alive_proxy._body_spool.spilled == (body_memory_limit == 4)
+
+    keep_alive_proxy.data_received(b'6\r\n world\r\n0\r\n\r\n')
+    # chunks are framed again when the held body is forwarded
+    assert b''.join(target.data_in) == \
+        head + b'b\r\nhello world\r\n0\r\n\r\n'
+    assert keep_alive_proxy._pending_body is None
+
+
+def test_buffer_request_body_too_large(keep_alive_proxy,
+                                       keep_alive_transports):
+    client, target = keep_alive_transports
+    keep_alive_proxy._settings.body_max_length = 8
+    head = b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+
+    keep_alive_proxy.data_received(head + b'5\r\nhello\r\n')
+    assert not client.close.called
+
+    keep_alive_proxy.data_received(b'6\r\n world\r\n0\r\n\r\n')
+    assert b''.join(client.data_in) == ResponseTemplates.default().deny(413)
+    assert client.close.called
+    # the held part was never forwarded
+    assert b''.join(target.data_in) == head
+
+
+def test_buffer_request_body_backpressure(keep_alive_proxy,
+                                          keep_alive_transports):
+    _, target = keep_alive_transports
+    head = b'POST / HTTP/1.1\r\nContent-Length: 5\r\n\r\n'
+
+    keep_alive_proxy.target_pause_writing()
+    keep_alive_proxy.data_received(head + b'hello')
+    assert b''.join(target.data_in) == head
+
+    keep_alive_proxy.target_resume_writing()
+    assert b''.join(target.data_in) == head + b'hello'
+
+
+@pytest.mark.parametrize('content_type, inspected', [
+    (b'text/html', True),
+    (b'image/png', False),
+])
+def test_response_inspection_policy(mocker, keep_alive_proxy,
+                                    keep_alive_transports, content_type,
+                                    inspected):
+    client, _ = keep_alive_transports
+    keep_alive_proxy._settings.response_policy = ResponseInspectionPolicy()
+    mocker.spy(keep_alive_proxy, '_pass_through_to_client')
+
+    keep_alive_proxy.data_received(b'GET / HTTP/1.1\r\nHost: a\r\n\r\n')
+    keep_alive_proxy.target_data_received(
+        b'HTTP/1.1 200 OK\r\nContent-Type: ' + content_type +
+        b'\r\nContent-Length: 4\r\n\r\nbody')
+
+    assert keep_alive_proxy._pass_through_to_client.called != inspected
+    assert b''.join(client.data_in).endswith(b'\n\nbody')
+
+
+def test_proxy_releases_backend(mocker, proxy):
+    balancer = Balancer([Backend('127.0.0.1', 80)])
+    backend = balancer.backends[0]
+    backend.active = 1
+    proxy._balancer = balancer
+    proxy._backend = backend
+
+    proxy.target_connection_lost(None)
+    assert backend.active == 0
+    # only once
+    proxy.connection_lost(None)
+    assert backend.active == 0
+
+
+
+@pytest.mark.asyncio
+async def test_client_left_while_acquiring(log, mocker, dst_port, tcp_server,
+                                           transport_factory):
+    await tcp_server.listen('127.0.0.1', dst_port)
+    pool = UpstreamPool(max_total=1)
+    p = Proxy('127.0.0.1', dst_port, mocker.Mock(),
+              settings=ProxySettings(upstream_pool=pool))
+
+    p.connection_made(transport_factory())
+    p.connection_lost(None)
+    await asyncio.sleep(0.1)
+
+    # the connection does not hold the only slot of the pool
+    assert pool.stats()['total'] == 0
+    target = await asyncio.wait_for(
+        pool.acquire('127.0.0.1', dst_port, p), 1)
+    target.close()
+    pool.close()
+
+
+@pytest.fixture
+def routed_proxy(log, mocker, modsecurity, modsecurity_rules,
+                 transport_factory):
+    def factory():
+        return ModSecurity.Transaction(modsecurity, modsecurity_rules)
+
+    api_factory = mocker.Mock(side_effect=factory)
+    router = HostRouter()
+    router.add('*.example.com',
+               Route('api', api_factory, dst_host='api', dst_port=8080))
+
+    p = Proxy(
+        'localhost',
+        80,
+        factory(),
+        transaction_factory=factory,
+        settings=ProxySettings(router=router))
+    mocker.patch.object(p, '_create_target_connection')
+    mocker.patch.object(p, '_schedule_keep_alive_timeout')
+    p.connection_made(transport_factory())
+    yield p, api_factory
+    p.cleanup()
+
+
+def test_route_by_host(routed_proxy, transport_factory):
+    proxy, api_factory = routed_proxy
+    # the target is only known with the Host header
+    proxy._create_target_connection.assert_not_called()
+
+    proxy.data_received(b'GET /a HTTP/1.1\r\nHost: v1.example.com\r\n\r\n')
+    assert api_factory.call_count == 1
+    # later requests start on the rules of the route
+    assert proxy._transaction_factory is api_factory
+    assert (proxy._dst_host, proxy._dst_port) == ('api', 8080)
+    proxy._create_target_connection.assert_called_once_with()
+
+    target = transport_factory()
+    proxy.target_connection_made(target)
+    assert b''.join(target.data_in).startswith(b'GET /a HTTP/1.1')
+    proxy.target_data_received(
+        b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+
+    # same route, the next transaction already uses its rules
+    proxy.data_received(b'GET /b HTTP/1.1\r\nHost: v2.example.com\r\n\r\n')
+    assert api_factory.call_count == 2
+    assert proxy._create_target_connection.call_count == 1
+
+
+def test_route_default(routed_proxy):
+    proxy, api_factory = routed_proxy
+
+    proxy.data_received(b'GET /a HTTP/1.1\r\nHost: example.org\r\n\r\n')
+    api_factory.assert_not_called()
+    assert (proxy._dst_host, proxy._dst_port) == ('localhost', 80)
+    proxy._create_target_connection.assert_called_once_with()
+
+
+
+def test_ip_table_deny(log, mocker, transport_factory):
+    table = IpTable()
+    table.add('127.0.0.0/8')
+    factory = mocker.Mock()
+    p = Proxy(
+        'localhost',
+        80,
+        None,
+        transaction_factory=factory,
+        settings=ProxySettings(ip_table=table))
+    mocker.patch.object(p, '_create_target_connection')
+
+    client = transport_factory()
+    p.connection_made(client)
+
+    # denied before any transaction
+    factory.assert_not_called()
+    p._create_target_connection.assert_not_called()
+    assert b''.join(client.data_in).startswith(b'HTTP/1.1 403')
+    assert client.close.called
+    p.cleanup()
+
+
+def test_ip_table_trust(log, mocker, transport_factory):
+    table = IpTable()
+    table.add('127.0.0.0/8', IpTable.DENY)
+    table.add('127.0.0.1', IpTable.TRUST)
+    factory = mocker.Mock()
+    p = Proxy(
+        'localhost',
+        80,
+        None,
+        transaction_factory=factory,
+        settings=ProxySettings(
+            ip_table=table, rate_limiter=RateLimiter(1, burst=1)))
+    mocker.patch.object(p, '_create_target_connection')
+
+    client, target = transport_factory(), transport_factory()
+    p.connection_made(client)
+    p.target_connection_made(target)
+
+    # tunneled as is, without any transaction
+    request = b'GET / HTTP/1.1\r\nHost: a\r\n\r\nGET /b HTTP/1.1\r\n\r\n'
+    p.data_received(request)
+    p.target_data_received(b'HTTP/1.1 200 OK\r\n')
+    factory.assert_not_called()
+    assert b''.join(target.data_in) == request
+    assert b''.join(client.data_in) == b'HTTP/1.1 200 OK\r\n'
+
+    p.target_connection_lost(None)
+    assert client.close.called
+    p.cleanup()
+
+
+def test_lazy_transaction(log, mocker, modsecurity, modsecurity_rules,
+                          transport_factory):
+    factory = mocker.Mock(
+        side_effect=lambda: ModSecurity.Transaction(modsecurity,
+                                                    modsecurity_rules))
+    table = IpTable()
+    table.add('10.0.0.0/8')
+    p = Proxy(
+        'localhost',
+        80,
+        None,
+        transaction_factory=factory,
+        settings=ProxySettings(ip_table=table))
+    mocker.patch.object(p, '_create_target_connection')
+    factory.assert_not_called()
+
+    p.connection_made(transport_factory())
+    factory.assert_called_once_with()
+    p._create_target_connection.assert_called_once_with()
+    p.cleanup()
+
+
+def test_proxy_without_transaction(log):
+    with pytest.raises(TeslaException):
+        Proxy('localhost', 80, None)
+
+
+
+def test_rate_limit_connections(log, mocker, modsecurity, modsecurity_rules,
+                                transport_factory):
+    def factory():
+        return ModSecurity.Transaction(modsecurity, modsecurity_rules)
+
+    settings = ProxySettings(rate_limiter=RateLimiter(1, burst=1))
+    clients = []
+    for _ in range(2):
+        p = Proxy('localhost', 80, None, factory, settings=settings)
+        mocker.patch.object(p, '_create_target_connection')
+        client = transport_factory()
+        p.connection_made(client)
+        clients.append(client)
+        p.cleanup()
+
+    assert not clients[0].close.called
+    assert b''.join(clients[1].data_in).startswith(b'HTTP/1.1 429')
+    assert clients[1].close.called
+
+
+def test_rate_limit_requests(keep_alive_proxy, keep_alive_transports):
+    client, target = keep_alive_transports
+    limiter = RateLimiter(1, burst=1)
+    keep_alive_proxy._settings.rate_limiter = limiter
+    # taken by connection_made
+    assert limiter.allow(keep_alive_proxy._client_host)
+
+    keep_alive_proxy.data_received(b'GET /a HTTP/1.1\r\nHost: a\r\n\r\n')
+    keep_alive_proxy.target_data_received(
+        b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+    assert not client.close.called
+
+    keep_alive_proxy.data_received(b'GET /b HTTP/1.1\r\nHost: a\r\n\r\n')
+    assert b'GET /b' not in b''.join(target.data_in)
+    assert b''.join(client.data_in).endswith(
+        ResponseTemplates.default().deny(429))
+    assert client.close.called
+
+
+@pytest.mark.asyncio
+async def test_admission_queue(log, mocker, modsecurity, modsecurity_rules,
+                               transport_factory):
+    def factory():
+        return ModSecurity.Transaction(modsecurity, modsecurity_rules)
+
+    admission = AdmissionControl(
+        max_connections=10, max_in_flight=1, queue_size=1)
+    settings = ProxySettings(admission=admission)
+    proxies = []
+    for _ in range(3):
+        p = Proxy('localhost', 80, None, factory, settings=settings)
+        mocker.patch.object(p, '_create_target_connection')
+        mocker.patch.object(p, '_schedule_keep_alive_timeout')
+        client, target = transport_factory(), transport_factory()
+        p.connection_made(client)
+        p.target_connection_made(target)
+        proxies.append((p, client, target))
+    assert admission.connections == 3
+
+    for p, _, _ in proxies:
+        p.data_received(b'GET / HTTP/1.1\r\nHost: a\r\n\r\n')
+
+    (first, _, first_target), (second, second_client, second_target), \
+        (third, third_client, _) = proxies
+    assert b'GET /' in b''.join(first_target.data_in)
+    # waits without being parsed nor read
+    assert second_target.data_in == []
+    assert second_client.pause_reading.called
+    # nothing else may wait
+    assert b''.join(third_client.data_in).startswith(b'HTTP/1.1 503')
+    assert third_client.close.called
+
+    first.target_data_received(
+        b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+    await asyncio.sleep(0)
+    assert b'GET /' in b''.join(second_target.data_in)
+    assert second_client.resume_reading.called
+    assert admission.in_flight == 1
+
+    for p, _, _ in proxies:
+        p.connection_lost(None)
+        p.cleanup()
+    assert admission.stats()['connections'] == 0
+    assert admission.in_flight == 0
+
+
+@pytest.yield_fixture
+def timeout_proxy(log, mocker, modsecurity, modsecurity_rules,
+                  transport_factory):
+    def factory():
+        return ModSecurity.Transaction(modsecurity, modsecurity_rules)
+
+    wheel = TimerWheel(resolution=0.01)
+    settings = ProxySettings(
+        idle_timeout=0.05,
+        header_timeout=0.05,
+        body_timeout=0.05,
+        request_timeout=0.2,
+        timer_wheel=wheel)
+    p = Proxy('localhost', 80, None, factory, settings=settings)
+    mocker.patch.object(p, '_create_target_connection')
+    client, target = transport_factory(), transport_factory()
+    p.connection_made(client)
+    p.target_connection_made(target)
+    yield p, client, target
+    p.cleanup()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('request_data, timeout', [
+    (b'', 'idle'),
+    (b'GET / HTTP/1.1\r\nHost: a\r\n', 'header'),
+    (b'POST / HTTP/1.1\r\nHost: a\r\nContent-Length: 9\r\n\r\nab',
+     'body'),
+])
+async def test_read_timeout(timeout_proxy, request_data, timeout):
+    proxy, client, _ = timeout_proxy
+
+    proxy.data_received(request_data)
+    await asyncio.sleep(0.1)
+
+    assert b''.join(client.data_in) == ResponseTemplates.default().deny(408)
+    assert client.close.called
+    assert proxy._timer_wheel.timeouts == {timeout: 1}
+
+
+@pytest.mark.asyncio
+async def test_request_timeout(timeout_proxy):
+    proxy, client, _ = timeout_proxy
+
+    proxy.data_received(
+        b'POST / HTTP/1.1\r\nHost: a\r\nContent-Length: 99\r\n\r\n')
+    # a trickled body beats the body timeout, not the request one
+    for _ in range(10):
+        await asyncio.sleep(0.03)
+        proxy.data_received(b'a')
+        if client.close.called:
+            break
+
+    assert b''.join(client.data_in) == ResponseTemplates.default().deny(408)
+    assert proxy._timer_wheel.timeouts == {'request': 1}
+
+
+@pytest.mark.asyncio
+async def test_no_timeout_awaiting_response(timeout_proxy):
+    proxy, client, target = timeout_proxy
+
+    proxy.data_received(b'GET / HTTP/1.1\r\nHost: a\r\n\r\n')
+    await asyncio.sleep(0.1)
+    assert not client.close.called
+    assert len(proxy._timer_wheel) == 0
+
+    proxy.target_data_received(
+        b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+    assert proxy._deadline.name == 'keep_alive'
+
+    # an idle keep-alive connection closing is not a client timeout
+    wheel = proxy._timer_wheel
+    wheel.move(proxy._deadline, wheel.time())
+    await asyncio.sleep(0.03)
+    assert client.close.called
+    assert wheel.timeouts == {}
+
+
 if __name__ == '__main__':
     import sys
     sys.exit(pytest.main(args=['-m', 'new']))
@@ -1,6 +1,8 @@
 import pytest
 
 import ModSecurity
+from tesla.proxy import Proxy
+from tesla.proxy_settings import ProxySettings
 
 
 @pytest.fixture(params=[True, False])
@@ -21,7 +23,6 @@ def test_intervention_disruptive_connection_made(
 @pytest.mark.parametrize('method,method_args', [
     ('on_request_header', ['Connection', 'Close']),
     ('on_request_headers_complete', []),
-    ('on_request_body', [b'hello world']),
 ])
 def test_intervention_disruptive_request_method(
         proxy, mocker, transport_factory, disruptive, method, method_args):
@@ -33,6 +34,20 @@ def test_intervention_disruptive_request_method(
     assert not proxy.send_to_target.called == disruptive
 
 
+def test_intervention_disruptive_request_body(proxy, mocker,
+                                              transport_factory, disruptive):
+    mocker.patch.object(
+        proxy, '_process_intervention', return_value=disruptive)
+    mocker.patch.object(proxy, 'send_to_target')
+    proxy.target_connection_made(transport_factory())
+
+    proxy.on_request_body(b'hello world')
+    proxy.send_to_target.assert_not_called()
+
+    proxy.on_request_message_completed()
+    assert not proxy.send_to_target.called == disruptive
+
+
 @pytest.mark.parametrize('method,method_args', [
     ('on_response_header', ['Connection', 'Close']),
     ('on_response_headers_complete', []),
@@ -47,3 +62,36 @@ def test_intervention_disruptive_response_method(
 
     getattr(proxy, method)(*method_args)
     assert not proxy.send_to_client.called == disruptive
+
+
+def test_intervention_phase_mode(mocker, log, modsecurity, modsecurity_rules,
+                                 dst_port, transport_factory):
+    request = b'GET / HTTP/1.1\r\nHost: a\r\nAccept: */*\r\nX-A: 1\r\n\r\n'
+    response = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nX-B: 2\r\n\r\nok'
+    checks = {}
+    outputs = {}
+
+    for mode in ProxySettings.INTERVENTION_MODES:
+        proxy = Proxy(
+            'localhost',
+            dst_port,
+            ModSecurity.Transaction(modsecurity, modsecurity_rules),
+            settings=ProxySettings(intervention_mode=mode))
+        mocker.patch.object(proxy, '_create_target_connection')
+        mocker.spy(proxy, '_process_intervention')
+        client = transport_factory()
+        target = transport_factory()
+
+        proxy.connection_made(client)
+        proxy.target_connection_made(target)
+        proxy.data_received(request)
+        proxy.target_data_received(response)
+        proxy.cleanup()
+
+        checks[mode] = proxy._process_intervention.call_count
+        outputs[mode] = (b''.join(target.data_in), b''.join(client.data_in))
+
+    header, phase = ProxySettings.INTERVENTION_MODES
+    assert outputs[header] == outputs[phase]
+    # uri + 3 request headers + status + 2 response headers
+    assert checks[header] - checks[phase] == 7
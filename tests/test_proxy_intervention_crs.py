@@ -2,6 +2,7 @@ import pytest
 
 import ModSecurity
 from tesla.proxy import Proxy
+from tesla.response_templates import ResponseTemplates
 
 
 def test_intervention_disruptive_connection_made(
@@ -27,15 +28,11 @@ def test_intervention_disruptive_request_url(mocker, proxy, modsecurity_rules,
 
     mocker.patch.object(proxy, 'send_to_target')
 
-    # This is really a limitation of httptools
-    # We can only add pending parsed url after adding a header
-    # although we make sure to check for interventions on the uri
-    # before processing parsed header
+    # The request head is only forwarded once ModSecurity accepted it
     proxy.data_received(b'GET /attack.php HTTP/1.1\n')
     proxy.data_received(b'Connection: Close\n\n')
 
-    assert proxy.send_to_target.call_count == 2
-    proxy.send_to_target.reset_mock()
+    proxy.send_to_target.assert_not_called()
 
     proxy.on_request_headers_complete()
 
@@ -55,8 +52,7 @@ def test_intervention_disruptive_request_header(
     proxy.data_received(b'GET /index.html HTTP/1.1\n')
     proxy.data_received(b'User-Agent: nikto\n\n')
 
-    assert proxy.send_to_target.call_count == 2
-    proxy.send_to_target.reset_mock()
+    proxy.send_to_target.assert_not_called()
 
     proxy.on_request_headers_complete()
 
@@ -77,9 +73,9 @@ def test_intervention_disruptive_request_body(mocker, proxy, modsecurity_rules,
 
     proxy.data_received(http_request_with_body)
 
-    # request line + 10 headers + \n
+    # the whole head at once
     # do not call body
-    assert proxy.send_to_target.call_count == 12
+    assert proxy.send_to_target.call_count == 1
 
 
 def test_intervention_disruptive_response_status(
@@ -100,9 +96,7 @@ def test_intervention_disruptive_response_status(
     # Finish response headers
     proxy.target_data_received(b'\n')
 
-    f = open('etc/templates/403.txt', mode='r')
-    forbidden_template = f.read()
-    f.close()
+    forbidden_template = ResponseTemplates.default().deny(403)
 
     proxy.send_to_client.assert_called_once_with(
         forbidden_template, overwrite=True)
@@ -130,9 +124,7 @@ def test_intervention_disruptive_response_header(
     # Finish response headers
     proxy.on_response_headers_complete()
     
-    f = open('etc/templates/403.txt', mode='r')
-    forbidden_template = f.read()
-    f.close()
+    forbidden_template = ResponseTemplates.default().deny(403)
 
     proxy.send_to_client.assert_called_once_with(
         forbidden_template, overwrite=True)
@@ -155,9 +147,7 @@ def test_intervention_disruptive_response_body(
     # do not call body
     assert proxy.send_to_client.call_count == 7
 
-    f = open('etc/templates/403.txt', mode='r')
-    forbidden_template = f.read()
-    f.close()
+    forbidden_template = ResponseTemplates.default().deny(403)
 
     proxy.send_to_client.assert_called_with(
         forbidden_template, overwrite=True)
@@ -0,0 +1,92 @@
+import pytest
+
+from tesla.rate_limiter import RateLimiter
+from tesla.tesla_exception import TeslaException
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_burst_then_rate(clock):
+    limiter = RateLimiter(2, burst=3, clock=clock)
+
+    assert [limiter.allow('a') for _ in range(4)] == [True] * 3 + [False]
+    # other clients have their own bucket
+    assert limiter.allow('b')
+
+    clock.now += 0.5
+    assert limiter.allow('a')
+    assert not limiter.allow('a')
+
+    # refilled up to the burst only
+    clock.now += 60
+    assert [limiter.allow('a') for _ in range(4)] == [True] * 3 + [False]
+    assert limiter.stats() == {
+        'allowed': 8,
+        'limited': 3,
+        'clients': 2,
+        'evicted': 0,
+        'resets': 0,
+    }
+
+
+def test_default_burst(clock):
+    assert RateLimiter(10, clock=clock).burst == 10
+    assert RateLimiter(0.5, clock=clock).burst == 1
+
+
+def test_lru_eviction(clock):
+    limiter = RateLimiter(1, burst=1, max_clients=2, clock=clock)
+    assert limiter.allow('a')
+    assert limiter.allow('b')
+    assert not limiter.allow('a')
+
+    # b is the least recently seen
+    assert limiter.allow('c')
+    assert len(limiter) == 2
+    assert limiter.evicted == 1
+    assert not limiter.allow('a')
+    # forgotten, it comes back with a full bucket
+    assert limiter.allow('b')
+    assert limiter.resets == 2
+
+    # a full bucket lost nothing
+    clock.now += 10
+    assert limiter.allow('d')
+    assert limiter.stats()['resets'] == 2
+
+
+def test_client_key(clock):
+    limiter = RateLimiter(1, burst=1, clock=clock)
+    first = limiter.client_key('2001:db8:1:2::1')
+    assert first == limiter.client_key('2001:db8:1:2:ffff::9')
+    assert first != limiter.client_key('2001:db8:1:3::1')
+    assert limiter.client_key('10.0.0.1') == '10.0.0.1'
+    assert limiter.client_key('::ffff:10.0.0.1') == '10.0.0.1'
+    assert limiter.client_key('not:an address') == 'not:an address'
+
+    # a host rotating addresses in its /64 shares one bucket
+    assert limiter.allow(limiter.client_key('2001:db8:1:2::1'))
+    assert not limiter.allow(limiter.client_key('2001:db8:1:2::2'))
+
+    limiter = RateLimiter(1, clock=clock, ipv6_prefix=128)
+    assert limiter.client_key('2001:db8::1') != \
+        limiter.client_key('2001:db8::2')
+
+
+@pytest.mark.parametrize('rate, max_clients, ipv6_prefix',
+                         [(0, 10, 64), (-1, 10, 64), (1, 0, 64), (1, 10, 0),
+                          (1, 10, 129)])
+def test_invalid(rate, max_clients, ipv6_prefix):
+    with pytest.raises(TeslaException):
+        RateLimiter(rate, max_clients=max_clients, ipv6_prefix=ipv6_prefix)
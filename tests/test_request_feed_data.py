@@ -45,4 +45,5 @@ def test_request_feed_data_on_body(proxy, mocker, http_request_with_body):
     proxy._request_parser.feed_data(http_request_with_body)
 
     assert stub.call_count == 1
-    assert proxy.send_to_target.call_count == 13
+    # the body waits for the target connection
+    assert proxy.send_to_target.call_count == 12
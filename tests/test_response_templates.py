@@ -0,0 +1,75 @@
+import pytest
+
+from tesla.response_templates import ResponseTemplates
+
+
+@pytest.fixture
+def templates_dir(tmpdir):
+    tmpdir.join('403.txt').write(
+        'HTTP/1.1 $status $reason\n'
+        'Content-Type: text/html\n'
+        'Content-Length: 999\n\n'
+        '<h1>$reason</h1>')
+    tmpdir.join('302.txt').write(
+        'HTTP/1.1 $status $reason\n'
+        'Location: $url\n\n'
+        '<a href="$url">$url</a>')
+    return tmpdir
+
+
+def test_deny(templates_dir):
+    templates = ResponseTemplates(str(templates_dir))
+
+    response = templates.deny()
+    assert response == (b'HTTP/1.1 403 Forbidden\r\n'
+                        b'Content-Type: text/html\r\n'
+                        b'Content-Length: 18\r\n'
+                        b'Connection: close\r\n\r\n'
+                        b'<h1>Forbidden</h1>')
+    # Rendered once
+    assert templates.deny(403) is response
+    assert templates.deny(429).startswith(b'HTTP/1.1 429 Too Many Requests')
+    assert templates.deny(599).startswith(b'HTTP/1.1 599 Unknown')
+
+
+def test_redirect(templates_dir):
+    templates = ResponseTemplates(str(templates_dir))
+
+    response = templates.redirect('/login?a=1&b=2', 301)
+    head, body = response.split(b'\r\n\r\n')
+    assert head.split(b'\r\n') == [
+        b'HTTP/1.1 301 Moved Permanently',
+        b'Location: /login?a=1&b=2',
+        b'Content-Length: %d' % len(body),
+        b'Connection: close',
+    ]
+    assert body == b'<a href="/login?a=1&amp;b=2">/login?a=1&amp;b=2</a>'
+    assert templates.redirect('/login?a=1&b=2', 301) is response
+
+    # Not a redirection status
+    assert templates.redirect('/', 200).startswith(b'HTTP/1.1 302 Found')
+    # Never break the head
+    head, _ = templates.redirect('/\r\nX-Evil: 1').split(b'\r\n\r\n')
+    assert b'\r\nX-Evil' not in head
+
+
+def test_reload(templates_dir):
+    templates = ResponseTemplates(str(templates_dir))
+    assert templates.deny().endswith(b'<h1>Forbidden</h1>')
+
+    templates_dir.join('403.txt').write('HTTP/1.1 $status $reason\n\nNo')
+    templates.reload()
+    assert templates.deny().endswith(b'\r\n\r\nNo')
+
+    templates_dir.join('403.txt').remove()
+    with pytest.raises(IOError):
+        templates.reload()
+    # Previous templates are kept
+    assert templates.deny().endswith(b'\r\n\r\nNo')
+
+
+def test_default():
+    templates = ResponseTemplates.default()
+    assert ResponseTemplates.default() is templates
+    assert templates.deny().startswith(b'HTTP/1.1 403 Forbidden\r\n')
+    assert b'Location: /x\r\n' in templates.redirect('/x')
@@ -0,0 +1,48 @@
+import pytest
+
+from tesla.router import HostRouter, Route
+from tesla.tesla_exception import TeslaException
+
+
+@pytest.fixture
+def router():
+    router = HostRouter()
+    router.add('example.com', Route('root'))
+    router.add('*.example.com', Route('any'))
+    router.add('*.api.example.com', Route('api'))
+    router.add('Www.Example.com.', Route('www'))
+    return router
+
+
+@pytest.mark.parametrize('host, expected', [
+    ('example.com', 'root'),
+    (b'example.com:8080', 'root'),
+    ('EXAMPLE.COM.', 'root'),
+    ('www.example.com', 'www'),
+    ('a.example.com', 'any'),
+    ('a.b.example.com', 'any'),
+    ('v1.api.example.com', 'api'),
+    ('a.v1.api.example.com', 'api'),
+    # the wildcard does not match the domain itself
+    ('api.example.com', 'any'),
+    ('example.org', None),
+    ('badexample.com', None),
+    ('', None),
+    (None, None),
+])
+def test_lookup(router, host, expected):
+    route = router.lookup(host)
+    assert (route.name if route is not None else None) == expected
+
+
+def test_lookup_ipv6():
+    router = HostRouter()
+    router.add('::1', Route('local'))
+    assert router.lookup('[::1]:8080').name == 'local'
+    assert router.lookup('::1').name == 'local'
+
+
+@pytest.mark.parametrize('pattern', ['', '*.', 'a.*.com', '*', 'example.com'])
+def test_invalid_pattern(router, pattern):
+    with pytest.raises(TeslaException):
+        router.add(pattern, Route('invalid'))
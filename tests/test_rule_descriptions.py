@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from tesla.rule_descriptions import RuleDescriptions
+
+
+@pytest.fixture
+def descriptions_path(tmpdir):
+    path = tmpdir.join('descriptions.txt')
+    path.write('REQUEST-941-APPLICATION-ATTACK-XSS|XSS attack\n'
+               'REQUEST-942-APPLICATION-ATTACK-SQLI|SQL injection attack\n'
+               '\n'
+               'invalid line\n')
+    return str(path)
+
+
+def test_lookup(descriptions_path):
+    descriptions = RuleDescriptions(descriptions_path)
+
+    assert len(descriptions) == 2
+    assert descriptions.lookup(
+        '/etc/owasp-crs/rules/REQUEST-942-APPLICATION-ATTACK-SQLI.conf') == \
+        'SQL injection attack'
+    assert descriptions.lookup('REQUEST-941-APPLICATION-ATTACK-XSS.conf') == \
+        'XSS attack'
+    assert descriptions.lookup('/etc/modsecurity.conf') is None
+    assert descriptions.lookup(None) is None
+
+
+def test_lookup_substring(descriptions_path, mocker):
+    descriptions = RuleDescriptions(descriptions_path)
+    rule_file = '/etc/custom/my-REQUEST-941-APPLICATION-ATTACK-XSS.conf'
+
+    assert descriptions.lookup(rule_file) == 'XSS attack'
+    # Remembered
+    mocker.patch.object(descriptions, '_index', {})
+    assert descriptions.lookup(rule_file) == 'XSS attack'
+
+
+def test_reload_if_changed(descriptions_path):
+    descriptions = RuleDescriptions(descriptions_path)
+    assert not descriptions.reload_if_changed()
+
+    with open(descriptions_path, 'a') as f:
+        f.write('REQUEST-930-APPLICATION-ATTACK-LFI|LFI attack\n')
+    mtime = os.stat(descriptions_path).st_mtime + 1
+    os.utime(descriptions_path, (mtime, mtime))
+
+    assert descriptions.reload_if_changed()
+    assert descriptions.lookup('REQUEST-930-APPLICATION-ATTACK-LFI.conf') == \
+        'LFI attack'
+
+    os.remove(descriptions_path)
+    assert not descriptions.reload_if_changed()
+    assert len(descriptions) == 3
+
+
+def test_shipped_descriptions():
+    descriptions = RuleDescriptions()
+    assert descriptions.lookup(
+        '/etc/owasp-crs/rules/RESPONSE-980-CORRELATION.conf') == 'Correlation'
@@ -0,0 +1,52 @@
+import gc
+
+from tesla.rule_generations import RuleGenerations
+
+
+class Transaction(object):
+    pass
+
+
+class Rules(object):
+    pass
+
+
+def test_retired_rules_kept_while_used():
+    generations = RuleGenerations()
+    rules = Rules()
+    first = Transaction()
+    second = Transaction()
+    generations.track(first, rules)
+    generations.track(second, rules)
+
+    generations.retire(rules)
+    assert generations.stats() == {'retired': 1, 'transactions': 2}
+
+    del first
+    gc.collect()
+    assert generations.stats() == {'retired': 1, 'transactions': 1}
+
+    del second
+    gc.collect()
+    assert generations.stats() == {'retired': 0, 'transactions': 0}
+
+
+def test_unused_rules_not_kept():
+    generations = RuleGenerations()
+    rules = Rules()
+    transaction = Transaction()
+    generations.track(transaction, rules)
+    del transaction
+    gc.collect()
+
+    generations.retire(rules)
+    assert generations.stats()['retired'] == 0
+
+
+def test_untrackable_transactions():
+    generations = RuleGenerations()
+    rules = Rules()
+    # no weak references to ints
+    generations.track(1, rules)
+    generations.retire(rules)
+    assert generations.stats()['retired'] == 1
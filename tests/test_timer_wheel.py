@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import pytest
+
+from tesla.timer_wheel import TimerWheel
+
+
+@pytest.mark.asyncio
+async def test_fire(mocker):
+    wheel = TimerWheel(resolution=0.01)
+    first = mocker.Mock()
+    second = mocker.Mock()
+
+    wheel.call_later(0.01, first, 'first')
+    wheel.call_later(0.2, second, 'second')
+    assert len(wheel) == 2
+
+    await asyncio.sleep(0.05)
+    first.assert_called_once_with()
+    second.assert_not_called()
+    assert wheel.stats() == {'pending': 1, 'timeouts': {}}
+
+
+@pytest.mark.asyncio
+async def test_cancel_and_move(mocker):
+    wheel = TimerWheel(resolution=0.01)
+    cancelled = mocker.Mock()
+    moved = mocker.Mock()
+
+    timer = wheel.call_later(0.01, cancelled)
+    timer.cancel()
+    assert not timer.pending
+    # cancelling twice is harmless
+    timer.cancel()
+
+    timer = wheel.call_later(0.01, moved, 'idle')
+    wheel.move(timer, wheel.time() + 0.1, 'header')
+    await asyncio.sleep(0.05)
+    moved.assert_not_called()
+    assert timer.pending
+
+    wheel.move(timer, wheel.time())
+    await asyncio.sleep(0.03)
+    moved.assert_called_once_with()
+    cancelled.assert_not_called()
+    assert len(wheel) == 0
+    assert timer.name == 'header'
+
+
+@pytest.mark.asyncio
+async def test_callback_error(mocker):
+    wheel = TimerWheel(resolution=0.01)
+    called = mocker.Mock()
+
+    wheel.call_later(0, mocker.Mock(side_effect=ValueError()))
+    wheel.call_later(0, called)
+    await asyncio.sleep(0.03)
+    called.assert_called_once_with()
+
+    # the wheel starts again with new timers
+    wheel.call_later(0, called)
+    await asyncio.sleep(0.03)
+    assert called.call_count == 2
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.asyncio
+async def test_never_early(mocker):
+    clock = Clock()
+    wheel = TimerWheel(resolution=0.5, clock=clock)
+    fired = mocker.Mock()
+
+    wheel.call_later(1.0, fired)
+    for now in (100.7, 100.99):
+        clock.now = now
+        wheel._run()
+        fired.assert_not_called()
+
+    clock.now = 101.5
+    wheel._run()
+    fired.assert_called_once_with()
+
+
+@pytest.mark.asyncio
+async def test_never_early_real_clock():
+    wheel = TimerWheel(resolution=0.01)
+    early = []
+
+    def check(deadline):
+        if time.monotonic() < deadline:
+            early.append(deadline)
+
+    for i in range(50):
+        timer = wheel.call_later(i * 0.0007, None)
+        timer.callback = (lambda deadline=timer.deadline: check(deadline))
+    await asyncio.sleep(0.1)
+    assert len(wheel) == 0
+    assert early == []
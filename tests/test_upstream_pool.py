@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from tesla.upstream_pool import UpstreamPool
+
+
+@pytest.fixture
+def parent(mocker):
+    return mocker.Mock(
+        spec=[
+            'target_connection_made', 'target_connection_lost',
+            'target_data_received'
+        ])
+
+
+@pytest.mark.asyncio
+async def test_acquire_release(parent, dst_port, tcp_server):
+    await tcp_server.listen('127.0.0.1', dst_port)
+    pool = UpstreamPool()
+
+    target = await pool.acquire('127.0.0.1', dst_port, parent)
+    assert pool.misses == 1
+    assert parent.target_connection_made.call_count == 1
+
+    pool.release(target)
+    assert pool.stats()['idle'] == 1
+
+    reused = await pool.acquire('127.0.0.1', dst_port, parent)
+    assert reused is target
+    assert pool.hits == 1
+    assert pool.stats()['reuse_ratio'] == 0.5
+    assert parent.target_connection_made.call_count == 2
+
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_release_max_idle(parent, dst_port, tcp_server):
+    await tcp_server.listen('127.0.0.1', dst_port)
+    pool = UpstreamPool(max_idle=1)
+
+    first = await pool.acquire('127.0.0.1', dst_port, parent)
+    second = await pool.acquire('127.0.0.1', dst_port, parent)
+    pool.release(first)
+    pool.release(second)
+
+    assert pool.stats()['idle'] == 1
+    assert second.transport is None or second.transport.is_closing()
+
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_acquire_max_total(parent, dst_port, tcp_server):
+    await tcp_server.listen('127.0.0.1', dst_port)
+    pool = UpstreamPool(max_total=1)
+
+    target = await pool.acquire('127.0.0.1', dst_port, parent)
+    pending = asyncio.ensure_future(
+        pool.acquire('127.0.0.1', dst_port, parent))
+    await asyncio.sleep(0.01)
+    assert not pending.done()
+
+    pool.release(target)
+    assert await pending is target
+
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_acquire_skips_expired(parent, dst_port, tcp_server):
+    await tcp_server.listen('127.0.0.1', dst_port)
+    pool = UpstreamPool(idle_timeout=0.01)
+
+    target = await pool.acquire('127.0.0.1', dst_port, parent)
+    pool.release(target)
+    await asyncio.sleep(0.02)
+
+    fresh = await pool.acquire('127.0.0.1', dst_port, parent)
+    assert fresh is not target
+    assert pool.misses == 2
+
+    pool.close()
@@ -0,0 +1,36 @@
+import os
+import signal
+import time
+
+from tesla.workers import WorkerSupervisor
+
+
+def test_supervisor_stop(log):
+    def target(worker_id):
+        os.kill(os.getppid(), signal.SIGTERM)
+        time.sleep(5)
+        return 0
+
+    handler = signal.getsignal(signal.SIGTERM)
+    supervisor = WorkerSupervisor(2, target, restart_delay=0)
+
+    assert supervisor.run() == 0
+    assert not supervisor.workers
+    assert signal.getsignal(signal.SIGTERM) == handler
+
+
+def test_supervisor_restart(log, tmpdir):
+    started = tmpdir.join('started')
+
+    def target(worker_id):
+        with open(str(started), 'a') as f:
+            f.write('x')
+        if len(started.read()) >= 3:
+            os.kill(os.getppid(), signal.SIGTERM)
+            time.sleep(5)
+        return 1
+
+    supervisor = WorkerSupervisor(1, target, restart_delay=0)
+
+    assert supervisor.run() == 0
+    assert len(started.read()) >= 3
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the `header` and `phase` intervention modes of the proxy.
+
+Usage: python tools/bench_interventions.py [rule files...]
+(defaults to etc/basic_rules.conf)
+"""
+import hashlib
+import sys
+import time
+
+import ModSecurity
+from tesla.proxy import Proxy
+from tesla.proxy_settings import ProxySettings
+
+REQUEST = (b'GET /index.html?id=5 HTTP/1.1\r\n'
+           b'Host: localhost:8080\r\n'
+           b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:61.0)\r\n'
+           b'Accept: text/html,application/xhtml+xml,application/xml\r\n'
+           b'Accept-Language: en-US,en;q=0.5\r\n'
+           b'Accept-Encoding: gzip, deflate\r\n'
+           b'Cookie: _ga=GA1.1.2018935373.1535217505\r\n'
+           b'Connection: keep-alive\r\n'
+           b'Upgrade-Insecure-Requests: 1\r\n\r\n')
+
+RESPONSE = (b'HTTP/1.1 200 OK\r\n'
+            b'Content-Type: text/html; charset=UTF-8\r\n'
+            b'Referrer-Policy: no-referrer\r\n'
+            b'Date: Wed, 05 Sep 2018 20:56:09 GMT\r\n'
+            b'Content-Length: 5\r\n\r\nHello')
+
+
+class CountingTransaction(object):
+    def __init__(self, transaction):
+        self._transaction = transaction
+        self.crossings = 0
+
+    def intervention(self, intervention):
+        self.crossings += 1
+        return self._transaction.intervention(intervention)
+
+    def __getattr__(self, name):
+        return getattr(self._transaction, name)
+
+
+class NullTransport(object):
+    def __init__(self):
+        # The bytes written, compared between the modes
+        self.digest = hashlib.sha256()
+
+    def get_extra_info(self, key):
+        return ('127.0.0.1', 9090)
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.digest.update(data)
+
+    def writelines(self, data):
+        for d in data:
+            self.write(d)
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+def run(modsec, rules, mode, requests):
+    settings = ProxySettings(intervention_mode=mode)
+    crossings = 0
+    output = hashlib.sha256()
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        transaction = CountingTransaction(ModSecurity.Transaction(
+            modsec, rules))
+        proxy = Proxy('localhost', 80, transaction, settings=settings)
+        proxy._create_target_connection = lambda: None
+        client = NullTransport()
+        target = NullTransport()
+
+        proxy.connection_made(client)
+        proxy.target_connection_made(target)
+        proxy.data_received(REQUEST)
+        proxy.target_data_received(RESPONSE)
+        proxy.cleanup()
+
+        crossings += transaction.crossings
+        output.update(client.digest.digest())
+        output.update(target.digest.digest())
+    elapsed = time.perf_counter() - start
+
+    return crossings / requests, elapsed / requests * 1e6, output.hexdigest()
+
+
+def main(args):
+    modsec = ModSecurity.ModSecurity()
+    rules = ModSecurity.Rules()
+    for path in args or ['etc/basic_rules.conf']:
+        rules.loadFromUri(path)
+
+    requests = 2000
+    results = {}
+    for mode in ProxySettings.INTERVENTION_MODES:
+        results[mode] = run(modsec, rules, mode, requests)
+        print('{:>6}: {:5.1f} crossings/request {:8.1f} us/request'.format(
+            mode, results[mode][0], results[mode][1]))
+
+    header, phase = ProxySettings.INTERVENTION_MODES
+    assert results[header][2] == results[phase][2], 'output differs'
+    print('saved {:.1f} crossings/request'.format(results[header][0] -
+                                                  results[phase][0]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measure how many ModSecurity log lines per second are tokenized.
+
+Usage: python tools/bench_modsec_parser.py [corpus file]
+(defaults to tools/modsec_log_corpus.txt, CRS 3 alerts)
+"""
+import re
+import sys
+import time
+
+from tesla.modsec_event import ModSecurityEvent
+
+LINES = 200000
+
+
+def legacy_parse(item):
+    '''
+    Tokenizer of ModSecurityParser.parse before ModSecurityEvent
+    '''
+    items = {}
+
+    line = item.strip()
+    start_msg_modsec = line.find("ModSecurity:")
+    end_msg_modesec = line.find("[file")
+    line_without_msg = line[:start_msg_modsec] + line[end_msg_modesec:]
+    split = re.findall("\[.*?\]", line_without_msg)
+
+    if ("[\\d.:]" in split):
+        split.remove("[\\d.:]")
+
+    for item in split:
+        item = item.replace("[", "")
+        item = item.replace("]", "")
+
+        tag = item.split(" ")
+        tag_name = tag[0]
+
+        item = re.findall(r'"([^"]*)"', item)
+        try:
+            if (item[0] is not None):
+                items[tag_name] = item[0]
+        except:
+            pass
+
+    return items
+
+
+def run(parse, corpus):
+    lines = (corpus * (LINES // len(corpus) + 1))[:LINES]
+
+    start = time.perf_counter()
+    for line in lines:
+        parse(line)
+    elapsed = time.perf_counter() - start
+
+    return LINES / elapsed
+
+
+def main(args):
+    path = args[0] if args else 'tools/modsec_log_corpus.txt'
+    with open(path) as f:
+        corpus = [line.rstrip('\n') for line in f if 'ModSecurity' in line]
+
+    for line in corpus:
+        event = ModSecurityEvent.parse(line)
+        assert event is not None and event.file, line
+        assert event.id == int(legacy_parse(line)['id']), line
+
+    results = {}
+    for name, parse in (('legacy', legacy_parse),
+                        ('event', ModSecurityEvent.parse),
+                        ('event+dict',
+                         lambda l: ModSecurityEvent.parse(l).to_dict())):
+        results[name] = run(parse, corpus)
+        print('{:>10}: {:10.0f} lines/s'.format(name, results[name]))
+
+    print('speedup {:.1f}x'.format(results['event'] / results['legacy']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))